@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark the single-pass info parser against the regular expression parser
+it replaced.
+
+Example:
+    $ python bench_info_parser.py --repeat=200
+"""
+from __future__ import(absolute_import, division, generators,
+                       print_function, unicode_literals)
+
+import sys
+import os
+from os.path import pardir, sep
+import re
+import argparse
+import tempfile
+import timeit
+sys.path.append(os.path.realpath(os.path.dirname(os.path.realpath(__file__)) +
+                                 sep + pardir))
+from voxelmod.virtual_family.virtual_population import (
+    parseVirtualPopulationInfo)
+
+# Regular expressions of the previous parser.
+MAT_PROG = re.compile(r"(^[0-9]+)\s([0|0.[0-9]*|1])\s([0|0.[0-9]*|1])\s([0|0.[0-9]*|1])\s([a-zA-Z0-9_/]*)")
+NXYZ_PROG = re.compile(r"^n([xyz])\s([0-9]*)")
+DXYZ_PROG = re.compile(r"^d([xyz])\s([0-9.]*)")
+
+def parse_info_regex(info_file):
+    """Previous readVirtualPopulation metadata loop: three matches per line."""
+    materials = []
+    grid = {}
+    with open(info_file, 'r') as file_handle:
+        for line in file_handle:
+            m_mat = re.match(MAT_PROG, line)
+            m_nxyz = re.match(NXYZ_PROG, line)
+            m_dxyz = re.match(DXYZ_PROG, line)
+            if m_mat:
+                materials.append((m_mat.group(5), float(m_mat.group(2)),
+                                  float(m_mat.group(3)),
+                                  float(m_mat.group(4))))
+            elif m_nxyz:
+                grid['n' + m_nxyz.group(1)] = int(m_nxyz.group(2))
+            elif m_dxyz:
+                grid['d' + m_dxyz.group(1)] = float(m_dxyz.group(2))
+    return materials, grid
+
+def write_info_file(file_name, num_materials):
+    """Write a synthetic info file with the given number of materials."""
+    with open(file_name, 'w') as file_handle:
+        for index in range(1, num_materials + 1):
+            file_handle.write('{0}\t0.5\t0.25\t1.0\tModel/Tissue_{0}\n'
+                              .format(index))
+        file_handle.write('\nGrid extent (number of cells)\n'
+                          'nx\t600\nny\t350\nnz\t1900\n'
+                          '\nSpatial steps [m]\n'
+                          'dx\t0.001\ndy\t0.001\ndz\t0.001\n')
+
+def main(argv):
+    """Time both parsers on synthetic info files."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--repeat', type=int, default=200,
+                        help='parses per timing (default 200)')
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        for num_materials in (77, 255, 4000):
+            info_file = os.path.join(work_dir,
+                                     'model_{0}.txt'.format(num_materials))
+            write_info_file(info_file, num_materials)
+            assert parse_info_regex(info_file) == \
+                parseVirtualPopulationInfo(info_file)
+            regex_time = min(timeit.repeat(
+                lambda: parse_info_regex(info_file),
+                number=args.repeat, repeat=3)) / args.repeat
+            token_time = min(timeit.repeat(
+                lambda: parseVirtualPopulationInfo(info_file),
+                number=args.repeat, repeat=3)) / args.repeat
+            print("{0:5d} materials: regex {1:8.1f} us  "
+                  "tokenizer {2:8.1f} us  speedup {3:4.1f}x".format(
+                      num_materials, 1e6 * regex_time, 1e6 * token_time,
+                      regex_time / token_time))
+            os.remove(info_file)
+    finally:
+        os.rmdir(work_dir)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
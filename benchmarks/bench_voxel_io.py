@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Benchmark the read, reduce, write and transform paths on synthetic models.
+
+Synthetic whole-body models are generated at 5 mm, 2 mm and 1 mm resolution
+with the 77 materials of the test fixture.  Every benchmark case reports
+its best time of --repeat runs, its throughput in voxels/s and MB/s of label
+data, and its peak Python heap use (measured by tracemalloc in a separate,
+untimed run).  Results can be saved as a baseline JSON file and later runs
+compared against it.
+
+Example:
+    $ python bench_voxel_io.py --scales=5,2 --save
+    $ python bench_voxel_io.py --scales=5,2 --tolerance=0.2
+"""
+from __future__ import(absolute_import, division, generators,
+                       print_function, unicode_literals)
+
+import sys
+import os
+from os.path import pardir, sep
+import argparse
+import contextlib
+import json
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+import numpy
+sys.path.append(os.path.realpath(os.path.dirname(os.path.realpath(__file__)) +
+                                 sep + pardir))
+from voxelmod.virtual_family import (readVirtualPopulation,
+                                     readVirtualPopulationInfo,
+                                     writeVirtualPopulation,
+                                     writeVirtualPopulationInfo,
+                                     writeChunkedVirtualPopulation,
+                                     readChunkedVirtualPopulation,
+                                     computeMaterialStatistics,
+                                     RunLengthVoxelData,
+                                     ReduceVoxel,
+                                     StreamReduceVoxel,
+                                     BatchReduceVoxel,
+                                     TissueProperties)
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+TEST_DIR = os.path.realpath(BENCH_DIR + sep + pardir + sep + 'test')
+FIXTURE_INFO_FILE = TEST_DIR + sep + 'full_materials.txt'
+MAP_FILE = TEST_DIR + sep + 'material_map_4.txt'
+PROPERTY_FILE = TEST_DIR + sep + 'tissue_properties_4.txt'
+DEFAULT_BASELINE = BENCH_DIR + sep + 'baseline.json'
+
+# Grid spacings of the synthetic models, in mm.
+SCALES_MM = (5, 2, 1)
+# Extent (x, y, z) of the synthetic body box, in m.
+BODY_EXTENT = (0.5, 0.3, 1.8)
+# Number of tissue shells across the body cross-section.
+NUM_SHELLS = 12
+
+def write_synthetic_model(work_dir, scale_mm):
+    """
+    Write a synthetic model with the fixture's materials: an elliptic body
+    cross-section, varying along z, filled with nested tissue shells.  The
+    data file is written one z-slice at a time.
+
+    Returns:
+        tuple: (info file, data file, number of voxels).
+    """
+    model = readVirtualPopulationInfo(FIXTURE_INFO_FILE)
+    model.name = 'Synthetic_{0}mm'.format(scale_mm)
+    step = scale_mm / 1000.0
+    (model.nx, model.ny, model.nz) = [int(round(extent / step))
+                                      for extent in BODY_EXTENT]
+    (model.dx, model.dy, model.dz) = (step, step, step)
+    info_file = os.path.join(work_dir, model.name + '.txt')
+    data_file = os.path.join(work_dir, model.name + '.raw')
+    writeVirtualPopulationInfo(model, info_file)
+
+    num_tissues = model.numMaterials - 1
+    x = numpy.linspace(-1.0, 1.0, model.nx)[numpy.newaxis, :]
+    y = numpy.linspace(-1.0, 1.0, model.ny)[:, numpy.newaxis]
+    with open(data_file, 'wb') as file_handle:
+        for z in range(model.nz):
+            height = z / max(1, model.nz - 1)
+            # Narrower at the head and the feet than at the torso.
+            scale = 0.55 + 0.4 * numpy.sin(numpy.pi * height)
+            radius = numpy.sqrt((x / scale) ** 2 + (y / (0.8 * scale)) ** 2)
+            shell = (radius * NUM_SHELLS).astype(numpy.int64)
+            labels = 1 + (shell * 7 + int(height * 23)) % num_tissues
+            labels[radius >= 1.0] = 0
+            file_handle.write(labels.astype(numpy.uint8).tobytes())
+    return (info_file, data_file, model.nx * model.ny * model.nz)
+
+def read_mapped(info_file, data_file):
+    """Memory-map a model read-only and touch every page of its data."""
+    model = readVirtualPopulation(info_file, data_file, mmapMode='r')
+    return int(model.array.max())
+
+def read_chunked(model, chunk_dir):
+    """Read back the chunked files written for model in chunk_dir."""
+    file_name = os.path.join(chunk_dir, model.name)
+    return readChunkedVirtualPopulation(file_name + '.txt',
+                                        file_name + '.vxc').data
+
+def relabel_mapped(info_file, data_file, relabel):
+    """Apply relabel to a read-only mapped model, leaving the file as is."""
+    model = readVirtualPopulation(info_file, data_file, mmapMode='r')
+    relabel(model)
+    return model
+
+def benchmark_cases(info_file, data_file, work_dir):
+    """
+    Returns (name, function) pairs of the benchmarked operations on the
+    model in info_file and data_file.
+    """
+    source = readVirtualPopulation(info_file, data_file)
+    stream_dir = os.path.join(work_dir, 'stream')
+    if not os.path.isdir(stream_dir):
+        os.mkdir(stream_dir)
+    write_dir = os.path.join(work_dir, 'write')
+    if not os.path.isdir(write_dir):
+        os.mkdir(write_dir)
+    chunk_dir = os.path.join(work_dir, 'chunked')
+    if not os.path.isdir(chunk_dir):
+        os.mkdir(chunk_dir)
+    writeChunkedVirtualPopulation(source, chunk_dir)
+    middle = [(n // 4, 3 * n // 4) for n in (source.nx, source.ny, source.nz)]
+    return [
+        ('read', lambda: readVirtualPopulation(info_file, data_file)),
+        ('read_mmap', lambda: read_mapped(info_file, data_file)),
+        ('reduce_translate', lambda: ReduceVoxel(MAP_FILE, source)),
+        ('reduce_numpy', lambda: ReduceVoxel(MAP_FILE, source,
+                                             backend='numpy')),
+        ('reduce_numpy_threads', lambda: ReduceVoxel(
+            MAP_FILE, source, backend='numpy', workers=os.cpu_count())),
+        ('batch_reduce_3', lambda: BatchReduceVoxel([MAP_FILE] * 3, source)),
+        ('stream_reduce', lambda: StreamReduceVoxel(
+            MAP_FILE, readVirtualPopulation(info_file, data_file, lazy=True),
+            data_file, stream_dir, name='stream')),
+        ('write', lambda: writeVirtualPopulation(source, write_dir)),
+        ('write_chunked',
+         lambda: writeChunkedVirtualPopulation(source, chunk_dir)),
+        ('read_chunked', lambda: read_chunked(source, chunk_dir)),
+        ('resample_2x', lambda: source.resample(2)),
+        ('sub_region', lambda: source.subRegion(*middle)),
+        ('flip_x', lambda: source.flip('x')),
+        ('trim_free_space', lambda: source.trimFreeSpace(2)),
+        ('merge_materials', lambda: relabel_mapped(
+            info_file, data_file, lambda model: model.mergeMaterials(
+                ['Skull', 'Mandible', 'Vertebrae'], 'Bone'))),
+        ('remove_material', lambda: relabel_mapped(
+            info_file, data_file,
+            lambda model: model.removeMaterial('Heart_muscle'))),
+        ('material_statistics',
+         lambda: computeMaterialStatistics(source.array,
+                                           source.numMaterials)),
+        ('run_length_encode',
+         lambda: RunLengthVoxelData.fromArray(source.array)),
+        ('tissue_sigma', lambda: TissueProperties(
+            PROPERTY_FILE, source, MAP_FILE).volume('sigma')),
+    ]
+
+def run_case(function, repeat):
+    """
+    Returns (best seconds of repeat runs, peak traced bytes of one run).
+    Output printed by the operation is discarded.
+    """
+    with open(os.devnull, 'w') as devnull, \
+         contextlib.redirect_stdout(devnull):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+        tracemalloc.start()
+        try:
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return (min(times), peak)
+
+def compare(results, baseline, tolerance):
+    """
+    Returns (scale, case, ratio) of every case that is more than tolerance
+    slower than in the baseline.
+    """
+    regressions = []
+    for (scale, cases) in results['scales'].items():
+        for (case, result) in cases.items():
+            reference = baseline.get('scales', {}).get(scale, {}).get(case)
+            if reference is None:
+                continue
+            ratio = result['seconds'] / reference['seconds']
+            if ratio > 1.0 + tolerance:
+                regressions.append((scale, case, ratio))
+    return regressions
+
+def main(argv):
+    """Generate the synthetic models, time every case and compare."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--scales', default=','.join(str(scale) for scale
+                                                     in SCALES_MM),
+                        help='comma separated grid spacings in mm '
+                             '(default 5,2,1)')
+    parser.add_argument('--cases', default=None,
+                        help='comma separated case names (default all)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed runs per case (default 3)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help='baseline JSON file (default '
+                             'benchmarks/baseline.json)')
+    parser.add_argument('--save', action='store_true',
+                        help='save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown against the baseline '
+                             '(default 0.25)')
+    args = parser.parse_args(argv)
+    selected = args.cases.split(',') if args.cases else None
+
+    results = {'python': platform.python_version(),
+               'numpy': numpy.__version__,
+               'machine': platform.machine(),
+               'scales': {}}
+    work_dir = tempfile.mkdtemp()
+    try:
+        for scale in args.scales.split(','):
+            scale_mm = float(scale) if '.' in scale else int(scale)
+            (info_file, data_file, num_voxels) = write_synthetic_model(
+                work_dir, scale_mm)
+            num_bytes = os.path.getsize(data_file)
+            print("{0} mm: {1} voxels".format(scale, num_voxels))
+            scale_results = results['scales'][scale] = {}
+            for (case, function) in benchmark_cases(info_file, data_file,
+                                                    work_dir):
+                if selected is not None and case not in selected:
+                    continue
+                (seconds, peak) = run_case(function, args.repeat)
+                scale_results[case] = {
+                    'seconds': seconds,
+                    'voxels_per_s': num_voxels / seconds,
+                    'mb_per_s': num_bytes / seconds / 1e6,
+                    'peak_mb': peak / 1e6}
+                print("  {0:22s} {1:9.4f} s  {2:9.1f} Mvoxel/s  "
+                      "{3:9.1f} MB/s  peak {4:8.1f} MB".format(
+                          case, seconds, num_voxels / seconds / 1e6,
+                          num_bytes / seconds / 1e6, peak / 1e6))
+            os.remove(info_file)
+            os.remove(data_file)
+    finally:
+        shutil.rmtree(work_dir)
+
+    status = 0
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, 'r') as file_handle:
+            baseline = json.load(file_handle)
+        regressions = compare(results, baseline, args.tolerance)
+        for (scale, case, ratio) in regressions:
+            print("REGRESSION {0} mm {1}: {2:.2f}x baseline time".format(
+                scale, case, ratio))
+        if regressions:
+            status = 1
+        else:
+            print("No regressions against " + args.baseline)
+    if args.save:
+        with open(args.baseline, 'w') as file_handle:
+            json.dump(results, file_handle, indent=2, sort_keys=True)
+        print("Saved baseline " + args.baseline)
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+"""
+Apply a chain of operations to every Virtual Population model in a
+directory tree, using every core.
+
+Example:
+    $ python run_batch.py /data/models --config=chain.json --workers=8
+
+    chain.json: {"operations": [["reduce", {"mapFile": "material_map_4.txt"}],
+                                ["crop", {"padding": 2}],
+                                ["export", {"outputDir": "/data/reduced"}]]}
+"""
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+
+import sys
+import argparse
+import json
+import logging
+from voxelmod import virtual_family as voxelmod
+
+def main(argv):
+    """Run an operation chain from a JSON file over a model library."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('rootDir', help='root of the model library')
+    parser.add_argument('--config', required=True,
+                        help='JSON file with an "operations" list')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--memory-limit', type=int, default=None,
+                        help='memory limit per worker, in MB')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    with open(args.config, 'r') as fileHandle:
+        operations = json.load(fileHandle)['operations']
+    memoryLimit = None if args.memory_limit is None else \
+        args.memory_limit << 20
+    report = voxelmod.runBatch(args.rootDir, operations, args.workers,
+                               memoryLimit)
+    print(report.summary())
+    return 1 if report.failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
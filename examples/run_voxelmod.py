@@ -7,7 +7,7 @@ from __future__ import (absolute_import, division,
 
 import sys, os.path, ntpath
 import re
-import voxelmod
+from voxelmod import virtual_family as voxelmod
 import matplotlib.pyplot as plt
 
 def isDuke(fileName):
@@ -49,39 +49,33 @@ mInfo = re.match(VOXEL_MODEL_FILE_NAME_RE, fileName)
 newVoxelInfoFileName = mInfo.group(1) + fileDesc + mInfo.group(2) + ".txt"
 newVoxelDataFileName = mInfo.group(1) + fileDesc + mInfo.group(2) + ".raw"
 
-# create voxel metadata info from file
-origVoxelInfo = voxelmod.VoxelInfo()
-origVoxelInfo.loadVoxelInfo(voxelInfoFileName)
-origVoxelInfo.printVoxelInfo()
-
-# load voxelData based off of voxel metadata
-origVoxelData = voxelmod.VoxelData(origVoxelInfo)
-origVoxelData.loadVoxelData(voxelDataFileName)
+# load voxel model; the data file is memory-mapped until it is cropped
+origVoxel = voxelmod.readVirtualPopulation(voxelInfoFileName,
+                                           voxelDataFileName, mmapMode='r')
 if isDuke(voxelInfoFileName):
     print("Voxel Image is 'Duke'")
-    origVoxelData.flipZ()
-origVoxelData.voxelDataSubRegion((0,origVoxelInfo.nx),
-                                 (0,origVoxelInfo.ny),
-                                 (0,int(dataFraction*origVoxelInfo.nz)))
+    origVoxel = origVoxel.flipZ()
+newVoxel = origVoxel.subRegion((0, origVoxel.nx),
+                               (0, origVoxel.ny),
+                               (0, int(dataFraction*origVoxel.nz)))
+newVoxel.name = os.path.splitext(newVoxelInfoFileName)[0]
 
-origVoxelData.plotVoxelData()
+plt.imshow(newVoxel.array[:, newVoxel.ny // 2, :], origin='lower')
+plt.show()
 
 #prompt for save?
 while True:
-    save_choice = raw_input('Save the voxel data? (y/n): ')
+    save_choice = input('Save the voxel data? (y/n): ')
     if save_choice == 'y':
-        origVoxelData.saveVoxelInfo(newVoxelInfoFileName)
-        origVoxelData.saveVoxelData(newVoxelDataFileName)
+        voxelmod.writeVirtualPopulation(newVoxel, os.getcwd())
 
         # check the results for consistency
         if plotSaved:
-            newVoxelInfo = voxelmod.VoxelInfo()
-            newVoxelInfo.loadVoxelInfo(newVoxelInfoFileName)
-            newVoxelInfo.printVoxelInfo()
-
-            newVoxelData = voxelmod.VoxelData(newVoxelInfo)
-            newVoxelData.loadVoxelData(newVoxelDataFileName)
-            newVoxelData.plotVoxelData()
+            savedVoxel = voxelmod.readVirtualPopulation(newVoxelInfoFileName,
+                                                        newVoxelDataFileName)
+            plt.imshow(savedVoxel.array[:, savedVoxel.ny // 2, :],
+                       origin='lower')
+            plt.show()
 
         break
 
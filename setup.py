@@ -6,5 +6,6 @@ from setuptools import setup
 setup(
     name='voxelmod',
     version='1.0',
-    py_modules=['voxelmod']
+    py_modules=['voxelmod'],
+    install_requires=['numpy']
 )
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Test atomic, buffered file writing.
+"""
+
+from __future__ import(absolute_import, division, generators,
+                       print_function, unicode_literals)
+
+import sys, os
+from os.path import pardir, sep
+import unittest
+from unittest import mock
+import errno
+import tempfile
+import shutil
+import numpy
+sys.path.append(os.path.realpath(os.path.dirname(os.path.realpath(__file__)) +
+                                 sep + pardir))
+from voxelmod.virtual_family import (readVirtualPopulation,
+                                     writeVirtualPopulation)
+from voxelmod.virtual_family.atomic_file import (atomicWrite, byteView,
+                                                 writeBuffer)
+
+class TestAtomicFile(unittest.TestCase):
+    """Tests for atomic replacement and zero-copy buffer writes."""
+    @classmethod
+    def setUpClass(cls):
+        testDir = os.path.dirname(os.path.realpath(__file__))
+        cls.infoFile = testDir + sep + 'full_materials.txt'
+        cls.dataFile = testDir + sep + 'full_materials.raw'
+
+    def setUp(self):
+        self.outputDir = tempfile.mkdtemp()
+        self.fileName = self.outputDir + sep + 'target.raw'
+
+    def tearDown(self):
+        shutil.rmtree(self.outputDir)
+
+    def testFailedWriteKeepsTarget(self):
+        """An exception inside the block leaves the old file in place."""
+        with atomicWrite(self.fileName) as fileHandle:
+            fileHandle.write(b'old')
+        with self.assertRaises(RuntimeError):
+            with atomicWrite(self.fileName) as fileHandle:
+                fileHandle.write(b'new, but incomplete')
+                raise RuntimeError("crash")
+        self.assertEqual(['target.raw'], os.listdir(self.outputDir))
+        with open(self.fileName, 'rb') as fileHandle:
+            self.assertEqual(b'old', fileHandle.read())
+
+    def testPreallocatedWriteIsTruncated(self):
+        """A preallocated file ends where the data ends."""
+        with atomicWrite(self.fileName, size=1 << 16) as fileHandle:
+            fileHandle.write(b'x' * 100)
+        self.assertEqual(100, os.path.getsize(self.fileName))
+
+    def testWriteBuffer(self):
+        """Buffers and arrays are written as their raw bytes."""
+        wide = numpy.arange(12, dtype='<u2').reshape(3, 4)
+        self.assertEqual(24, byteView(wide).nbytes)
+        for data in (wide, wide[:, ::2], memoryview(bytearray(b'abc'))):
+            with atomicWrite(self.fileName, sync=True) as fileHandle:
+                written = writeBuffer(fileHandle, data, chunkBytes=5)
+            with open(self.fileName, 'rb') as fileHandle:
+                expected = numpy.ascontiguousarray(data).tobytes() \
+                    if isinstance(data, numpy.ndarray) else bytes(data)
+                self.assertEqual(expected, fileHandle.read())
+            self.assertEqual(len(expected), written)
+
+    def testWriteVirtualPopulationDefaultPath(self):
+        """The default output directory is the current one at call time."""
+        voxel = readVirtualPopulation(self.infoFile, self.dataFile,
+                                      mmapMode='r')
+        cwd = os.getcwd()
+        os.chdir(self.outputDir)
+        try:
+            self.assertEqual(0, writeVirtualPopulation(voxel,
+                                                       preallocate=True))
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(sorted([voxel.name + '.raw', voxel.name + '.txt']),
+                         sorted(os.listdir(self.outputDir)))
+        self.assertEqual(os.path.getsize(self.dataFile),
+                         os.path.getsize(self.outputDir + sep + voxel.name +
+                                         '.raw'))
+
+    def testFailedDataWriteSkipsInfo(self):
+        """A failed data write returns -1 and writes no info file."""
+        voxel = readVirtualPopulation(self.infoFile, self.dataFile)
+        with mock.patch('voxelmod.virtual_family.virtual_population.'
+                        'writeBuffer',
+                        side_effect=OSError(errno.ENOSPC,
+                                            'No space left on device')):
+            self.assertEqual(-1, writeVirtualPopulation(voxel,
+                                                        self.outputDir))
+        self.assertEqual([], os.listdir(self.outputDir))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Test the batch driver.
+"""
+
+from __future__ import(absolute_import, division, generators,
+                       print_function, unicode_literals)
+
+import sys, os
+from os.path import pardir, sep
+import unittest
+from unittest import mock
+import tempfile
+import shutil
+sys.path.append(os.path.realpath(os.path.dirname(os.path.realpath(__file__)) +
+                                 sep + pardir))
+from voxelmod.virtual_family import (findModels, runBatch,
+                                     readVirtualPopulation,
+                                     readVirtualPopulationInfo,
+                                     writeVirtualPopulationInfo)
+from voxelmod.virtual_family.batch import processModel
+
+def crashingProcessModel(infoFile, dataFile, operations, relDir=''):
+    """processModel whose worker process dies on the broken model."""
+    if os.path.basename(infoFile) == 'broken.txt':
+        os._exit(1)
+    return processModel(infoFile, dataFile, operations, relDir)
+
+def flakyProcessModel(infoFile, dataFile, operations, relDir=''):
+    """processModel whose worker process dies on its first model only."""
+    marker = os.path.join(os.path.dirname(dataFile), 'crashed')
+    if os.path.basename(relDir) == 'Duke' and not os.path.exists(marker):
+        open(marker, 'w').close()
+        os._exit(1)
+    return processModel(infoFile, dataFile, operations, relDir)
+
+class TestBatch(unittest.TestCase):
+    """Tests for model discovery and batch operation chains."""
+    @classmethod
+    def setUpClass(cls):
+        cls.testDir = os.path.dirname(os.path.realpath(__file__))
+        cls.mapFile = cls.testDir + sep + 'material_map_4.txt'
+
+    def setUp(self):
+        self.libraryDir = tempfile.mkdtemp()
+        self.outputDir = tempfile.mkdtemp()
+        for modelDir in ('Duke', 'Ella' + sep + '2mm'):
+            os.makedirs(self.libraryDir + sep + modelDir)
+            for extension in ('.txt', '.raw'):
+                shutil.copy(self.testDir + sep + 'full_materials' + extension,
+                            self.libraryDir + sep + modelDir + sep +
+                            'full_materials' + extension)
+        # A map file has no data file and is not a model.
+        shutil.copy(self.mapFile, self.libraryDir + sep + 'Duke')
+        # A model whose data file is truncated.
+        shutil.copy(self.testDir + sep + 'full_materials.txt',
+                    self.libraryDir + sep + 'broken.txt')
+        with open(self.libraryDir + sep + 'broken.raw', 'wb') as fileHandle:
+            fileHandle.write(b'\0' * 10)
+
+    def tearDown(self):
+        shutil.rmtree(self.libraryDir)
+        shutil.rmtree(self.outputDir)
+
+    def testFindModels(self):
+        """Only .txt files with a matching .raw file are models."""
+        models = findModels(self.libraryDir)
+        self.assertEqual(['', 'Duke', 'Ella' + sep + '2mm'],
+                         [os.path.relpath(os.path.dirname(info),
+                                          self.libraryDir).strip('.')
+                          for (info, data) in models])
+        self.assertEqual(3, len(models))
+
+    def testRunBatch(self):
+        """The chain runs on every model in a process pool."""
+        operations = [('reduce', {'mapFile': self.mapFile}),
+                      ('crop', {'padding': 1}),
+                      ('resample', {'factors': 2}),
+                      ('export', {'outputDir': self.outputDir})]
+        report = runBatch(self.libraryDir, operations, workers=2)
+        self.assertEqual(3, len(report.results))
+        self.assertEqual(1, len(report.failed))
+        self.assertIn('broken.txt', report.failed[0].infoFile)
+        self.assertIn('1 failed', report.summary())
+        exported = self.outputDir + sep + 'Ella' + sep + '2mm' + sep + \
+                   'full_materials_reduced'
+        self.assertIn(exported + '.raw', report.results[2].outputs)
+        reduced = readVirtualPopulation(exported + '.txt', exported + '.raw')
+        self.assertEqual(5, reduced.numMaterials)
+
+        serial = runBatch(self.libraryDir, operations, workers=1)
+        self.assertEqual([result.ok for result in report.results],
+                         [result.ok for result in serial.results])
+        self.assertRaises(ValueError, runBatch, self.libraryDir,
+                          [('smooth', {})])
+
+    def testWorkerDeath(self):
+        """A model that kills its worker fails; the others complete."""
+        with mock.patch('voxelmod.virtual_family.batch.processModel',
+                        crashingProcessModel):
+            report = runBatch(self.libraryDir,
+                              [('reduce', {'mapFile': self.mapFile})],
+                              workers=2)
+        self.assertEqual([False, True, True],
+                         [result.ok for result in report.results])
+        self.assertIn('BrokenProcessPool', report.results[0].error)
+
+    def testLostModelsRetriedTogether(self):
+        """Models lost to a dying worker are retried in one new pool."""
+        from voxelmod.virtual_family import batch
+        operations = [('reduce', {'mapFile': self.mapFile})]
+        with mock.patch('voxelmod.virtual_family.batch.processModel',
+                        flakyProcessModel), \
+             mock.patch('voxelmod.virtual_family.batch._runPool',
+                        wraps=batch._runPool) as runPool:
+            report = runBatch(self.libraryDir, operations, workers=2)
+        self.assertEqual([False, True, True],
+                         [result.ok for result in report.results])
+        self.assertEqual(2, runPool.call_count)
+        with mock.patch('voxelmod.virtual_family.batch._runPool',
+                        wraps=batch._runPool) as runPool:
+            report = runBatch(self.libraryDir, operations, workers=1,
+                              memoryLimit=1 << 30)
+        self.assertEqual(1, runPool.call_count)
+        self.assertEqual(2, len(report.results) - len(report.failed))
+
+    def testCachedReduceSkipsHashing(self):
+        """A cached reduction of an unchanged model does not rehash it."""
+        cacheDir = tempfile.mkdtemp()
+        try:
+            operations = [('reduce', {'mapFile': self.mapFile,
+                                      'cacheDir': cacheDir})]
+            (infoFile, dataFile) = findModels(self.libraryDir)[1]
+            first = processModel(infoFile, dataFile, operations)
+            with mock.patch(
+                    'voxelmod.virtual_family.derivation_cache._hashLabels',
+                    side_effect=AssertionError('hashed again')):
+                second = processModel(infoFile, dataFile, operations)
+            self.assertEqual([True, True], [first.ok, second.ok])
+        finally:
+            shutil.rmtree(cacheDir)
+
+    @unittest.skipUnless(sys.platform.startswith('linux'),
+                         "memory-mapped files count against the limit")
+    def testMemoryLimitExcludesMappedSource(self):
+        """A mapped source larger than memoryLimit does not count."""
+        largeDir = self.libraryDir + sep + 'large'
+        os.mkdir(largeDir)
+        model = readVirtualPopulationInfo(self.testDir + sep +
+                                          'full_materials.txt')
+        (model.nx, model.ny, model.nz) = (1024, 1024, 2048)
+        writeVirtualPopulationInfo(model, largeDir + sep + 'large.txt')
+        with open(largeDir + sep + 'large.raw', 'wb') as fileHandle:
+            # Sparse: 2 GiB of Free Space without using the disk space.
+            fileHandle.truncate(model.nx * model.ny * model.nz)
+        report = runBatch(largeDir, [('crop', {'xRange': (0, 8),
+                                               'yRange': (0, 8),
+                                               'zRange': (0, 8)})],
+                          workers=2, memoryLimit=1 << 30)
+        self.assertEqual([True], [result.ok for result in report.results])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Test chunked voxel storage.
+"""
+
+from __future__ import(absolute_import, division, generators,
+                       print_function, unicode_literals)
+
+import sys
+import os
+from os.path import (pardir, sep)
+import shutil
+import tempfile
+import unittest
+sys.path.append(os.path.realpath(os.path.dirname(os.path.realpath(__file__)) +
+                                 sep + pardir ))
+from voxelmod.virtual_family import(VirtualPopulation,
+                                    readVirtualPopulation,
+                                    ChunkedVoxelFile,
+                                    readChunkedVirtualPopulation,
+                                    writeChunkedVirtualPopulation)
+
+class TestChunkedVoxel(unittest.TestCase):
+    """Tests for the compressed chunked voxel format."""
+    @classmethod
+    def setUpClass(cls):
+        cls.test_dir = os.path.dirname(os.path.realpath(__file__))
+        cls.full_material_voxel = readVirtualPopulation(
+            cls.test_dir + sep + 'full_materials.txt',
+            cls.test_dir + sep + 'full_materials.raw')
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def testRoundTrip(self):
+        """Every codec reads back the data it wrote."""
+        for codec in ('none', 'zlib', 'lzma'):
+            self.full_material_voxel.name = 'chunked_' + codec
+            status = writeChunkedVirtualPopulation(self.full_material_voxel,
+                                                   self.output_dir,
+                                                   brickShape=(16, 32, 50),
+                                                   codec=codec)
+            self.assertEqual(0, status)
+            voxel = readChunkedVirtualPopulation(
+                self.output_dir + sep + 'chunked_' + codec + '.txt',
+                self.output_dir + sep + 'chunked_' + codec + '.vxc')
+            self.assertIsInstance(voxel, VirtualPopulation)
+            self.assertEqual(78, voxel.numMaterials)
+            self.assertEqual(self.full_material_voxel.data, voxel.data)
+
+    def testCompression(self):
+        """Compressed file is much smaller than the raw data."""
+        self.full_material_voxel.name = 'compressed'
+        writeChunkedVirtualPopulation(self.full_material_voxel,
+                                      self.output_dir)
+        size = os.path.getsize(self.output_dir + sep + 'compressed.vxc')
+        self.assertLess(10 * size, len(self.full_material_voxel.data))
+
+    def testReadBrick(self):
+        """Single bricks can be read without reading the whole file."""
+        self.full_material_voxel.name = 'bricks'
+        writeChunkedVirtualPopulation(self.full_material_voxel,
+                                      self.output_dir,
+                                      brickShape=(40, 40, 40))
+        voxels = self.full_material_voxel.array
+        with ChunkedVoxelFile(self.output_dir + sep + 'bricks.vxc') as chunked:
+            self.assertEqual((93, 62, 122), chunked.shape)
+            self.assertEqual((3, 2, 4), chunked.numBricks)
+            brick = chunked.readBrick(2, 1, 3)
+            self.assertEqual((13, 22, 2), brick.shape)
+            self.assertTrue((voxels[80:93, 40:62, 120:122] == brick).all())
+            self.assertRaises(IndexError, chunked.readBrick, 3, 0, 0)
+
+if __name__ == '__main__':
+    unittest.main()
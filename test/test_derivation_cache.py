@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Test the derivation cache.
+"""
+
+from __future__ import(absolute_import, division, generators,
+                       print_function, unicode_literals)
+
+import sys, os
+from os.path import pardir, sep
+import unittest
+from unittest import mock
+import tempfile
+import shutil
+sys.path.append(os.path.realpath(os.path.dirname(os.path.realpath(__file__)) +
+                                 sep + pardir))
+from voxelmod.virtual_family import (DerivationCache, ReduceVoxel,
+                                     readVirtualPopulation)
+
+class TestDerivationCache(unittest.TestCase):
+    """Tests for the content-hash cache of derived models."""
+    @classmethod
+    def setUpClass(cls):
+        testDir = os.path.dirname(os.path.realpath(__file__))
+        cls.infoFile = testDir + sep + 'full_materials.txt'
+        cls.dataFile = testDir + sep + 'full_materials.raw'
+        cls.mapFile = testDir + sep + 'material_map_4.txt'
+
+    def setUp(self):
+        self.cacheDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cacheDir)
+
+    def testModelDigest(self):
+        """Deferred and loaded data of the same model hash alike."""
+        cache = DerivationCache(self.cacheDir)
+        lazy = readVirtualPopulation(self.infoFile, self.dataFile, lazy=True)
+        loaded = readVirtualPopulation(self.infoFile, self.dataFile)
+        lazyDigest = cache.modelDigest(lazy)
+        self.assertFalse(lazy.dataLoaded)
+        self.assertEqual(lazyDigest, cache.modelDigest(loaded))
+        self.assertEqual(lazyDigest, cache.modelDigest(
+            readVirtualPopulation(self.infoFile, self.dataFile, lazy=True)))
+        self.assertEqual(lazyDigest, cache.modelDigest(
+            readVirtualPopulation(self.infoFile, self.dataFile,
+                                  mmapMode='r')))
+        packed = readVirtualPopulation(self.infoFile, self.dataFile)
+        packed.packRunLength()
+        self.assertEqual(lazyDigest, cache.modelDigest(packed))
+        self.assertFalse(packed.dataLoaded)
+        before = cache.modelDigest(loaded)
+        loaded.array[0, 0, 0] += 1
+        self.assertNotEqual(before, cache.modelDigest(loaded))
+        self.assertNotEqual(cache.key('op', [loaded], scale=1),
+                            cache.key('op', [loaded], scale=2))
+
+    def testMappedDigestRemembered(self):
+        """Read-only mapped data is hashed once per unchanged data file."""
+        cache = DerivationCache(self.cacheDir)
+        loadedDigest = cache.modelDigest(
+            readVirtualPopulation(self.infoFile, self.dataFile))
+        mapped = readVirtualPopulation(self.infoFile, self.dataFile,
+                                       mmapMode='r')
+        self.assertEqual(loadedDigest, cache.modelDigest(mapped))
+        with mock.patch('voxelmod.virtual_family.derivation_cache._hashLabels',
+                        side_effect=AssertionError('hashed again')):
+            self.assertEqual(loadedDigest, cache.modelDigest(
+                readVirtualPopulation(self.infoFile, self.dataFile,
+                                      mmapMode='r')))
+        copyOnWrite = readVirtualPopulation(self.infoFile, self.dataFile,
+                                            mmapMode='c')
+        copyOnWrite.array[0, 0, 0] += 1
+        self.assertNotEqual(loadedDigest, cache.modelDigest(copyOnWrite))
+
+    def testReduceVoxelCached(self):
+        """A repeated reduction is read back without loading the source."""
+        cache = DerivationCache(self.cacheDir)
+        source = readVirtualPopulation(self.infoFile, self.dataFile, lazy=True)
+        first = ReduceVoxel(self.mapFile, source, cache=cache).voxel_model
+        self.assertEqual(1, len(cache))
+        source = readVirtualPopulation(self.infoFile, self.dataFile, lazy=True)
+        second = ReduceVoxel(self.mapFile, source, cache=cache).voxel_model
+        self.assertFalse(source.dataLoaded)
+        self.assertEqual(bytes(first.data), bytes(second.data))
+        self.assertEqual(first.numMaterials, second.numMaterials)
+        self.assertEqual(first.name, second.name)
+        self.assertEqual(1, len(cache))
+        loaded = readVirtualPopulation(self.infoFile, self.dataFile)
+        ReduceVoxel(self.mapFile, loaded, cache=cache)
+        self.assertEqual(1, len(cache))
+
+    def testLeastRecentlyUsedEviction(self):
+        """Entries beyond the size bound are evicted oldest use first."""
+        model = readVirtualPopulation(self.infoFile, self.dataFile)
+        cache = DerivationCache(self.cacheDir)
+        cache.put('a', model)
+        entryBytes = cache.size
+        cache = DerivationCache(self.cacheDir, maxBytes=2 * entryBytes)
+        cache.put('b', model)
+        os.utime(cache.cacheDir + sep + 'a', (1, 1))
+        os.utime(cache.cacheDir + sep + 'b', (2, 2))
+        self.assertIsNotNone(cache.get('a'))
+        cache.put('c', model)
+        self.assertEqual(2, len(cache))
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIsNone(cache.get('b'))
+        self.assertLessEqual(cache.size, cache.maxBytes)
+        cache.clear()
+        self.assertEqual(0, len(cache))
+
+    def testSharedKeyKeepsFirstEntry(self):
+        """A key stored twice keeps the first entry; broken entries miss."""
+        model = readVirtualPopulation(self.infoFile, self.dataFile)
+        cache = DerivationCache(self.cacheDir)
+        cache.put('a', model)
+        entryDir = cache.cacheDir + sep + 'a'
+        inode = os.stat(entryDir).st_ino
+        DerivationCache(self.cacheDir).put('a', model)
+        self.assertEqual(inode, os.stat(entryDir).st_ino)
+        self.assertEqual(['a'], os.listdir(cache.cacheDir))
+        os.remove(entryDir + sep + model.name + '.raw')
+        self.assertIsNone(cache.get('a'))
+        shutil.rmtree(entryDir)
+        cache.evict(0)
+        cache.clear()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Test the stage timers and hooks.
+"""
+
+from __future__ import(absolute_import, division, generators,
+                       print_function, unicode_literals)
+
+import sys, os
+from os.path import pardir, sep
+import unittest
+import tempfile
+import shutil
+import logging
+sys.path.append(os.path.realpath(os.path.dirname(os.path.realpath(__file__)) +
+                                 sep + pardir))
+from voxelmod.virtual_family import (instrumentation, ReduceVoxel,
+                                     BatchReduceVoxel,
+                                     readVirtualPopulation,
+                                     writeVirtualPopulation)
+
+class TestInstrumentation(unittest.TestCase):
+    """Tests for stage timers, counters and hooks."""
+    @classmethod
+    def setUpClass(cls):
+        testDir = os.path.dirname(os.path.realpath(__file__))
+        cls.infoFile = testDir + sep + 'full_materials.txt'
+        cls.dataFile = testDir + sep + 'full_materials.raw'
+        cls.mapFile = testDir + sep + 'material_map_4.txt'
+
+    def tearDown(self):
+        instrumentation.enableStatistics(False)
+
+    def testDisabledStageIsShared(self):
+        """Without hooks or statistics, stages are a shared no-op."""
+        self.assertIs(instrumentation.stage('a'), instrumentation.stage('b'))
+        with instrumentation.stage('a') as stage:
+            stage.voxels = 10
+        self.assertEqual({}, instrumentation.stageStatistics())
+
+    def testStageStatistics(self):
+        """Read, reduce and write stages are timed and counted."""
+        instrumentation.enableStatistics()
+        voxel = readVirtualPopulation(self.infoFile, self.dataFile)
+        ReduceVoxel(self.mapFile, voxel)
+        outputDir = tempfile.mkdtemp()
+        try:
+            writeVirtualPopulation(voxel, outputDir)
+        finally:
+            shutil.rmtree(outputDir)
+        statistics = instrumentation.stageStatistics()
+        numVoxels = voxel.nx * voxel.ny * voxel.nz
+        for name in ('read.info', 'read.data', 'reduce.map', 'reduce.remap',
+                     'write.info', 'write.data'):
+            self.assertEqual(1, statistics[name]['calls'])
+            self.assertGreaterEqual(statistics[name]['seconds'], 0.0)
+        self.assertEqual(numVoxels, statistics['read.data']['voxels'])
+        self.assertEqual(os.path.getsize(self.dataFile),
+                         statistics['read.data']['bytes'])
+        self.assertEqual(numVoxels, statistics['reduce.remap']['voxels'])
+        self.assertEqual(numVoxels, statistics['write.data']['bytes'])
+        instrumentation.resetStatistics()
+        self.assertEqual({}, instrumentation.stageStatistics())
+
+    def testBatchReduceStages(self):
+        """A batch reduction loads every map and remaps the data once."""
+        voxel = readVirtualPopulation(self.infoFile, self.dataFile)
+        instrumentation.enableStatistics()
+        BatchReduceVoxel([self.mapFile] * 3, voxel, names=['a', 'b', 'c'])
+        statistics = instrumentation.stageStatistics()
+        self.assertEqual(3, statistics['reduce.map']['calls'])
+        self.assertEqual(1, statistics['reduce.remap']['calls'])
+        self.assertEqual(voxel.nx * voxel.ny * voxel.nz,
+                         statistics['reduce.remap']['voxels'])
+
+    def testStageHooks(self):
+        """Hooks receive every stage; the logging hook logs at DEBUG."""
+        events = []
+        instrumentation.addStageHook(events.append)
+        try:
+            with self.assertLogs('voxelmod', logging.DEBUG) as logs:
+                instrumentation.addStageHook(instrumentation.logStage)
+                try:
+                    readVirtualPopulation(self.infoFile, self.dataFile,
+                                          lazy=True).data
+                finally:
+                    instrumentation.removeStageHook(instrumentation.logStage)
+        finally:
+            instrumentation.removeStageHook(events.append)
+        self.assertEqual(['read.info', 'read.data'],
+                         [event.stage for event in events])
+        self.assertTrue(any('read.data' in line for line in logs.output))
+
+if __name__ == '__main__':
+    unittest.main()
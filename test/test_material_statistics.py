@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Test per-material voxel statistics.
+"""
+
+from __future__ import(absolute_import, division, generators,
+                       print_function, unicode_literals)
+
+import sys
+import os
+from os.path import (pardir, sep)
+import unittest
+import numpy
+sys.path.append(os.path.realpath(os.path.dirname(os.path.realpath(__file__)) +
+                                 sep + pardir ))
+from voxelmod.virtual_family import readVirtualPopulation
+
+class TestMaterialStatistics(unittest.TestCase):
+    """Tests for material counts, bounding boxes and centroids."""
+    def setUp(self):
+        test_dir = os.path.dirname(os.path.realpath(__file__))
+        self.voxel = readVirtualPopulation(test_dir + sep +
+                                           'full_materials.txt',
+                                           test_dir + sep +
+                                           'full_materials.raw')
+
+    def testStatistics(self):
+        """Statistics match per-material numpy computations."""
+        voxels = self.voxel.array
+        statistics = self.voxel.materialStatistics
+        self.assertEqual(78, len(statistics.counts))
+        for mat_num in range(78):
+            (z, y, x) = numpy.nonzero(voxels == mat_num)
+            self.assertEqual(len(z), statistics.count(mat_num))
+            if not len(z):
+                self.assertIsNone(statistics.boundingBox(mat_num))
+                self.assertIn(mat_num, statistics.emptyMaterials())
+                continue
+            self.assertEqual(((x.min(), x.max() + 1), (y.min(), y.max() + 1),
+                              (z.min(), z.max() + 1)),
+                             statistics.boundingBox(mat_num))
+            numpy.testing.assert_allclose((x.mean(), y.mean(), z.mean()),
+                                          statistics.centroid(mat_num))
+
+    def testCacheInvalidation(self):
+        """Statistics are cached until data is replaced or invalidated."""
+        statistics = self.voxel.materialStatistics
+        self.assertIs(statistics, self.voxel.materialStatistics)
+        self.voxel.data = bytearray(len(self.voxel.data))
+        self.assertEqual(122 * 62 * 93,
+                         self.voxel.materialStatistics.count(0))
+        self.voxel.array[0, 0, 0] = 5
+        self.voxel.invalidateStatistics()
+        self.assertEqual(1, self.voxel.materialStatistics.count(5))
+
+if __name__ == '__main__':
+    unittest.main()
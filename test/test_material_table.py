@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Test the indexed material table.
+"""
+
+from __future__ import(absolute_import, division, generators,
+                       print_function, unicode_literals)
+
+import sys
+import os
+from os.path import (pardir, sep)
+import unittest
+sys.path.append(os.path.realpath(os.path.dirname(os.path.realpath(__file__)) +
+                                 sep + pardir ))
+from voxelmod.virtual_family import (MaterialTable,
+                                     readVirtualPopulation)
+
+class TestMaterialTable(unittest.TestCase):
+    """Tests for material lookup, removal and reordering."""
+    def setUp(self):
+        self.table = MaterialTable()
+        self.table.append('Duke/Bone', 1.0, 1.0, 1.0)
+        self.table.append('Duke/Fat', 0.5, 0.5, 0.5)
+        self.table.append('Ella/Fat', 0.25, 0.25, 0.25)
+        self.table.append('Duke/Muscle', 0.0, 0.0, 1.0)
+
+    def testLookup(self):
+        """Materials are found by full and unique short names."""
+        self.assertEqual(5, len(self.table))
+        self.assertEqual(0, self.table.index('Free Space'))
+        self.assertEqual(3, self.table.index('Ella/Fat'))
+        self.assertEqual(4, self.table.index('Muscle'))
+        self.assertEqual('Bone', self.table.shortName(1))
+        self.assertEqual([2, 'Duke/Fat', 0.5, 0.5, 0.5],
+                         self.table.record(2))
+        self.assertRaises(KeyError, self.table.index, 'Fat')
+        self.assertRaises(KeyError, self.table.index, 'Liver')
+        self.assertRaises(IndexError, self.table.record, 5)
+
+    def testRemoveAndReorder(self):
+        """Removal and reordering renumber materials and names."""
+        self.assertEqual([2], self.table.remove('Duke/Fat'))
+        self.assertEqual(3, self.table.index('Muscle'))
+        self.assertEqual(2, self.table.index('Fat'))
+        self.table.reorder([0, 3, 1])
+        self.assertEqual(['Free Space', 'Duke/Muscle', 'Duke/Bone'],
+                         [self.table.name(i) for i in range(3)])
+        self.assertNotIn('Fat', self.table)
+
+    def testVirtualPopulationLookup(self):
+        """VirtualPopulation resolves material names in O(1)."""
+        test_dir = os.path.dirname(os.path.realpath(__file__))
+        voxel = readVirtualPopulation(test_dir + sep + 'full_materials.txt',
+                                      test_dir + sep + 'full_materials.raw',
+                                      lazy=True)
+        self.assertEqual(30, voxel.materialIndex('Heart_muscle'))
+        self.assertEqual(30, voxel.materialIndex(
+            'Adult_male_1_34y/Heart_muscle'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Test progress reporting and cancellation.
+"""
+
+from __future__ import(absolute_import, division, generators,
+                       print_function, unicode_literals)
+
+import sys, os
+from os.path import pardir, sep
+import unittest
+import tempfile
+import shutil
+sys.path.append(os.path.realpath(os.path.dirname(os.path.realpath(__file__)) +
+                                 sep + pardir))
+from voxelmod.virtual_family import (CancellationToken, OperationCancelled,
+                                     ReduceVoxel, StreamReduceVoxel,
+                                     readVirtualPopulation,
+                                     writeVirtualPopulation)
+
+class TestProgress(unittest.TestCase):
+    """Tests for progress callbacks and cancellation tokens."""
+    @classmethod
+    def setUpClass(cls):
+        testDir = os.path.dirname(os.path.realpath(__file__))
+        cls.infoFile = testDir + sep + 'full_materials.txt'
+        cls.dataFile = testDir + sep + 'full_materials.raw'
+        cls.mapFile = testDir + sep + 'material_map_4.txt'
+        cls.voxel = readVirtualPopulation(cls.infoFile, cls.dataFile)
+
+    def setUp(self):
+        self.outputDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.outputDir)
+
+    def testReadProgress(self):
+        """Reading reports bytes read and stops once cancelled."""
+        events = []
+        progress = lambda *event: events.append(event)
+        voxel = readVirtualPopulation(self.infoFile, self.dataFile,
+                                      progress=progress)
+        size = os.path.getsize(self.dataFile)
+        self.assertEqual(('read.data', size, size), events[-1])
+        self.assertEqual(self.voxel.data, voxel.data)
+        token = CancellationToken()
+        token.cancel()
+        self.assertTrue(token.cancelled)
+        self.assertRaises(OperationCancelled, readVirtualPopulation,
+                          self.infoFile, self.dataFile, cancel=token)
+
+    def testReduceProgress(self):
+        """Every backend reports voxels remapped and can be cancelled."""
+        reference = ReduceVoxel(self.mapFile, self.voxel).voxel_model
+        numVoxels = self.voxel.nx * self.voxel.ny * self.voxel.nz
+        for (backend, workers) in (('python', 1), ('translate', 1),
+                                   ('numpy', 1), ('numpy', 3)):
+            events = []
+            reduced = ReduceVoxel(
+                self.mapFile, self.voxel, backend, workers,
+                progress=lambda *event: events.append(event)).voxel_model
+            self.assertEqual(reference.data, reduced.data)
+            self.assertEqual(('reduce.remap', numVoxels, numVoxels),
+                             max(events))
+            token = CancellationToken()
+            token.cancel()
+            self.assertRaises(OperationCancelled, ReduceVoxel, self.mapFile,
+                              self.voxel, backend, workers, cancel=token)
+
+    def testCancelledWriteKeepsOldFile(self):
+        """A cancelled write leaves the previous files untouched."""
+        self.assertEqual(0, writeVirtualPopulation(self.voxel,
+                                                   self.outputDir))
+        dataFile = self.outputDir + sep + self.voxel.name + '.raw'
+        reduced = ReduceVoxel(self.mapFile, self.voxel).voxel_model
+        reduced.name = self.voxel.name
+        token = CancellationToken()
+        token.cancel()
+        self.assertRaises(OperationCancelled, writeVirtualPopulation,
+                          reduced, self.outputDir, cancel=token)
+        self.assertEqual(sorted([self.voxel.name + '.txt',
+                                 self.voxel.name + '.raw']),
+                         sorted(os.listdir(self.outputDir)))
+        with open(dataFile, 'rb') as fileHandle:
+            self.assertEqual(bytes(self.voxel.data), fileHandle.read())
+
+    def testCancelledStreamReduceLeavesNoFiles(self):
+        """Cancelling a streaming reduction midway removes its output."""
+        token = CancellationToken()
+        events = []
+
+        def progress(stage, done, total):
+            events.append(done)
+            if done * 2 >= total:
+                token.cancel()
+
+        source = readVirtualPopulation(self.infoFile, self.dataFile,
+                                       lazy=True)
+        self.assertRaises(OperationCancelled, StreamReduceVoxel,
+                          self.mapFile, source, self.dataFile,
+                          self.outputDir, progress=progress, cancel=token)
+        self.assertGreater(len(events), 1)
+        self.assertEqual([], os.listdir(self.outputDir))
+
+if __name__ == '__main__':
+    unittest.main()
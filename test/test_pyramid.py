@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Test multi-resolution pyramids.
+"""
+
+from __future__ import(absolute_import, division, generators,
+                       print_function, unicode_literals)
+
+import sys
+import os
+from os.path import (pardir, sep)
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+sys.path.append(os.path.realpath(os.path.dirname(os.path.realpath(__file__)) +
+                                 sep + pardir ))
+from voxelmod.virtual_family import(buildPyramid,
+                                    pyramidLevels,
+                                    readPyramidLevel)
+
+class TestPyramid(unittest.TestCase):
+    """Tests for pyramid building and level selection."""
+    def setUp(self):
+        test_dir = os.path.dirname(os.path.realpath(__file__))
+        self.output_dir = tempfile.mkdtemp()
+        self.info_file = self.output_dir + sep + 'full_materials.txt'
+        self.data_file = self.output_dir + sep + 'full_materials.raw'
+        shutil.copy(test_dir + sep + 'full_materials.txt', self.info_file)
+        shutil.copy(test_dir + sep + 'full_materials.raw', self.data_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def testBuildPyramid(self):
+        """Levels halve the grid until minSize is reached."""
+        written = buildPyramid(self.info_file, self.data_file, minSize=8)
+        self.assertEqual(3, len(written))
+        self.assertEqual(4, len(pyramidLevels(self.info_file)))
+        self.assertTrue(os.path.isfile(self.output_dir + sep +
+                                       'full_materials_pyramid3.raw'))
+
+    def testLevelFilesMatchWrittenFiles(self):
+        """Returned names are where the levels are, through symlinks."""
+        link_dir = tempfile.mkdtemp()
+        try:
+            data_file = self.output_dir + sep + 'labels.bin'
+            os.rename(self.data_file, data_file)
+            info_link = link_dir + sep + 'full_materials.txt'
+            os.symlink(self.info_file, info_link)
+            written = buildPyramid(info_link, data_file, levels=2)
+            for level_files in written:
+                for file_name in level_files:
+                    self.assertTrue(os.path.isfile(file_name))
+            self.assertEqual([(info_link, data_file)] + written,
+                             pyramidLevels(info_link, data_file))
+            with mock.patch('voxelmod.virtual_family.pyramid.'
+                            'writeVirtualPopulation', return_value=-1):
+                self.assertRaises(IOError, buildPyramid, info_link,
+                                  data_file)
+        finally:
+            shutil.rmtree(link_dir)
+
+    def testReadPyramidLevel(self):
+        """The coarsest level within the requested spacing is read."""
+        buildPyramid(self.info_file, self.data_file, levels=1)
+        coarse = readPyramidLevel(self.info_file, 0.012)
+        self.assertEqual('full_materials_pyramid1', coarse.name)
+        self.assertEqual((61, 31, 47), (coarse.nx, coarse.ny, coarse.nz))
+        self.assertEqual(78, coarse.numMaterials)
+        fine = readPyramidLevel(self.info_file, 0.006, lazy=True)
+        self.assertEqual('full_materials', fine.name)
+        self.assertFalse(fine.dataLoaded)
+
+if __name__ == '__main__':
+    unittest.main()
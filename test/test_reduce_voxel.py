@@ -10,12 +10,17 @@ import sys
 import os
 from os.path import (pardir, sep)
 import unittest
+from unittest import mock
+import tempfile
+import shutil
 sys.path.append(os.path.realpath(os.path.dirname(os.path.realpath(__file__)) +
                                  sep + pardir ))
 from voxelmod.virtual_family import(VirtualPopulation,
                                     readVirtualPopulation,
                                     writeVirtualPopulation,
-                                    ReduceVoxel)
+                                    ReduceVoxel,
+                                    StreamReduceVoxel,
+                                    BatchReduceVoxel)
 
 class TestReduceVoxelData(unittest.TestCase):
     """Tests for voxel material reductions."""
@@ -35,6 +40,8 @@ class TestReduceVoxelData(unittest.TestCase):
         print('duke_voxel_data_file: ', full_mat_data_file)
         cls.full_material_voxel =  readVirtualPopulation(full_mat_info_file,
                                                          full_mat_data_file)
+        cls.full_mat_info_file = full_mat_info_file
+        cls.full_mat_data_file = full_mat_data_file
 
     def testEnvironment(self):
         """Verify the test class is set up properly."""
@@ -60,5 +67,132 @@ class TestReduceVoxelData(unittest.TestCase):
         # Check if reduced voxel object has 5 materials (4 voxel + 'Free space')
         self.assertEqual(5, four_voxel.numMaterials)
 
+    def testRemapBackends(self):
+        """Lookup-table remap matches the per-voxel reference remap."""
+        original_data = bytearray(self.full_material_voxel.data)
+        reference = ReduceVoxel(self.voxel_map_file, self.full_material_voxel,
+                                backend='python').voxel_model
+        translated = ReduceVoxel(self.voxel_map_file, self.full_material_voxel,
+                                 backend='translate').voxel_model
+        vectorized = ReduceVoxel(self.voxel_map_file, self.full_material_voxel,
+                                 backend='numpy').voxel_model
+        self.assertEqual(reference.data, translated.data)
+        self.assertEqual(reference.data, vectorized.data)
+        self.assertEqual(original_data, self.full_material_voxel.data)
+        self.assertEqual(5, max(translated.data) + 1)
+        mapped = readVirtualPopulation(self.full_mat_info_file,
+                                       self.full_mat_data_file, mmapMode='r')
+        for backend in ('python', 'translate', 'numpy'):
+            reduced = ReduceVoxel(self.voxel_map_file, mapped,
+                                  backend=backend).voxel_model
+            self.assertEqual(reference.data, reduced.data)
+        self.assertRaises(ValueError, ReduceVoxel, self.voxel_map_file,
+                          self.full_material_voxel, 'fortran')
+
+    def testParallelRemap(self):
+        """Threaded z-slab remap matches the single-threaded remap."""
+        serial = ReduceVoxel(self.voxel_map_file, self.full_material_voxel,
+                             backend='numpy').voxel_model
+        parallel = ReduceVoxel(self.voxel_map_file, self.full_material_voxel,
+                               backend='numpy', workers=3).voxel_model
+        self.assertEqual(serial.data, parallel.data)
+        self.assertRaises(ValueError, ReduceVoxel, self.voxel_map_file,
+                          self.full_material_voxel, 'translate', 2)
+
+    def testAutomaticWorkers(self):
+        """workers=None threads large models on enough CPUs only."""
+        serial = ReduceVoxel(self.voxel_map_file,
+                             self.full_material_voxel).voxel_model
+        large = self.full_material_voxel.resample(0.5)
+        with mock.patch('os.cpu_count', return_value=8):
+            small = ReduceVoxel(self.voxel_map_file, self.full_material_voxel,
+                                workers=None)
+            threaded = ReduceVoxel(self.voxel_map_file, large, workers=None)
+        with mock.patch('os.cpu_count', return_value=2):
+            few_cpus = ReduceVoxel(self.voxel_map_file, large, workers=None)
+        self.assertEqual(('translate', 1), (small._backend, small._workers))
+        self.assertEqual(serial.data, small.voxel_model.data)
+        self.assertEqual(('numpy', 8), (threaded._backend, threaded._workers))
+        self.assertEqual(('translate', 1),
+                         (few_cpus._backend, few_cpus._workers))
+        self.assertEqual(threaded.voxel_model.data,
+                         few_cpus.voxel_model.data)
+
+    def testStreamReduceVoxel(self):
+        """Streaming reduction matches the in-memory reduction."""
+        output_dir = tempfile.mkdtemp()
+        try:
+            source = readVirtualPopulation(self.full_mat_info_file,
+                                           self.full_mat_data_file,
+                                           lazy=True)
+            streamed = StreamReduceVoxel(self.voxel_map_file, source,
+                                         self.full_mat_data_file, output_dir,
+                                         name='Duke_4_Mat_Stream',
+                                         slab_depth=7).voxel_model
+            in_memory = ReduceVoxel(self.voxel_map_file,
+                                    self.full_material_voxel).voxel_model
+            self.assertEqual(bytes(in_memory.data), streamed.data.tobytes())
+            self.assertFalse(source.dataLoaded)
+            written = readVirtualPopulation(
+                output_dir + sep + 'Duke_4_Mat_Stream.txt',
+                output_dir + sep + 'Duke_4_Mat_Stream.raw')
+            self.assertEqual(5, written.numMaterials)
+            self.assertEqual(bytes(in_memory.data), bytes(written.data))
+        finally:
+            shutil.rmtree(output_dir)
+
+    def testStreamReduceInfoWriteFailure(self):
+        """A failed info write raises instead of returning a model."""
+        output_dir = tempfile.mkdtemp()
+        try:
+            with mock.patch('voxelmod.virtual_family.reduce_voxel.'
+                            'writeVirtualPopulationInfo', return_value=-1):
+                self.assertRaises(IOError, StreamReduceVoxel,
+                                  self.voxel_map_file, self.full_material_voxel,
+                                  self.full_mat_data_file, output_dir)
+        finally:
+            shutil.rmtree(output_dir)
+
+    def testBatchReduceVoxel(self):
+        """Batch reduction matches one ReduceVoxel per map file."""
+        single = ReduceVoxel(self.voxel_map_file,
+                             self.full_material_voxel).voxel_model
+        output_dir = tempfile.mkdtemp()
+        try:
+            batch = BatchReduceVoxel([self.voxel_map_file,
+                                      self.voxel_map_file],
+                                     self.full_material_voxel,
+                                     names=['first', 'second'])
+            for voxel in batch.voxel_models:
+                self.assertEqual(single.data, voxel.data)
+            self.assertEqual([0, 0], batch.write(output_dir))
+            self.assertTrue(os.path.isfile(output_dir + sep + 'second.raw'))
+        finally:
+            shutil.rmtree(output_dir)
+
+    def testReduceWideLabels(self):
+        """Reduction of uint16 labels matches the one byte reduction."""
+        single = ReduceVoxel(self.voxel_map_file,
+                             self.full_material_voxel).voxel_model
+        wide = readVirtualPopulation(self.full_mat_info_file,
+                                     self.full_mat_data_file)
+        wide.setLabelDtype('<u2')
+        reduced = ReduceVoxel(self.voxel_map_file, wide).voxel_model
+        self.assertEqual(single.data, reduced.data)
+        batch = BatchReduceVoxel([self.voxel_map_file], wide)
+        self.assertEqual(single.data, batch.voxel_models[0].data)
+        output_dir = tempfile.mkdtemp()
+        try:
+            wide_data_file = output_dir + sep + 'wide.raw'
+            with open(wide_data_file, 'wb') as file_handle:
+                file_handle.write(wide.data)
+            streamed = StreamReduceVoxel(self.voxel_map_file, wide,
+                                         wide_data_file, output_dir,
+                                         name='Duke_4_Mat_Wide',
+                                         slab_depth=5).voxel_model
+            self.assertEqual(bytes(single.data), streamed.data.tobytes())
+        finally:
+            shutil.rmtree(output_dir)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Test label volume resampling.
+"""
+
+from __future__ import(absolute_import, division, generators,
+                       print_function, unicode_literals)
+
+import sys
+import os
+from os.path import (pardir, sep)
+import unittest
+import numpy
+sys.path.append(os.path.realpath(os.path.dirname(os.path.realpath(__file__)) +
+                                 sep + pardir ))
+from voxelmod.virtual_family import readVirtualPopulation
+from voxelmod.virtual_family.resample import (blockMode, resampleLabels,
+                                              resampledShape)
+
+class TestResample(unittest.TestCase):
+    """Tests for majority vote and nearest neighbour resampling."""
+    def testBlockMode(self):
+        """Majority vote ignores padding and breaks ties low."""
+        blocks = numpy.array([[3, 1, 3, 2], [5, 4, 4, 5],
+                              [7, 0xFFFF, 0xFFFF, 0xFFFF]], dtype=numpy.uint16)
+        self.assertEqual([3, 4, 7], list(blockMode(blocks)))
+
+    def testDownsample(self):
+        """Integer factors match a brute force majority vote."""
+        labels = numpy.random.RandomState(1).randint(
+            0, 4, size=(7, 9, 10)).astype(numpy.uint8)
+        reduced = resampleLabels(labels, (2, 3, 2))
+        self.assertEqual((4, 3, 5), reduced.shape)
+        for (z, y, x) in numpy.ndindex(*reduced.shape):
+            block = labels[2 * z:2 * z + 2, 3 * y:3 * y + 3, 2 * x:2 * x + 2]
+            counts = numpy.bincount(block.reshape(-1), minlength=4)
+            self.assertEqual(counts.argmax(), reduced[z, y, x])
+
+    def testUpsample(self):
+        """Factor 1/2 repeats every voxel twice along each axis."""
+        labels = numpy.arange(24, dtype=numpy.uint8).reshape(2, 3, 4)
+        enlarged = resampleLabels(labels, (0.5, 0.5, 0.5))
+        expected = labels.repeat(2, 0).repeat(2, 1).repeat(2, 2)
+        self.assertTrue((expected == enlarged).all())
+        self.assertEqual((3, 3, 5), resampledShape((2, 3, 4), (0.75, 1, 0.8)))
+
+    def testResampleVirtualPopulation(self):
+        """VirtualPopulation.resample updates grid and spacing."""
+        test_dir = os.path.dirname(os.path.realpath(__file__))
+        voxel = readVirtualPopulation(test_dir + sep + 'full_materials.txt',
+                                      test_dir + sep + 'full_materials.raw')
+        coarse = voxel.resample(2)
+        self.assertEqual((61, 31, 47), (coarse.nx, coarse.ny, coarse.nz))
+        self.assertAlmostEqual(0.01, coarse.dz)
+        self.assertEqual(78, coarse.numMaterials)
+        fine = voxel.resample((1, 1, 0.5))
+        self.assertEqual(186, fine.nz)
+        self.assertTrue((voxel.array == fine.array[::2]).all())
+
+if __name__ == '__main__':
+    unittest.main()
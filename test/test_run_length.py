@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Test run-length encoded voxel data.
+"""
+
+from __future__ import(absolute_import, division, generators,
+                       print_function, unicode_literals)
+
+import sys
+import os
+from os.path import (pardir, sep)
+import unittest
+import tempfile
+import shutil
+import numpy
+sys.path.append(os.path.realpath(os.path.dirname(os.path.realpath(__file__)) +
+                                 sep + pardir ))
+from voxelmod.virtual_family import(readVirtualPopulation,
+                                    writeVirtualPopulation,
+                                    computeMaterialStatistics,
+                                    RunLengthVoxelData)
+
+class TestRunLengthVoxelData(unittest.TestCase):
+    """Tests for the run-length encoded voxel data."""
+    def setUp(self):
+        test_dir = os.path.dirname(os.path.realpath(__file__))
+        self.voxel = readVirtualPopulation(test_dir + sep +
+                                           'full_materials.txt',
+                                           test_dir + sep +
+                                           'full_materials.raw')
+
+    def testRoundTrip(self):
+        """Encoding and decoding reproduces the dense data."""
+        run_length = RunLengthVoxelData.fromArray(self.voxel.array)
+        self.assertEqual((93, 62, 122), run_length.shape)
+        self.assertEqual(self.voxel.data, run_length.toBytes())
+        self.assertLess(run_length.nbytes, len(self.voxel.data))
+
+    def testReads(self):
+        """Voxel, row and slice reads match the dense array."""
+        voxels = self.voxel.array
+        run_length = RunLengthVoxelData.fromArray(voxels)
+        for (z, y, x) in [(0, 0, 0), (50, 30, 61), (92, 61, 121),
+                          (60, 20, 40)]:
+            self.assertEqual(voxels[z, y, x], run_length.voxel(z, y, x))
+        self.assertTrue((voxels[50, 30] == run_length.readRow(50, 30)).all())
+        self.assertTrue((voxels[70] == run_length.readSlice(70)).all())
+
+    def testMaterialCounts(self):
+        """Material counts from runs match a dense bincount."""
+        run_length = RunLengthVoxelData.fromArray(self.voxel.array)
+        expected = numpy.bincount(self.voxel.array.reshape(-1), minlength=78)
+        self.assertTrue((expected == run_length.materialCounts(78)).all())
+
+    def testPackRunLength(self):
+        """A packed VirtualPopulation decodes back to dense on access."""
+        original = bytes(self.voxel.data)
+        run_length = self.voxel.packRunLength()
+        self.assertIs(run_length, self.voxel.runLength)
+        self.assertFalse(self.voxel.dataLoaded)
+        self.assertEqual(original, bytes(self.voxel.data))
+        self.assertIsNone(self.voxel.runLength)
+
+    def testPackedAccessKeepsRuns(self):
+        """Label type, statistics and writing work on the runs."""
+        dense = computeMaterialStatistics(self.voxel.array,
+                                          self.voxel.numMaterials)
+        original = bytes(self.voxel.data)
+        self.voxel.packRunLength()
+        self.assertEqual(numpy.uint8, self.voxel.labelDtype)
+        statistics = self.voxel.materialStatistics
+        self.assertTrue((dense.counts == statistics.counts).all())
+        for mat_num in range(self.voxel.numMaterials):
+            self.assertEqual(dense.boundingBox(mat_num),
+                             statistics.boundingBox(mat_num))
+            if dense.count(mat_num):
+                numpy.testing.assert_allclose(dense.centroid(mat_num),
+                                              statistics.centroid(mat_num))
+        output_dir = tempfile.mkdtemp()
+        try:
+            self.assertEqual(0, writeVirtualPopulation(self.voxel,
+                                                       output_dir))
+            with open(output_dir + sep + self.voxel.name + '.raw',
+                      'rb') as data_fh:
+                self.assertEqual(original, data_fh.read())
+        finally:
+            shutil.rmtree(output_dir)
+        self.assertIsNotNone(self.voxel.runLength)
+        self.assertFalse(self.voxel.dataLoaded)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Test tissue property volumes.
+"""
+
+from __future__ import(absolute_import, division, generators,
+                       print_function, unicode_literals)
+
+import sys
+import os
+from os.path import (pardir, sep)
+import unittest
+import tempfile
+import shutil
+import numpy
+sys.path.append(os.path.realpath(os.path.dirname(os.path.realpath(__file__)) +
+                                 sep + pardir ))
+from voxelmod.virtual_family import(readVirtualPopulation,
+                                    ReduceVoxel,
+                                    TissueProperties,
+                                    read_property_table)
+
+class TestTissueProperties(unittest.TestCase):
+    """Tests for tissue property volumes."""
+    @classmethod
+    def setUpClass(cls):
+        cls.test_dir = os.path.dirname(os.path.realpath(__file__))
+        cls.voxel_map_file = cls.test_dir + sep + 'material_map_4.txt'
+        cls.property_file = cls.test_dir + sep + 'tissue_properties_4.txt'
+        cls.info_file = cls.test_dir + sep + 'full_materials.txt'
+        cls.data_file = cls.test_dir + sep + 'full_materials.raw'
+        cls.voxel = readVirtualPopulation(cls.info_file, cls.data_file)
+
+    def testReadPropertyTable(self):
+        """The table file gives the frequency and one row per tissue."""
+        (table, frequency) = read_property_table(self.property_file)
+        self.assertEqual(64e6, frequency)
+        self.assertEqual((0.688, 72.2, 1090.0), table['Muscle'])
+        self.assertEqual(4, len(table))
+
+    def testPropertyVolumes(self):
+        """Property volumes follow the labels of the reduced model."""
+        properties = TissueProperties(self.property_file, self.voxel,
+                                      self.voxel_map_file)
+        self.assertEqual(64e6, properties.frequency)
+        reduced = ReduceVoxel(self.voxel_map_file, self.voxel).voxel_model
+        (table, _) = read_property_table(self.property_file)
+        sigma = properties.volume('sigma')
+        self.assertEqual(numpy.float32, sigma.dtype)
+        self.assertEqual(self.voxel.array.shape, sigma.shape)
+        for matNum in range(1, reduced.numMaterials):
+            expected = numpy.float32(table[reduced.material(matNum)[1]][0])
+            self.assertTrue((sigma[reduced.array == matNum] ==
+                             expected).all())
+        self.assertTrue((properties.volume('epsilon_r')[
+            reduced.array == 0] == 1.0).all())
+        self.assertRaises(ValueError, properties.volume, 'mu_r')
+
+    def testMissingTissue(self):
+        """Materials missing from the table are reported."""
+        table = {'Air': (0.0, 1.0, 1.16), 'Bone': (0.0589, 16.7, 1908)}
+        self.assertRaises(KeyError, TissueProperties, table, self.voxel,
+                          self.voxel_map_file)
+        self.assertRaises(KeyError, TissueProperties, self.property_file,
+                          self.voxel)
+
+    def testWriteStreamsFromMemoryMap(self):
+        """Streamed property files match the in-memory volumes."""
+        source = readVirtualPopulation(self.info_file, self.data_file,
+                                       mmapMode='r')
+        properties = TissueProperties(self.property_file, source,
+                                      self.voxel_map_file)
+        output_dir = tempfile.mkdtemp()
+        try:
+            self.assertEqual(0, properties.write(output_dir))
+            for property_name in ('sigma', 'epsilon_r', 'density'):
+                written = numpy.fromfile(output_dir + sep + source.name +
+                                         '_' + property_name + '.raw',
+                                         dtype='<f4')
+                self.assertTrue((properties.volume(property_name).reshape(-1)
+                                 == written).all())
+            self.assertEqual(-1, properties.write(output_dir + sep + 'none'))
+        finally:
+            shutil.rmtree(output_dir)
+
+    def testWriteStreamsFromLazyModel(self):
+        """A lazily read model is streamed without loading its data."""
+        source = readVirtualPopulation(self.info_file, self.data_file,
+                                       lazy=True)
+        properties = TissueProperties(self.property_file, source,
+                                      self.voxel_map_file)
+        output_dir = tempfile.mkdtemp()
+        try:
+            self.assertEqual(0, properties.write(output_dir,
+                                                 property_names=('sigma',)))
+            sigma = properties.volume('sigma')
+            self.assertFalse(source.dataLoaded)
+            written = numpy.fromfile(output_dir + sep + source.name +
+                                     '_sigma.raw', dtype='<f4')
+            self.assertTrue((sigma.reshape(-1) == written).all())
+            expected = TissueProperties(self.property_file, self.voxel,
+                                        self.voxel_map_file).volume('sigma')
+            self.assertTrue((expected == sigma).all())
+        finally:
+            shutil.rmtree(output_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,9 +10,15 @@ import sys, os
 from os.path import pardir, sep
 from random import random
 import unittest
+from unittest import mock
+import tempfile
+import tracemalloc
+import numpy
 sys.path.append(os.path.realpath(os.path.dirname(os.path.realpath(__file__)) +
                                  sep + pardir))
 from voxelmod.virtual_family import VirtualPopulation, readVirtualPopulation, writeVirtualPopulation
+from voxelmod.virtual_family import (VirtualPopulationInfoError,
+                                     parseVirtualPopulationInfo)
 
 class TestReducedVoxelData(unittest.TestCase):
     """Tests for Voxel Info and Data."""
@@ -73,6 +79,200 @@ class TestReducedVoxelData(unittest.TestCase):
         self.assertEqual(testVoxel.nx * testVoxel.ny * testVoxel.nz,
                          len(testVoxel.data))
 
+    def testArrayView(self):
+        """The array property is a (nz, ny, nx) view sharing data."""
+        testVoxel = readVirtualPopulation(self.voxelInfoFile,
+                                          self.voxelDataFile)
+        voxelArray = testVoxel.array
+        self.assertEqual((93, 62, 122), voxelArray.shape)
+        self.assertEqual(testVoxel.data[122 * 62 + 122 + 1],
+                         voxelArray[1, 1, 1])
+        voxelArray[1, 1, 1] = 200
+        self.assertEqual(200, testVoxel.data[122 * 62 + 122 + 1])
+        testVoxel.nz = 92
+        with self.assertRaises(ValueError):
+            testVoxel.array
+
+    def testRemoveMaterialRelabelsData(self):
+        """Removing a material relabels voxels above it."""
+        testVoxel = readVirtualPopulation(self.voxelInfoFile,
+                                          self.voxelDataFile)
+        original = testVoxel.array.copy()
+        testVoxel.removeMaterial('Adult_male_1_34y/Heart_muscle')
+        self.assertEqual(77, testVoxel.numMaterials)
+        self.assertEqual('Adult_male_1_34y/Hippocampus',
+                         testVoxel.material(30)[1])
+        expected = original - (original > 30)
+        expected[original == 30] = 0
+        self.assertTrue((expected == testVoxel.array).all())
+
+    def testMergeAndReorderMaterials(self):
+        """Merging and reordering keep table and voxel labels consistent."""
+        testVoxel = readVirtualPopulation(self.voxelInfoFile,
+                                          self.voxelDataFile, mmapMode='r')
+        names = [testVoxel.material(i)[1] for i in range(78)]
+        original = numpy.array(testVoxel.array)
+        testVoxel.mergeMaterials(['Skull', 'Mandible', 'Vertebrae'], 'Bone')
+        self.assertEqual(75, testVoxel.numMaterials)
+        relabelled = testVoxel.array
+        for matNum in (6, 42, 59, 77):
+            self.assertTrue((relabelled[original == matNum] ==
+                             testVoxel.materialIndex('Bone')).all())
+        self.assertTrue((relabelled[original == 30] ==
+                         testVoxel.materialIndex('Heart_muscle')).all())
+
+        order = [0] + list(range(testVoxel.numMaterials - 1, 0, -1))
+        before = testVoxel.array.copy()
+        testVoxel.reorderMaterials(order)
+        self.assertEqual(names[1], testVoxel.material(74)[1])
+        self.assertTrue((testVoxel.array[before == 1] == 74).all())
+        self.assertRaises(ValueError, testVoxel.reorderMaterials, [1, 0])
+
+    def testRelabelReadOnlyMemory(self):
+        """Relabelling read-only data needs about one copy of it."""
+        testVoxel = readVirtualPopulation(self.voxelInfoFile,
+                                          self.voxelDataFile).resample(0.5)
+        readOnly = numpy.frombuffer(bytes(testVoxel.data), dtype=numpy.uint8)
+        expected = readOnly - (readOnly > 30)
+        expected[readOnly == 30] = 0
+        testVoxel.data = readOnly.reshape(testVoxel.array.shape)
+        tracemalloc.start()
+        try:
+            testVoxel.removeMaterial('Heart_muscle')
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 3 * readOnly.nbytes)
+        self.assertTrue((expected == testVoxel.array.reshape(-1)).all())
+
+    def testWideLabels(self):
+        """Models with more than 256 materials use uint16 labels."""
+        testVoxel = readVirtualPopulation(self.voxelInfoFile,
+                                          self.voxelDataFile)
+        original = testVoxel.array.copy()
+        for matNum in range(testVoxel.numMaterials, 300):
+            testVoxel.appendMaterial('Extra_' + str(matNum), 0.5, 0.5, 0.5)
+        testVoxel.setLabelDtype(numpy.uint16)
+        testVoxel.array[0, 0, 0] = 299
+        self.assertEqual(numpy.uint16, testVoxel.array.dtype)
+        self.assertRaises(ValueError, testVoxel.setLabelDtype, numpy.uint8)
+        outputDir = tempfile.mkdtemp()
+        try:
+            writeVirtualPopulation(testVoxel, outputDir)
+            dataFile = outputDir + sep + testVoxel.name + '.raw'
+            self.assertEqual(2 * original.size, os.path.getsize(dataFile))
+            wide = readVirtualPopulation(outputDir + sep + testVoxel.name +
+                                         '.txt', dataFile)
+            self.assertEqual(300, wide.numMaterials)
+            self.assertEqual(299, wide.array[0, 0, 0])
+            self.assertTrue((original.reshape(-1)[1:] ==
+                             wide.array.reshape(-1)[1:]).all())
+
+            # Dropping back to 256 materials narrows the labels.
+            for matNum in range(299, 255, -1):
+                wide.removeMaterial(wide.material(matNum)[1])
+            self.assertEqual(numpy.uint8, wide.array.dtype)
+            self.assertEqual(0, wide.array[0, 0, 0])
+        finally:
+            for extension in ('.txt', '.raw'):
+                os.remove(outputDir + sep + testVoxel.name + extension)
+            os.rmdir(outputDir)
+
+    def testSubRegion(self):
+        """Sub-region copies the requested block and updates the grid."""
+        testVoxel = readVirtualPopulation(self.voxelInfoFile,
+                                          self.voxelDataFile)
+        head = testVoxel.subRegion(zRange=(60, 93), xRange=(10, 110))
+        self.assertEqual((100, 62, 33), (head.nx, head.ny, head.nz))
+        self.assertEqual(78, head.numMaterials)
+        self.assertTrue((testVoxel.array[60:93, :, 10:110] ==
+                         head.array).all())
+        self.assertRaises(ValueError, testVoxel.subRegion, None, (0, 63))
+
+    def testTrimFreeSpace(self):
+        """Trimming keeps every labelled voxel and reports the offset."""
+        testVoxel = VirtualPopulation()
+        testVoxel.nx = 10; testVoxel.ny = 8; testVoxel.nz = 6
+        testVoxel.data = bytearray(10 * 8 * 6)
+        self.assertIsNone(testVoxel.boundingBox())
+        testVoxel.array[2, 3, 4] = 1
+        testVoxel.array[3, 5, 7] = 2
+        self.assertEqual(((4, 8), (3, 6), (2, 4)), testVoxel.boundingBox())
+        trimmed, offset = testVoxel.trimFreeSpace()
+        self.assertEqual((4, 3, 2), offset)
+        self.assertEqual((4, 3, 2), (trimmed.nx, trimmed.ny, trimmed.nz))
+        self.assertEqual(2, trimmed.array[1, 2, 3])
+        padded, offset = testVoxel.trimFreeSpace(padding=(1, 5, 0))
+        self.assertEqual((3, 0, 2), offset)
+        self.assertEqual((6, 8, 2), (padded.nx, padded.ny, padded.nz))
+
+    def testFlipAndPermute(self):
+        """Flip and axis permutation match the numpy equivalents."""
+        testVoxel = readVirtualPopulation(self.voxelInfoFile,
+                                          self.voxelDataFile)
+        testVoxel.dx = 0.001
+        flipped = testVoxel.flipZ()
+        self.assertTrue((testVoxel.array[::-1] == flipped.array).all())
+        self.assertTrue((testVoxel.array[:, ::-1] ==
+                         testVoxel.flip('y').array).all())
+        permuted = testVoxel.permuteAxes(('z', 'x', 'y'))
+        self.assertEqual((93, 122, 62), (permuted.nx, permuted.ny,
+                                         permuted.nz))
+        self.assertEqual((0.005, 0.001, 0.005), (permuted.dx, permuted.dy,
+                                                 permuted.dz))
+        self.assertEqual(testVoxel.array[5, 7, 11], permuted.array[7, 11, 5])
+
+    def testReadVirtualPopulationLazy(self):
+        """Lazy read defers the data file until data is accessed."""
+        lazyVoxel = readVirtualPopulation(self.voxelInfoFile,
+                                          self.voxelDataFile, lazy=True)
+        self.assertFalse(lazyVoxel.dataLoaded)
+        self.assertEqual(78, lazyVoxel.numMaterials)
+        self.assertEqual(122 * 62 * 93, len(lazyVoxel.data))
+        self.assertTrue(lazyVoxel.dataLoaded)
+
+    def testReadVirtualPopulationMemoryMapped(self):
+        """Memory-mapped read matches the in-memory read."""
+        testVoxel = readVirtualPopulation(self.voxelInfoFile,
+                                          self.voxelDataFile)
+        mappedVoxel = readVirtualPopulation(self.voxelInfoFile,
+                                            self.voxelDataFile,
+                                            mmapMode='r')
+        self.assertEqual((93, 62, 122), mappedVoxel.data.shape)
+        self.assertEqual(bytes(testVoxel.data), mappedVoxel.data.tobytes())
+        self.assertFalse(mappedVoxel.data.flags.writeable)
+        self.assertRaises(ValueError, readVirtualPopulation,
+                          self.voxelInfoFile, self.voxelDataFile, 'w+')
+
+    def testParseVirtualPopulationInfo(self):
+        """Single-pass info parser returns materials and grid header."""
+        materials, grid = parseVirtualPopulationInfo(self.voxelInfoFile)
+        self.assertEqual(77, len(materials))
+        self.assertEqual(('Adult_male_1_34y/Heart_muscle', 1.0, 0.0, 0.235294),
+                         materials[29])
+        self.assertEqual({'nx': 122, 'ny': 62, 'nz': 93,
+                          'dx': 0.005, 'dy': 0.005, 'dz': 0.005}, grid)
+
+    def testParseVirtualPopulationInfoError(self):
+        """Malformed info lines raise an error with the line number."""
+        with tempfile.NamedTemporaryFile('w', suffix='.txt',
+                                         delete=False) as infoFile:
+            infoFile.write('1\t0.5\t0.5\t0.5\tBone\n\nnx\t12x\n')
+        try:
+            with self.assertRaises(VirtualPopulationInfoError) as context:
+                parseVirtualPopulationInfo(infoFile.name)
+            self.assertEqual(3, context.exception.lineNumber)
+        finally:
+            os.remove(infoFile.name)
+
+    def testReadVirtualPopulationInfoIOError(self):
+        """Read errors of the info file are raised, not swallowed."""
+        with mock.patch('voxelmod.virtual_family.virtual_population.'
+                        'parseVirtualPopulationInfo',
+                        side_effect=IOError(5, 'Input/output error')):
+            with self.assertRaises(IOError):
+                readVirtualPopulation(self.voxelInfoFile, self.voxelDataFile)
+
     def testWriteVirtualPopulation(self):
         """Write Virtual Population object data to raw and info files."""
         newVoxel = VirtualPopulation()
@@ -1,5 +1,32 @@
 from .virtual_population import VirtualPopulation, \
+                                VirtualPopulationInfoError, \
+                                parseVirtualPopulationInfo, \
                                 readVirtualPopulation, \
-                                writeVirtualPopulation
+                                readVirtualPopulationInfo, \
+                                writeVirtualPopulation, \
+                                writeVirtualPopulationInfo
 
-from .reduce_voxel import ReduceVoxel
+from . import instrumentation
+
+from .progress import CancellationToken, OperationCancelled
+
+from .material_table import MaterialTable
+
+from .material_statistics import MaterialStatistics, \
+                                 computeMaterialStatistics
+
+from .run_length import RunLengthVoxelData
+
+from .chunked_voxel import ChunkedVoxelFile, \
+                           readChunkedVirtualPopulation, \
+                           writeChunkedVirtualPopulation
+
+from .derivation_cache import DerivationCache
+
+from .pyramid import buildPyramid, pyramidLevels, readPyramidLevel
+
+from .reduce_voxel import ReduceVoxel, StreamReduceVoxel, BatchReduceVoxel
+
+from .tissue_properties import TissueProperties, read_property_table
+
+from .batch import BatchReport, findModels, runBatch
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Atomic, buffered file writing for Virtual Population model files.
+
+atomicWrite() writes to a partial file next to the target and moves it over
+the target with os.replace only once the write completed, so readers see
+either the old file or the complete new one, and a crash or an exception
+never leaves a truncated file under the target name.  writeBuffer() writes
+bytes, memoryviews and numpy arrays in large chunks straight from their
+memory, without an intermediate copy.
+"""
+
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+import os
+import contextlib
+import numpy
+from .progress import IO_CHUNK_BYTES
+
+# Suffix of files that are still being written.
+PARTIAL_SUFFIX = '.partial'
+
+def partialFileName(fileName):
+    """Returns the partial file name this process writes fileName to."""
+    return fileName + '.' + str(os.getpid()) + PARTIAL_SUFFIX
+
+def _preallocate(fileHandle, size):
+    """
+    Reserve size bytes for a file with os.posix_fallocate, where the
+    platform and file system support it.
+    """
+    if size <= 0 or not hasattr(os, 'posix_fallocate'):
+        return
+    try:
+        os.posix_fallocate(fileHandle.fileno(), 0, size)
+    except OSError:
+        # The file system does not support preallocation.
+        pass
+
+@contextlib.contextmanager
+def atomicWrite(fileName, mode='wb', size=None, sync=False):
+    """
+    Open a partial file for writing and replace fileName with it once the
+    with block completes.  If the block raises, the partial file is removed
+    and fileName is left as it was.
+
+    Args:
+        fileName (str): Target file.
+        mode (str): 'wb' or 'w'.
+        size (int): Expected size in bytes.  Binary files of known size are
+                    preallocated with os.posix_fallocate where available,
+                    and truncated to what was written.
+        sync (bool): fsync the data before replacing the target, so the
+                     new file survives a power failure as well.
+    """
+    partial = partialFileName(fileName)
+    try:
+        with open(partial, mode) as fileHandle:
+            if size is not None and 'b' in mode:
+                _preallocate(fileHandle, size)
+            yield fileHandle
+            if size is not None and 'b' in mode:
+                fileHandle.truncate()
+            if sync:
+                fileHandle.flush()
+                os.fsync(fileHandle.fileno())
+        os.replace(partial, fileName)
+    finally:
+        if os.path.isfile(partial):
+            os.remove(partial)
+
+def byteView(data):
+    """
+    Returns a flat byte memoryview of bytes, a bytearray, a memoryview or a
+    numpy array.  Only arrays that are not C-contiguous are copied.
+    """
+    if isinstance(data, numpy.ndarray):
+        data = numpy.ascontiguousarray(data)
+    return memoryview(data).cast('B')
+
+def writeBuffer(fileHandle, data, chunkProgress=None,
+                chunkBytes=IO_CHUNK_BYTES):
+    """
+    Write data to a binary file in chunks of chunkBytes, straight from its
+    memory.  chunkProgress, if given, is checked before and advanced after
+    every chunk.  Returns the number of bytes written.
+    """
+    view = byteView(data)
+    try:
+        for start in range(0, view.nbytes, chunkBytes):
+            if chunkProgress is not None:
+                chunkProgress.check()
+            stop = min(start + chunkBytes, view.nbytes)
+            fileHandle.write(view[start:stop])
+            if chunkProgress is not None:
+                chunkProgress.advance(stop - start)
+        return view.nbytes
+    finally:
+        view.release()
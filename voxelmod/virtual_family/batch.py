@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Batch processing of Virtual Population model libraries.
+
+findModels() discovers the info (.txt) and data (.raw) pairs in a directory
+tree, and runBatch() applies a chain of operations to every model in a pool
+of worker processes.  An operation chain is a list of (name, parameters)
+pairs, applied in order to the model returned by the previous operation:
+
+    reduce      mapFile, backend ('translate'), cacheDir (optional
+                DerivationCache directory)
+    crop        padding (0): trim Free Space; or xRange, yRange, zRange
+    resample    factors
+    export      outputDir, fileFormat ('raw' or 'chunked'); files are written
+                to the model's directory relative to the library root,
+                under outputDir
+
+Source data is memory-mapped read-only when an operation first needs it, so
+only the pages an operation touches are loaded, and a cached reduction whose
+source file did not change is found without reading the source.  Worker
+processes can be replaced after tasksPerWorker models, which returns their
+memory to the system, and their memory can be capped with memoryLimit.
+runBatch() returns a BatchReport with one BatchResult per model; a failing
+model is reported and does not stop the others.
+
+Example:
+    report = runBatch('/data/models',
+                      [('reduce', {'mapFile': 'material_map_4.txt'}),
+                       ('export', {'outputDir': '/data/reduced'})])
+    print(report.summary())
+
+examples/run_batch.py runs a chain read from a JSON file.
+"""
+
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+import os
+import sys
+import collections
+import logging
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from .virtual_population import readVirtualPopulation, writeVirtualPopulation
+from .chunked_voxel import writeChunkedVirtualPopulation
+from .reduce_voxel import ReduceVoxel
+from .derivation_cache import DerivationCache
+
+logger = logging.getLogger(__name__)
+
+BatchResult = collections.namedtuple('BatchResult',
+                                     ['infoFile', 'dataFile', 'ok',
+                                      'seconds', 'numVoxels', 'outputs',
+                                      'error'])
+
+def findModels(rootDir):
+    """
+    Returns the sorted (info, data) file pairs of every model in the
+    directory tree under rootDir: each .txt file with a .raw file of the
+    same name next to it.
+    """
+    models = []
+    for (dirPath, dirNames, fileNames) in os.walk(rootDir):
+        dirNames.sort()
+        names = set(fileNames)
+        for fileName in sorted(fileNames):
+            (base, extension) = os.path.splitext(fileName)
+            if extension == '.txt' and base + '.raw' in names:
+                models.append((os.path.join(dirPath, fileName),
+                               os.path.join(dirPath, base + '.raw')))
+    return models
+
+def _reduce(voxelModel, context, mapFile, backend='translate',
+            cacheDir=None):
+    """Reduce the materials with a map file."""
+    cache = None if cacheDir is None else DerivationCache(cacheDir)
+    return ReduceVoxel(mapFile, voxelModel, backend,
+                       cache=cache).voxel_model
+
+def _crop(voxelModel, context, padding=0, xRange=None, yRange=None,
+          zRange=None):
+    """Crop to the given ranges, or trim Free Space if none are given."""
+    if xRange is None and yRange is None and zRange is None:
+        return voxelModel.trimFreeSpace(padding)[0]
+    return voxelModel.subRegion(xRange, yRange, zRange)
+
+def _resample(voxelModel, context, factors):
+    """Resample the grid by factors."""
+    return voxelModel.resample(factors)
+
+def _export(voxelModel, context, outputDir, fileFormat='raw'):
+    """Write the model below outputDir, mirroring the library tree."""
+    exportDir = os.path.join(outputDir, context['relDir'])
+    if not os.path.isdir(exportDir):
+        os.makedirs(exportDir, exist_ok=True)
+    if fileFormat == 'raw':
+        status = writeVirtualPopulation(voxelModel, exportDir)
+        extension = '.raw'
+    elif fileFormat == 'chunked':
+        status = writeChunkedVirtualPopulation(voxelModel, exportDir)
+        extension = '.vxc'
+    else:
+        raise ValueError("Unknown export format: " + str(fileFormat))
+    if status != 0:
+        raise IOError("Could not write " + voxelModel.name + " to " +
+                      exportDir)
+    fileName = os.path.join(exportDir, voxelModel.name)
+    context['outputs'].extend([fileName + '.txt', fileName + extension])
+    return voxelModel
+
+# Operation name -> function(voxelModel, context, **parameters)
+BATCH_OPERATIONS = {'reduce': _reduce,
+                    'crop': _crop,
+                    'resample': _resample,
+                    'export': _export}
+
+def processModel(infoFile, dataFile, operations, relDir=''):
+    """
+    Apply an operation chain to one model.  Errors are caught and reported
+    in the returned BatchResult.
+    """
+    start = time.perf_counter()
+    context = {'relDir': relDir, 'outputs': []}
+    numVoxels = 0
+    try:
+        voxelModel = readVirtualPopulation(infoFile, dataFile, mmapMode='r',
+                                           lazy=True)
+        numVoxels = voxelModel.nx * voxelModel.ny * voxelModel.nz
+        for (name, parameters) in operations:
+            voxelModel = BATCH_OPERATIONS[name](voxelModel, context,
+                                                **parameters)
+    except Exception as e:
+        return BatchResult(infoFile, dataFile, False,
+                           time.perf_counter() - start, numVoxels,
+                           context['outputs'],
+                           type(e).__name__ + ": " + str(e))
+    return BatchResult(infoFile, dataFile, True, time.perf_counter() - start,
+                       numVoxels, context['outputs'], None)
+
+def _failedResult(job, error):
+    """Returns the BatchResult of a job whose worker did not report back."""
+    return BatchResult(job[0], job[1], False, 0.0, 0, [],
+                       type(error).__name__ + ": " + str(error))
+
+def _limitMemory(memoryLimit):
+    """
+    Worker initializer: cap the memory of the worker process.
+
+    On Linux RLIMIT_DATA is capped.  It counts the heap and private writable
+    mappings, but not the read-only memory maps of the source files.
+    Elsewhere the address space (RLIMIT_AS) is capped, which counts mapped
+    source files in full.
+    """
+    if memoryLimit is None:
+        return
+    try:
+        import resource
+    except ImportError:
+        # Not available on this platform.
+        return
+    limit = resource.RLIMIT_DATA if sys.platform.startswith('linux') \
+        else resource.RLIMIT_AS
+    resource.setrlimit(limit, (memoryLimit, memoryLimit))
+
+def _newExecutor(workers, memoryLimit, tasksPerWorker):
+    """Returns a process pool whose workers run _limitMemory first."""
+    try:
+        return ProcessPoolExecutor(workers, initializer=_limitMemory,
+                                   initargs=(memoryLimit,),
+                                   max_tasks_per_child=tasksPerWorker)
+    except TypeError:
+        # max_tasks_per_child needs Python 3.11.
+        return ProcessPoolExecutor(workers, initializer=_limitMemory,
+                                   initargs=(memoryLimit,))
+
+def _runPool(jobs, workers, memoryLimit, tasksPerWorker):
+    """
+    Run jobs in a new process pool.
+
+    Returns (results, broken): a BatchResult per job, and the indices of the
+    jobs that were lost because a worker died (killed, crashed or failed to
+    start) and broke the pool.  Their results are failures.
+    """
+    results = [None] * len(jobs)
+    broken = []
+    with _newExecutor(workers, memoryLimit, tasksPerWorker) as executor:
+        futures = []
+        for job in jobs:
+            try:
+                future = executor.submit(processModel, *job)
+            except (BrokenProcessPool, OSError) as e:
+                # The pool broke, or could not start a worker, while jobs
+                # were still being submitted.
+                future = Future()
+                future.set_exception(e)
+            futures.append(future)
+        for (index, (job, future)) in enumerate(zip(jobs, futures)):
+            try:
+                results[index] = future.result()
+            except BrokenProcessPool as e:
+                results[index] = _failedResult(job, e)
+                broken.append(index)
+            except Exception as e:
+                results[index] = _failedResult(job, e)
+            logger.info("%s done", job[0])
+    return (results, broken)
+
+class BatchReport(object):
+    """
+    Results of a batch run, one BatchResult per model in discovery order.
+    """
+    def __init__(self, results, seconds):
+        self._results = results
+        self._seconds = seconds
+
+    @property
+    def results(self):
+        """Returns the BatchResult of every model."""
+        return self._results
+
+    @property
+    def seconds(self):
+        """Returns the wall time of the batch run."""
+        return self._seconds
+
+    @property
+    def failed(self):
+        """Returns the results of the models that failed."""
+        return [result for result in self._results if not result.ok]
+
+    def summary(self):
+        """Returns a text summary: totals, then one line per failure."""
+        numVoxels = sum(result.numVoxels for result in self._results
+                        if result.ok)
+        lines = ["{0} models, {1} succeeded, {2} failed in {3:.1f} s "
+                 "({4:.1f} Mvoxel/s)".format(
+                     len(self._results),
+                     len(self._results) - len(self.failed),
+                     len(self.failed), self._seconds,
+                     numVoxels / max(self._seconds, 1e-9) / 1e6)]
+        for result in self.failed:
+            lines.append("FAILED " + result.infoFile + ": " + result.error)
+        return '\n'.join(lines)
+
+def runBatch(rootDir, operations, workers=None, memoryLimit=None,
+             tasksPerWorker=None):
+    """
+    Apply an operation chain to every model under rootDir.
+
+    Args:
+        rootDir (str): Root of the model library.
+        operations (list): (name, parameters) pairs, see BATCH_OPERATIONS.
+        workers (int): Number of worker processes (default: one per CPU);
+                       with 1 and no memoryLimit, models are processed in
+                       this process.
+        memoryLimit (int): Optional memory limit of each worker, in bytes;
+                           a model exceeding it fails with MemoryError.
+                           On Linux the memory-mapped source does not
+                           count against it.  Elsewhere the limit caps the
+                           address space, so it must exceed the size of
+                           the source data file plus the working memory.
+        tasksPerWorker (int): Models handled by a worker process before it
+                              is replaced (default: never replaced).  A
+                              limit starts workers with the spawn method,
+                              which costs an interpreter start each.
+
+    Returns:
+        :obj:`BatchReport`: Result of every model.  The models lost when
+                            a worker process dies are retried in a new
+                            pool, and those lost again one at a time; a
+                            model that kills its worker on its own fails
+                            with BrokenProcessPool.
+    """
+    operations = [(name, dict(parameters)) for (name, parameters)
+                  in operations]
+    for (name, _) in operations:
+        if name not in BATCH_OPERATIONS:
+            raise ValueError("Unknown batch operation: " + str(name))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    rootDir = os.path.realpath(rootDir)
+    jobs = [(infoFile, dataFile, operations,
+             os.path.relpath(os.path.dirname(infoFile), rootDir))
+            for (infoFile, dataFile) in findModels(rootDir)]
+
+    start = time.perf_counter()
+    if workers == 1 and memoryLimit is None:
+        results = []
+        for job in jobs:
+            results.append(processModel(*job))
+            logger.info("%s done", job[0])
+    else:
+        (results, broken) = _runPool(jobs, workers, memoryLimit,
+                                     tasksPerWorker)
+        # A dying worker breaks the whole pool, failing every model still
+        # queued or running.  Those are retried together in a new pool, and
+        # the ones lost again each in a pool of its own, so only a model
+        # that kills its worker by itself fails.
+        if broken:
+            (retried, lost) = _runPool([jobs[index] for index in broken],
+                                       min(workers, len(broken)),
+                                       memoryLimit, tasksPerWorker)
+            for (index, result) in zip(broken, retried):
+                results[index] = result
+            for index in [broken[retry] for retry in lost]:
+                results[index] = _runPool([jobs[index]], 1, memoryLimit,
+                                          None)[0][0]
+    return BatchReport(results, time.perf_counter() - start)
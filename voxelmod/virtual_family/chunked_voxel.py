@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Compressed, chunked on-disk storage for Virtual Population voxel data.
+
+The voxel data is split into bricks of z-, y- and x-slices, each brick is
+compressed on its own, and an index of brick offsets is stored at the end of
+the file, so any single brick can be read without touching the others.  The
+metadata stays in the usual Virtual Population info (.txt) file.
+
+File layout (little endian):
+    header   magic, codec, brick shape (bz, by, bx), grid (nz, ny, nx),
+             index offset
+    bricks   compressed brick data, in z, y, x brick order
+    index    (offset, length) of every brick
+"""
+
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+import os
+from os.path import sep
+import struct
+import zlib
+import lzma
+import logging
+import numpy
+from .atomic_file import atomicWrite
+from .virtual_population import (readVirtualPopulationInfo,
+                                 writeVirtualPopulationInfo)
+
+logger = logging.getLogger(__name__)
+
+CHUNK_MAGIC = b'VPCHUNK1'
+CHUNK_HEADER = struct.Struct('<8sB3I3IQ')
+CHUNK_INDEX_ENTRY = struct.Struct('<QQ')
+
+# Codec name -> (codec id, compress(data, level), decompress(data))
+CHUNK_CODECS = {
+    'none': (0, lambda data, level: data, lambda data: data),
+    'zlib': (1, zlib.compress, zlib.decompress),
+    'lzma': (2, lambda data, level: lzma.compress(data, preset=level),
+             lzma.decompress),
+}
+CHUNK_CODEC_NAMES = dict((codec[0], name)
+                         for (name, codec) in CHUNK_CODECS.items())
+
+def _brickRanges(size, brickSize):
+    """Return (start, stop) pairs splitting one axis into bricks."""
+    return [(start, min(start + brickSize, size))
+            for start in range(0, size, brickSize)]
+
+class ChunkedVoxelFile(object):
+    """
+    Random access reader for a chunked voxel data (.vxc) file.
+
+    Args:
+        fileName (str): Chunked voxel data file.
+    """
+    def __init__(self, fileName):
+        self._fileName = fileName
+        self._fileHandle = open(fileName, 'rb')
+        header = self._fileHandle.read(CHUNK_HEADER.size)
+        if len(header) != CHUNK_HEADER.size:
+            self.close()
+            raise ValueError("Not a chunked voxel file: " + fileName)
+        (magic, codecId, bz, by, bx, nz, ny, nx,
+         indexOffset) = CHUNK_HEADER.unpack(header)
+        if magic != CHUNK_MAGIC or codecId not in CHUNK_CODEC_NAMES:
+            self.close()
+            raise ValueError("Not a chunked voxel file: " + fileName)
+        self._codec = CHUNK_CODEC_NAMES[codecId]
+        self._brickShape = (bz, by, bx)
+        self._shape = (nz, ny, nx)
+        self._ranges = [_brickRanges(n, b) for (n, b) in
+                        zip(self._shape, self._brickShape)]
+        numBricks = self.numBricks
+        self._fileHandle.seek(indexOffset)
+        index = self._fileHandle.read(
+            numBricks[0] * numBricks[1] * numBricks[2] *
+            CHUNK_INDEX_ENTRY.size)
+        self._index = list(CHUNK_INDEX_ENTRY.iter_unpack(index))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        self.close()
+
+    def close(self):
+        """Close the underlying file."""
+        self._fileHandle.close()
+
+    @property
+    def codec(self):
+        """Returns the name of the compression codec."""
+        return self._codec
+
+    @property
+    def shape(self):
+        """Returns the grid shape (nz, ny, nx)."""
+        return self._shape
+
+    @property
+    def brickShape(self):
+        """Returns the full brick shape (bz, by, bx)."""
+        return self._brickShape
+
+    @property
+    def numBricks(self):
+        """Returns the number of bricks along z, y and x."""
+        return tuple(len(ranges) for ranges in self._ranges)
+
+    def brickBounds(self, kz, ky, kx):
+        """Returns the (start, stop) voxel ranges along z, y, x of a brick."""
+        return (self._ranges[0][kz], self._ranges[1][ky], self._ranges[2][kx])
+
+    def readBrick(self, kz, ky, kx):
+        """
+        Read and decompress a single brick.
+
+        Returns a uint8 array shaped like the brick; bricks on the upper
+        edges of the grid may be smaller than brickShape.
+        """
+        numBricks = self.numBricks
+        if not (0 <= kz < numBricks[0] and 0 <= ky < numBricks[1] and
+                0 <= kx < numBricks[2]):
+            raise IndexError("Brick (" + str(kz) + ", " + str(ky) + ", " +
+                             str(kx) + ") is out of range " + str(numBricks))
+        (offset, length) = self._index[(kz * numBricks[1] + ky) *
+                                       numBricks[2] + kx]
+        self._fileHandle.seek(offset)
+        data = CHUNK_CODECS[self._codec][2](self._fileHandle.read(length))
+        shape = tuple(stop - start for (start, stop) in
+                      self.brickBounds(kz, ky, kx))
+        return numpy.frombuffer(data, dtype=numpy.uint8).reshape(shape)
+
+    def read(self):
+        """Read the whole grid into a bytearray in .raw (z, y, x) order."""
+        data = bytearray(self._shape[0] * self._shape[1] * self._shape[2])
+        voxels = numpy.frombuffer(data, dtype=numpy.uint8).reshape(self._shape)
+        numBricks = self.numBricks
+        for kz in range(numBricks[0]):
+            for ky in range(numBricks[1]):
+                for kx in range(numBricks[2]):
+                    ((z0, z1), (y0, y1), (x0, x1)) = \
+                        self.brickBounds(kz, ky, kx)
+                    voxels[z0:z1, y0:y1, x0:x1] = self.readBrick(kz, ky, kx)
+        return data
+
+# Writer helper function
+def writeChunkedVirtualPopulation(vpVoxel, filePath=None,
+                                  brickShape=(64, 64, 64), codec='zlib',
+                                  level=6):
+    """
+    Write a Virtual Population info file and a compressed, chunked data
+    (.vxc) file from the given Virtual Population voxel object.
+    """
+    if codec not in CHUNK_CODECS:
+        raise ValueError("Unknown codec: " + str(codec))
+    if filePath is None:
+        filePath = os.getcwd()
+    if not os.path.isdir(filePath):
+        logger.error("Directory (%s) not found.", filePath)
+        return -1
+
+    fileName = os.path.realpath(filePath + sep + vpVoxel.name)
+
+    voxels = vpVoxel.array
+    if voxels.dtype.itemsize != 1:
+        raise ValueError("Chunked voxel files hold one byte labels; "
+                         "narrow the labels first.")
+    (codecId, compress, _) = CHUNK_CODECS[codec]
+    ranges = [_brickRanges(n, b) for (n, b) in zip(voxels.shape, brickShape)]
+    index = []
+    with atomicWrite(fileName + '.vxc', 'wb') as fileHandle:
+        fileHandle.seek(CHUNK_HEADER.size)
+        for (z0, z1) in ranges[0]:
+            for (y0, y1) in ranges[1]:
+                for (x0, x1) in ranges[2]:
+                    brick = compress(voxels[z0:z1, y0:y1, x0:x1].tobytes(),
+                                     level)
+                    index.append((fileHandle.tell(), len(brick)))
+                    fileHandle.write(brick)
+        indexOffset = fileHandle.tell()
+        for entry in index:
+            fileHandle.write(CHUNK_INDEX_ENTRY.pack(*entry))
+        fileHandle.seek(0)
+        fileHandle.write(CHUNK_HEADER.pack(CHUNK_MAGIC, codecId,
+                                           *(tuple(brickShape) +
+                                             voxels.shape + (indexOffset,))))
+    return writeVirtualPopulationInfo(vpVoxel, fileName + '.txt')
+
+# Reader helper function
+def readChunkedVirtualPopulation(infoFile, chunkFile, lazy=False):
+    """
+    Read a Virtual Population info file and a chunked data (.vxc) file and
+    return a Virtual Population voxel object.
+
+    If lazy is True, the bricks are only decompressed the first time data is
+    accessed.
+    """
+    voxelModel = readVirtualPopulationInfo(infoFile)
+    with ChunkedVoxelFile(chunkFile) as chunked:
+        if chunked.shape != (voxelModel.nz, voxelModel.ny, voxelModel.nx):
+            raise ValueError("Grid of " + chunkFile + " does not match " +
+                             infoFile)
+
+    def loadData():
+        """Decompress every brick of the chunked data file."""
+        with ChunkedVoxelFile(chunkFile) as chunked:
+            return chunked.read()
+
+    if lazy:
+        voxelModel.setDataLoader(loadData, chunkFile)
+    else:
+        voxelModel.data = loadData()
+    return voxelModel
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Content-addressed on-disk cache of derived Virtual Population models.
+
+A derived model (for example a reduced model) is stored under a key hashed
+from the operation name, its parameters, the contents of its input files and
+the grid, materials and voxel data of its input models.  Identical inputs
+give the same key, so a repeated derivation is read back from disk instead of
+being recomputed.
+
+Each entry is a directory holding an ordinary info (.txt) and data (.raw)
+pair.  Entries are evicted least recently used first once the cache grows
+beyond its size bound.
+
+Several processes may share a cache directory.  An entry is written to a
+partial directory and published with a single rename; the first process
+to publish a key wins, and entries that disappear while they are read or
+evicted are treated as misses.
+
+Voxel data is hashed by label content, so a model hashes alike whether its
+data is loaded, memory-mapped, run-length packed or still deferred.  File
+digests, including the label digests of deferred data files, are remembered
+by path, size and modification time, so input files that did not change are
+not hashed again.  The same holds for data memory-mapped read-only.
+"""
+
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+import os
+import glob
+import hashlib
+import json
+import shutil
+import tempfile
+import numpy
+from .virtual_population import (NARROW_LABEL,
+                                 WIDE_LABEL,
+                                 labelDtypeFor,
+                                 readVirtualPopulation,
+                                 writeVirtualPopulation)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'voxelmod')
+DEFAULT_CACHE_BYTES = 1 << 30
+
+# Name of the file digest index inside the cache directory.
+DIGEST_INDEX = 'digests.json'
+# Prefix of entries that are still being written.
+PARTIAL_PREFIX = '.partial-'
+
+# Bytes read per block while hashing a file.
+HASH_BLOCK_BYTES = 1 << 20
+
+def _newHash():
+    """Returns the hash object used for keys and digests."""
+    return hashlib.blake2b(digest_size=20)
+
+def _hashFile(fileName):
+    """Returns the hex digest of a file's bytes."""
+    fileHash = _newHash()
+    block = bytearray(HASH_BLOCK_BYTES)
+    blockView = memoryview(block)
+    with open(fileName, 'rb') as fileHandle:
+        while True:
+            numBytes = fileHandle.readinto(block)
+            if not numBytes:
+                break
+            fileHash.update(blockView[:numBytes])
+    return fileHash.hexdigest()
+
+def _hashLabels(chunks, dtype):
+    """Returns the hex digest of label arrays, each converted to dtype."""
+    labelHash = _newHash()
+    labelHash.update(b'labels:' + dtype.str.encode('ascii'))
+    for chunk in chunks:
+        labelHash.update(numpy.ascontiguousarray(chunk, dtype=dtype).data)
+    return labelHash.hexdigest()
+
+def _arrayChunks(labels):
+    """Yield a flat label array in blocks of HASH_BLOCK_BYTES labels."""
+    for start in range(0, labels.size, HASH_BLOCK_BYTES):
+        yield labels[start:start + HASH_BLOCK_BYTES]
+
+def _fileChunks(fileName, numVoxels):
+    """
+    Yield the labels of a Virtual Population data file in blocks of
+    HASH_BLOCK_BYTES labels, as uint8 or uint16 by the file size.
+    """
+    dtype = WIDE_LABEL if numVoxels and os.path.getsize(fileName) == \
+        WIDE_LABEL.itemsize * numVoxels else NARROW_LABEL
+    with open(fileName, 'rb') as fileHandle:
+        while True:
+            labels = numpy.fromfile(fileHandle, dtype=dtype,
+                                    count=HASH_BLOCK_BYTES)
+            if not labels.size:
+                break
+            yield labels
+
+def _mappedFile(labels, numVoxels):
+    """
+    Returns the file a read-only numpy.memmap maps whole, or None if labels
+    is not such a map.  Writable and copy-on-write maps may differ from
+    their file, and slices or transposes of a map do not span it in order.
+    """
+    if not isinstance(labels, numpy.memmap) or labels.flags.writeable or \
+            not labels.flags.c_contiguous or labels.size != numVoxels or \
+            not labels.filename:
+        return None
+    try:
+        if os.path.getsize(labels.filename) != labels.nbytes:
+            return None
+    except OSError:
+        return None
+    return labels.filename
+
+def _entryBytes(entryDir):
+    """
+    Returns the total size of the files of a cache entry, or 0 if another
+    process removed it.
+    """
+    try:
+        return sum(os.path.getsize(os.path.join(entryDir, fileName))
+                   for fileName in os.listdir(entryDir))
+    except FileNotFoundError:
+        return 0
+
+def _removeEntry(entryDir):
+    """Remove a cache entry, unless another process already did."""
+    try:
+        shutil.rmtree(entryDir)
+    except FileNotFoundError:
+        pass
+
+class DerivationCache(object):
+    """
+    Size-bounded, least recently used cache of derived voxel models.
+
+    Args:
+        cacheDir (str): Cache directory, created if needed (default
+                        ~/.cache/voxelmod).
+        maxBytes (int): Size bound of the stored models in bytes.
+    """
+    def __init__(self, cacheDir=None, maxBytes=DEFAULT_CACHE_BYTES):
+        if cacheDir is None:
+            cacheDir = DEFAULT_CACHE_DIR
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir, exist_ok=True)
+        self._cacheDir = os.path.realpath(cacheDir)
+        self._maxBytes = maxBytes
+        self._digests = {}
+        indexFile = os.path.join(self._cacheDir, DIGEST_INDEX)
+        if os.path.isfile(indexFile):
+            try:
+                with open(indexFile, 'r') as fileHandle:
+                    self._digests = json.load(fileHandle)
+            except ValueError:
+                self._digests = {}
+
+    @property
+    def cacheDir(self):
+        """Returns the cache directory."""
+        return self._cacheDir
+
+    @property
+    def maxBytes(self):
+        """Returns the size bound of the cache in bytes."""
+        return self._maxBytes
+
+    def _entries(self):
+        """Returns the directories of all complete cache entries."""
+        return [os.path.join(self._cacheDir, name)
+                for name in os.listdir(self._cacheDir)
+                if not name.startswith(PARTIAL_PREFIX) and
+                os.path.isdir(os.path.join(self._cacheDir, name))]
+
+    @property
+    def size(self):
+        """Returns the total size of the stored models in bytes."""
+        return sum(_entryBytes(entryDir) for entryDir in self._entries())
+
+    def __len__(self):
+        return len(self._entries())
+
+    def __contains__(self, key):
+        return os.path.isdir(os.path.join(self._cacheDir, key))
+
+    def _rememberedDigest(self, fileName, kind, compute):
+        """
+        Returns compute(fileName), remembered in the digest index under the
+        file's path and kind while its size and modification time are
+        unchanged.
+        """
+        fileName = os.path.realpath(fileName)
+        status = os.stat(fileName)
+        stamp = [status.st_size, status.st_mtime_ns]
+        indexKey = fileName if kind is None else fileName + '#' + kind
+        known = self._digests.get(indexKey)
+        if known is not None and known[0] == stamp:
+            return known[1]
+        digest = compute(fileName)
+        self._digests[indexKey] = [stamp, digest]
+        self._saveDigests()
+        return digest
+
+    def fileDigest(self, fileName):
+        """
+        Returns the hex digest of a file's contents.  Digests are reused
+        while the file's size and modification time are unchanged.
+        """
+        return self._rememberedDigest(fileName, None, _hashFile)
+
+    def _saveDigests(self):
+        """Write the file digest index, replacing the old one atomically."""
+        (handle, tempName) = tempfile.mkstemp(dir=self._cacheDir,
+                                              prefix=PARTIAL_PREFIX)
+        with os.fdopen(handle, 'w') as fileHandle:
+            json.dump(self._digests, fileHandle)
+        os.replace(tempName, os.path.join(self._cacheDir, DIGEST_INDEX))
+
+    def modelDigest(self, voxelModel):
+        """
+        Returns the hex digest of a voxel model's name, grid, materials and
+        voxel labels.  Labels are hashed as labelDtypeFor(numMaterials), so
+        the digest does not depend on how the data is held.  Data that is
+        still deferred or memory-mapped read-only is hashed from its data
+        file, without loading it, and the digest is remembered like a file
+        digest.
+        """
+        modelHash = _newHash()
+        materials = voxelModel.materials
+        header = [voxelModel.name,
+                  voxelModel.nx, voxelModel.ny, voxelModel.nz,
+                  voxelModel.dx, voxelModel.dy, voxelModel.dz,
+                  [materials.record(i) for i in range(len(materials))]]
+        modelHash.update(json.dumps(header).encode('utf-8'))
+        dtype = labelDtypeFor(voxelModel.numMaterials)
+        numVoxels = voxelModel.nx * voxelModel.ny * voxelModel.nz
+        dataFile = voxelModel.deferredDataFile
+        runLength = voxelModel.runLength
+        if dataFile is None and runLength is None and voxelModel.dataLoaded:
+            dataFile = _mappedFile(voxelModel.data, numVoxels)
+        if dataFile is not None:
+            digest = self._rememberedDigest(
+                dataFile, 'labels:' + dtype.str,
+                lambda fileName: _hashLabels(_fileChunks(fileName, numVoxels),
+                                             dtype))
+        elif runLength is not None:
+            digest = _hashLabels((runLength.readSlice(z).reshape(-1)
+                                  for z in range(voxelModel.nz)), dtype)
+        elif voxelModel.data is not None:
+            digest = _hashLabels(_arrayChunks(voxelModel.array.reshape(-1)),
+                                 dtype)
+        else:
+            digest = None
+        if digest is not None:
+            modelHash.update(b'data:' + digest.encode('ascii'))
+        return modelHash.hexdigest()
+
+    def key(self, operation, models=(), files=(), **params):
+        """
+        Returns the cache key of an operation applied to the given models
+        and input files with the given (JSON serializable) parameters.
+        """
+        keyHash = _newHash()
+        keyHash.update(json.dumps([operation, sorted(params.items())]
+                                  ).encode('utf-8'))
+        for voxelModel in models:
+            keyHash.update(self.modelDigest(voxelModel).encode('ascii'))
+        for fileName in files:
+            keyHash.update(self.fileDigest(fileName).encode('ascii'))
+        return keyHash.hexdigest()
+
+    def get(self, key):
+        """
+        Returns the model stored under key, read into memory, or None.
+        A hit marks the entry as most recently used; an entry that can not
+        be read, for example because another process is evicting it, is a
+        miss.
+        """
+        entryDir = os.path.join(self._cacheDir, key)
+        infoFiles = glob.glob(os.path.join(glob.escape(entryDir), '*.txt'))
+        if len(infoFiles) != 1:
+            return None
+        infoFile = infoFiles[0]
+        dataFile = os.path.splitext(infoFile)[0] + '.raw'
+        if not os.path.isfile(dataFile):
+            return None
+        try:
+            voxelModel = readVirtualPopulation(infoFile, dataFile)
+        except Exception:
+            # The reader raises plain Exceptions for missing files.
+            return None
+        if voxelModel.data is None:
+            return None
+        try:
+            os.utime(entryDir, None)
+        except FileNotFoundError:
+            pass
+        return voxelModel
+
+    def put(self, key, voxelModel):
+        """
+        Store a model under key and evict least recently used entries until
+        the cache fits its size bound again.  If the key is already stored,
+        for example by another process, the stored entry is kept.
+        """
+        entryDir = os.path.join(self._cacheDir, key)
+        partialDir = tempfile.mkdtemp(dir=self._cacheDir,
+                                      prefix=PARTIAL_PREFIX)
+        try:
+            if writeVirtualPopulation(voxelModel, partialDir) != 0:
+                return
+            try:
+                os.rename(partialDir, entryDir)
+            except OSError:
+                # A key always derives the same model, so an entry that was
+                # published first is as good as this one.
+                if not os.path.isdir(entryDir):
+                    raise
+        finally:
+            _removeEntry(partialDir)
+        self.evict()
+
+    def derive(self, key, compute):
+        """
+        Returns the model stored under key, or computes it with compute()
+        and stores it.
+        """
+        voxelModel = self.get(key)
+        if voxelModel is None:
+            voxelModel = compute()
+            self.put(key, voxelModel)
+        return voxelModel
+
+    def evict(self, maxBytes=None):
+        """
+        Remove least recently used entries until the cache holds at most
+        maxBytes (default: the cache's size bound).
+        """
+        if maxBytes is None:
+            maxBytes = self._maxBytes
+        entries = []
+        for entryDir in self._entries():
+            try:
+                entries.append((os.path.getmtime(entryDir), entryDir,
+                                _entryBytes(entryDir)))
+            except FileNotFoundError:
+                # Evicted by another process.
+                continue
+        total = sum(entry[2] for entry in entries)
+        for (_, entryDir, entryBytes) in sorted(entries):
+            if total <= maxBytes:
+                break
+            _removeEntry(entryDir)
+            total -= entryBytes
+
+    def clear(self):
+        """Remove every entry and the file digest index."""
+        for entryDir in self._entries():
+            _removeEntry(entryDir)
+        self._digests = {}
+        indexFile = os.path.join(self._cacheDir, DIGEST_INDEX)
+        if os.path.isfile(indexFile):
+            os.remove(indexFile)
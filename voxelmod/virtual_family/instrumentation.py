@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Timers, counters and hooks for the voxelmod hot paths.
+
+Each stage of reading, reducing and writing a model (for example
+'read.info' or 'reduce.remap') is wrapped in stage(), which times it and
+counts the voxels and bytes it handled.  Finished stages are passed as
+StageEvent tuples to the installed hooks, and summed per stage name while
+statistics are enabled.
+
+Example:
+    from voxelmod.virtual_family import instrumentation
+    instrumentation.enableStatistics()
+    instrumentation.addStageHook(instrumentation.logStage)
+    reduced = ReduceVoxel(mapFile, voxelModel).voxel_model
+    print(instrumentation.stageStatistics()['reduce.remap'])
+
+With no hook installed and statistics disabled, stage() returns a shared
+no-op context manager without reading the clock.
+
+Messages of the voxelmod modules go to loggers named after the modules,
+under 'voxelmod', instead of stdout.
+"""
+
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+import collections
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+StageEvent = collections.namedtuple('StageEvent',
+                                    ['stage', 'seconds', 'voxels',
+                                     'numBytes'])
+
+_hooks = []
+_statistics = None
+
+class _Stage(object):
+    """
+    Times one stage.  voxels and numBytes may be updated inside the with
+    block, once they are known.
+    """
+    __slots__ = ('name', 'voxels', 'numBytes', '_start')
+
+    def __init__(self, name, voxels, numBytes):
+        self.name = name
+        self.voxels = voxels
+        self.numBytes = numBytes
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *excInfo):
+        event = StageEvent(self.name, time.perf_counter() - self._start,
+                           self.voxels, self.numBytes)
+        if _statistics is not None:
+            totals = _statistics.setdefault(self.name, [0, 0.0, 0, 0])
+            totals[0] += 1
+            totals[1] += event.seconds
+            totals[2] += event.voxels
+            totals[3] += event.numBytes
+        for hook in list(_hooks):
+            hook(event)
+        return False
+
+class _NullStage(object):
+    """Shared stage used while instrumentation is off; ignores updates."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+def stage(name, voxels=0, numBytes=0):
+    """
+    Returns a context manager timing the named stage, which handles the
+    given number of voxels and bytes.
+    """
+    if not _hooks and _statistics is None:
+        return _NULL_STAGE
+    return _Stage(name, voxels, numBytes)
+
+def addStageHook(hook):
+    """Call hook(event) with a StageEvent after every stage."""
+    _hooks.append(hook)
+
+def removeStageHook(hook):
+    """Remove a hook installed with addStageHook."""
+    _hooks.remove(hook)
+
+def logStage(event):
+    """Stage hook logging every stage at DEBUG level."""
+    logger.debug("%s: %.6f s, %d voxels, %d bytes", event.stage,
+                 event.seconds, event.voxels, event.numBytes)
+
+def enableStatistics(enabled=True):
+    """Start (or stop, if enabled is False) summing stages per name."""
+    global _statistics
+    if not enabled:
+        _statistics = None
+    elif _statistics is None:
+        _statistics = {}
+
+def resetStatistics():
+    """Clear the summed stage statistics."""
+    if _statistics is not None:
+        _statistics.clear()
+
+def stageStatistics():
+    """
+    Returns {stage: {'calls', 'seconds', 'voxels', 'bytes'}} summed since
+    statistics were enabled or last reset.
+    """
+    if _statistics is None:
+        return {}
+    return dict((name, {'calls': totals[0], 'seconds': totals[1],
+                        'voxels': totals[2], 'bytes': totals[3]})
+                for (name, totals) in _statistics.items())
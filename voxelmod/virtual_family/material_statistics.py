@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Per-material voxel statistics of Virtual Population label volumes.
+
+A single pass over the voxel data, one z-slice at a time, yields the voxel
+count, bounding box and centroid of every material index.
+"""
+
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+import numpy
+
+class MaterialStatistics(object):
+    """
+    Voxel count, bounding box and centroid of every material index.
+
+    Bounding boxes are ((x0, x1), (y0, y1), (z0, z1)) index ranges and
+    centroids are (x, y, z) in voxel index units; both are None for
+    materials without voxels.
+
+    Args:
+        counts (numpy.ndarray): Voxel count per material index.
+        lower (numpy.ndarray): (numMaterials, 3) lowest x, y, z index.
+        upper (numpy.ndarray): (numMaterials, 3) highest x, y, z index + 1.
+        sums (numpy.ndarray): (numMaterials, 3) sums of x, y, z indices.
+    """
+    def __init__(self, counts, lower, upper, sums):
+        self._counts = counts
+        self._lower = lower
+        self._upper = upper
+        self._sums = sums
+
+    @property
+    def counts(self):
+        """Returns the voxel count of every material index."""
+        return self._counts
+
+    def count(self, matNum):
+        """Returns the number of voxels of a material index."""
+        if 0 <= matNum < len(self._counts):
+            return int(self._counts[matNum])
+        return 0
+
+    def boundingBox(self, matNum):
+        """Returns the ((x0, x1), (y0, y1), (z0, z1)) ranges of a material."""
+        if not self.count(matNum):
+            return None
+        return tuple((int(lower), int(upper)) for (lower, upper) in
+                     zip(self._lower[matNum], self._upper[matNum]))
+
+    def centroid(self, matNum):
+        """Returns the (x, y, z) centroid of a material, in voxel units."""
+        if not self.count(matNum):
+            return None
+        return tuple(float(total) / self._counts[matNum]
+                     for total in self._sums[matNum])
+
+    def emptyMaterials(self):
+        """Returns the material indices that have no voxels."""
+        return [int(matNum) for matNum in numpy.flatnonzero(self._counts == 0)]
+
+def computeMaterialStatistics(array, numMaterials=0):
+    """
+    Compute MaterialStatistics of a (nz, ny, nx) label array.
+
+    numMaterials sets the minimum number of material indices reported; labels
+    above it are included as well.
+    """
+    (nz, ny, nx) = array.shape
+    numLabels = max(numMaterials, int(array.max()) + 1 if array.size else 0)
+    counts = numpy.zeros(numLabels, dtype=numpy.int64)
+    sums = numpy.zeros((numLabels, 3))
+    xPresent = numpy.zeros((nx, numLabels), dtype=bool)
+    yPresent = numpy.zeros((ny, numLabels), dtype=bool)
+    zPresent = numpy.zeros((nz, numLabels), dtype=bool)
+    xIndex = numpy.tile(numpy.arange(nx), ny)
+    yIndex = numpy.repeat(numpy.arange(ny), nx)
+    for z in range(nz):
+        labels = numpy.ascontiguousarray(array[z]).reshape(-1)
+        sliceCounts = numpy.bincount(labels, minlength=numLabels)
+        counts += sliceCounts
+        zPresent[z] = sliceCounts > 0
+        sums[:, 0] += numpy.bincount(labels, weights=xIndex,
+                                     minlength=numLabels)
+        sums[:, 1] += numpy.bincount(labels, weights=yIndex,
+                                     minlength=numLabels)
+        sums[:, 2] += sliceCounts * z
+        xPresent[xIndex, labels] = True
+        yPresent[yIndex, labels] = True
+
+    lower = numpy.zeros((numLabels, 3), dtype=numpy.int64)
+    upper = numpy.zeros((numLabels, 3), dtype=numpy.int64)
+    for (axis, present) in enumerate((xPresent, yPresent, zPresent)):
+        lower[:, axis] = present.argmax(axis=0)
+        upper[:, axis] = len(present) - present[::-1].argmax(axis=0)
+    return MaterialStatistics(counts, lower, upper, sums)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+MaterialTable class holds the indexed material list of a voxel model.
+
+Names and RGB colors are kept in parallel lists indexed by material number,
+with dictionaries from full names ('Adult_male_1_34y/Heart_muscle') and
+short names ('Heart_muscle') to material numbers for O(1) lookup.
+"""
+
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+
+# Marks a short name shared by several materials in the short name index.
+_AMBIGUOUS = -1
+
+def shortMaterialName(name):
+    """Returns the material name without its model prefix."""
+    return name.split('/')[-1]
+
+class MaterialTable(object):
+    """
+    Indexed table of material names and RGB colors.
+
+    Material 0 is always 'Free Space'.
+    """
+    __slots__ = ('_names', '_colors', '_nameIndex', '_shortNameIndex')
+
+    def __init__(self):
+        self._names = []
+        self._colors = []
+        self._nameIndex = {}
+        self._shortNameIndex = {}
+        self.append('Free Space', 0.0, 0.0, 0.0)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        return name in self._nameIndex or \
+               self._shortNameIndex.get(name, _AMBIGUOUS) != _AMBIGUOUS
+
+    def _indexName(self, matNum):
+        """Add the names of a material to the lookup dictionaries."""
+        name = self._names[matNum]
+        self._nameIndex.setdefault(name, matNum)
+        shortName = shortMaterialName(name)
+        if self._shortNameIndex.get(shortName, matNum) != matNum:
+            self._shortNameIndex[shortName] = _AMBIGUOUS
+        else:
+            self._shortNameIndex[shortName] = matNum
+
+    def _reindex(self):
+        """Rebuild the lookup dictionaries after materials moved."""
+        self._nameIndex = {}
+        self._shortNameIndex = {}
+        for matNum in range(len(self._names)):
+            self._indexName(matNum)
+
+    def copy(self):
+        """Returns an independent copy of the table."""
+        table = MaterialTable.__new__(MaterialTable)
+        table._names = list(self._names)
+        table._colors = list(self._colors)
+        table._nameIndex = dict(self._nameIndex)
+        table._shortNameIndex = dict(self._shortNameIndex)
+        return table
+
+    def append(self, name, red, green, blue):
+        """Add a material to the end of the table and return its number."""
+        self._names.append(name)
+        self._colors.append((red, green, blue))
+        self._indexName(len(self._names) - 1)
+        return len(self._names) - 1
+
+    def record(self, matNum):
+        """Returns [number, name, red, green, blue] of a material."""
+        if not 0 <= matNum < len(self._names):
+            raise IndexError("Material index " + str(matNum) +
+                             " is out of range.  Valid range is [0, " +
+                             str(len(self._names)) + ")")
+        return [matNum, self._names[matNum]] + list(self._colors[matNum])
+
+    def name(self, matNum):
+        """Returns the full name of a material."""
+        return self._names[matNum]
+
+    def shortName(self, matNum):
+        """Returns the name of a material without its model prefix."""
+        return shortMaterialName(self._names[matNum])
+
+    def color(self, matNum):
+        """Returns the (red, green, blue) color of a material."""
+        return self._colors[matNum]
+
+    def index(self, name):
+        """
+        Returns the number of the material with the given full or short
+        name.  Raises KeyError if there is none, or if a short name is
+        shared by several materials.
+        """
+        if name in self._nameIndex:
+            return self._nameIndex[name]
+        matNum = self._shortNameIndex.get(name)
+        if matNum is None:
+            raise KeyError("No material named " + repr(name))
+        if matNum == _AMBIGUOUS:
+            raise KeyError("Material name " + repr(name) + " is ambiguous")
+        return matNum
+
+    def remove(self, name):
+        """
+        Remove every material with the given full name; later materials
+        move down.  Returns the removed material numbers.
+        """
+        removed = [matNum for (matNum, matName) in enumerate(self._names)
+                   if matName == name]
+        if removed:
+            removedSet = set(removed)
+            self.reorder([matNum for matNum in range(len(self._names))
+                          if matNum not in removedSet])
+        return removed
+
+    def reorder(self, order):
+        """
+        Rebuild the table from the materials numbered in order, so that
+        material order[i] becomes material i.  Materials left out are
+        dropped.
+        """
+        self._names = [self._names[matNum] for matNum in order]
+        self._colors = [self._colors[matNum] for matNum in order]
+        self._reindex()
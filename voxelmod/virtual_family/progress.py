@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Progress reporting and cancellation of long-running voxelmod operations.
+
+Reading, reducing and writing process the voxel data in chunks.  Between
+chunks they call an optional progress callback,
+
+    progress(stage, done, total)
+
+with the stage name ('read.data', 'reduce.remap', 'write.data', ...) and
+the amount of work done so far and in total (bytes or voxels, whichever the
+stage counts), and check an optional CancellationToken.  Once the token is
+cancelled, the operation raises OperationCancelled at the next chunk and
+removes any output file it had started.
+"""
+
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+import threading
+
+# Bytes read or written per chunk by the file readers and writers.
+IO_CHUNK_BYTES = 1 << 24
+
+class OperationCancelled(Exception):
+    """Raised by an operation whose CancellationToken was cancelled."""
+    pass
+
+class CancellationToken(object):
+    """
+    Cancellation flag shared between an operation and its controller.
+    cancel() may be called from any thread.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        """Ask the operations holding this token to stop."""
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        """Returns True once cancel() has been called."""
+        return self._event.is_set()
+
+    def check(self):
+        """Raise OperationCancelled if the token was cancelled."""
+        if self._event.is_set():
+            raise OperationCancelled("Operation cancelled.")
+
+class ChunkProgress(object):
+    """
+    Progress of one stage: checks the token before each chunk and reports
+    the running total after it.  Safe to update from several threads.
+
+    Args:
+        stage (str): Stage name passed to the callback.
+        total (int): Total amount of work.
+        progress (callable): Optional progress(stage, done, total) callback.
+        cancel (:obj:`CancellationToken`): Optional cancellation token.
+    """
+    def __init__(self, stage, total, progress=None, cancel=None):
+        self._stage = stage
+        self._total = total
+        self._progress = progress
+        self._cancel = cancel
+        self._done = 0
+        self._lock = threading.Lock()
+
+    def check(self):
+        """Raise OperationCancelled if the operation was cancelled."""
+        if self._cancel is not None:
+            self._cancel.check()
+
+    def advance(self, amount):
+        """Add amount to the work done and report it."""
+        with self._lock:
+            self._done += amount
+            if self._progress is not None:
+                self._progress(self._stage, self._done, self._total)
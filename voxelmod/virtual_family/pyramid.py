@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Multi-resolution pyramids of Virtual Population voxel models.
+
+Level k of a pyramid has 2**k times the spatial steps of the original model
+and is stored as an ordinary info (.txt) and data (.raw) pair next to it,
+named <model>_pyramid<k>.  Each level is a majority-vote 2x downsample of the
+level below, so building a pyramid reads the full-resolution data once.
+"""
+
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+import os
+from .virtual_population import (readVirtualPopulation,
+                                 readVirtualPopulationInfo,
+                                 writeVirtualPopulation)
+
+PYRAMID_SUFFIX = '_pyramid'
+
+def pyramidLevelFiles(infoFile, level, dataFile=None):
+    """
+    Returns the (info, data) file names of a pyramid level of the model
+    described by infoFile, in the directory of infoFile.  Level 0 is the
+    original model, with dataFile as its data file (default: infoFile with
+    a .raw extension).
+    """
+    base = os.path.splitext(infoFile)[0]
+    if level == 0:
+        return (infoFile, base + '.raw' if dataFile is None else dataFile)
+    base += PYRAMID_SUFFIX + str(level)
+    return (base + '.txt', base + '.raw')
+
+def buildPyramid(infoFile, dataFile, levels=None, minSize=8):
+    """
+    Write successive 2x majority-downsampled levels of a model next to it.
+
+    Levels are added until levels have been written or the next level would
+    have fewer than minSize cells along some axis.  Returns the list of
+    (info, data) file names written, coarsest last.  Raises IOError if a
+    level can not be written.
+    """
+    voxelModel = readVirtualPopulation(infoFile, dataFile, mmapMode='r')
+    # The directory pyramidLevelFiles names the levels in, even if infoFile
+    # is a symbolic link.
+    filePath = os.path.dirname(os.path.abspath(infoFile))
+    written = []
+    level = 0
+    while levels is None or level < levels:
+        if (min(voxelModel.nx, voxelModel.ny, voxelModel.nz) + 1) // 2 < \
+           minSize:
+            break
+        level += 1
+        voxelModel = voxelModel.resample(2)
+        levelInfoFile, levelDataFile = pyramidLevelFiles(infoFile, level)
+        voxelModel.name = os.path.splitext(os.path.basename(levelInfoFile))[0]
+        if writeVirtualPopulation(voxelModel, filePath) != 0:
+            raise IOError("Could not write pyramid level " + str(level) +
+                          ": " + levelInfoFile)
+        written.append((levelInfoFile, levelDataFile))
+    return written
+
+def pyramidLevels(infoFile, dataFile=None):
+    """
+    Returns the (info, data) file names of every existing level of the
+    model's pyramid, starting with the original model, whose data file is
+    dataFile (default: infoFile with a .raw extension).
+    """
+    levels = []
+    level = 0
+    while True:
+        levelFiles = pyramidLevelFiles(infoFile, level, dataFile)
+        if not (os.path.isfile(levelFiles[0]) and
+                os.path.isfile(levelFiles[1])):
+            return levels
+        levels.append(levelFiles)
+        level += 1
+
+def readPyramidLevel(infoFile, spacing, dataFile=None, **kwargs):
+    """
+    Read the coarsest pyramid level whose spatial steps are all no larger
+    than spacing, falling back to the original model (with data file
+    dataFile, see pyramidLevels).
+
+    Only the info files of the candidate levels are parsed; the chosen level
+    is read with readVirtualPopulation, which receives kwargs (for example
+    mmapMode or lazy).
+    """
+    levels = pyramidLevels(infoFile, dataFile)
+    if not levels:
+        raise IOError("File name: " + infoFile + " does not exist.")
+    chosen = levels[0]
+    for levelFiles in levels[1:]:
+        header = readVirtualPopulationInfo(levelFiles[0])
+        if max(header.dx, header.dy, header.dz) > spacing:
+            break
+        chosen = levelFiles
+    return readVirtualPopulation(chosen[0], chosen[1], **kwargs)
@@ -19,11 +19,236 @@ from __future__ import(absolute_import, division, generators,
 import os
 import sys
 import re
+import logging
 from random import random
-from .virtual_population import VirtualPopulation
+from concurrent.futures import ThreadPoolExecutor
+import numpy
+from .virtual_population import (VirtualPopulation,
+                                 NARROW_LABEL,
+                                 WIDE_LABEL,
+                                 labelDtypeFor,
+                                 writeVirtualPopulation,
+                                 writeVirtualPopulationInfo)
+from .instrumentation import stage
+from .progress import ChunkProgress
+from .atomic_file import atomicWrite
+
+logger = logging.getLogger(__name__)
 
 MATERIAL_PATTERN = re.compile('^([a-zA-Z_]*)[\s]*([a-zA-Z_][a-zA-Z_\s]*)$')
 
+def build_lookup_table(voxel_map_byte):
+    """
+    Build a 256-entry lookup table from a material byte map.
+
+    Args:
+        voxel_map_byte (dict): Mapping of original to reduced material index.
+
+    Returns:
+        bytes: Lookup table suitable for ``bytes.translate``.  Indices
+               missing from the map are passed through unchanged.
+    """
+    table = bytearray(range(256))
+    for (original, reduced) in voxel_map_byte.items():
+        table[original] = reduced
+    return bytes(table)
+
+def remap_python(data, voxel_map_byte):
+    """
+    Reference remap: walk every voxel and look up its new material.
+
+    Args:
+        data (bytearray or memoryview): Raw voxel data.
+        voxel_map_byte (dict): Mapping of original to reduced material index.
+
+    Returns:
+        bytearray: New voxel data; the input is not modified.
+    """
+    reduced_data = bytearray(len(data))
+    for (index, value) in enumerate(data):
+        reduced_data[index] = voxel_map_byte[value]
+    return reduced_data
+
+def remap_translate(data, voxel_map_byte):
+    """
+    Lookup-table remap applied in a single bulk ``translate`` pass.
+
+    Args:
+        data (bytearray or memoryview): Raw voxel data.
+        voxel_map_byte (dict): Mapping of original to reduced material index.
+
+    Returns:
+        bytearray: New voxel data; the input is not modified.
+    """
+    lookup_table = build_lookup_table(voxel_map_byte)
+    if isinstance(data, bytearray):
+        return data.translate(lookup_table)
+    return bytearray(bytes(data).translate(lookup_table))
+
+# Upper bound on voxels gathered per numpy.take call.  numpy widens the
+# uint8 indices to intp for each call, so chunking bounds that temporary and
+# keeps the working set in cache.
+REMAP_CHUNK_VOXELS = 1 << 20
+
+def slab_bounds(size, slab_size, max_voxels=REMAP_CHUNK_VOXELS):
+    """
+    Split a flat voxel buffer into ranges of whole z-slices.
+
+    Args:
+        size (int): Number of voxels in the buffer.
+        slab_size (int): Number of voxels per z-slice (nx * ny).
+        max_voxels (int): Preferred maximum number of voxels per range; a
+                          range always holds at least one slice.
+
+    Returns:
+        list: (start, stop) voxel index pairs covering the buffer.
+    """
+    step = max(1, max_voxels // slab_size) * slab_size
+    return [(start, min(start + step, size)) for start in range(0, size, step)]
+
+def build_label_lookup_table(voxel_map_byte, size, dtype):
+    """
+    Build a numpy lookup table of any size from a material byte map.
+
+    Args:
+        voxel_map_byte (dict): Mapping of original to reduced material index.
+        size (int): Number of entries, one per possible original label.
+        dtype (numpy.dtype): Label data type of the reduced data.
+
+    Returns:
+        numpy.ndarray: Lookup table; indices missing from the map are passed
+                       through unchanged.
+    """
+    table = numpy.arange(size).astype(dtype)
+    for (original, reduced) in voxel_map_byte.items():
+        table[original] = reduced
+    return table
+
+def remap_labels(voxels, voxel_map_byte, dtype=NARROW_LABEL, workers=1,
+                 slab_size=1, chunk_progress=None):
+    """
+    Lookup-table remap of labels of any width, applied with ``numpy.take``.
+
+    The labels are remapped in ranges of whole z-slices.  With more than one
+    worker the ranges are remapped concurrently in a thread pool, each
+    writing its own part of the shared output buffer; ``numpy.take``
+    releases the GIL, so the threads run in parallel.
+
+    Args:
+        voxels (numpy.ndarray): Source labels (uint8 or uint16).
+        voxel_map_byte (dict): Mapping of original to reduced material index.
+        dtype (numpy.dtype): Label data type of the result.
+        workers (int): Number of threads (default 1).
+        slab_size (int): Number of voxels per z-slice (nx * ny).
+        chunk_progress (:obj:`ChunkProgress`): Optional progress of the
+                            remap, checked before and advanced by the voxel
+                            count after every range (from the worker
+                            threads, if there are several).
+
+    Returns:
+        bytearray: New voxel data; the input is not modified.
+    """
+    dtype = numpy.dtype(dtype)
+    lookup_table = build_label_lookup_table(
+        voxel_map_byte, 1 << (8 * voxels.dtype.itemsize), dtype)
+    source = voxels.reshape(-1)
+    reduced_data = bytearray(source.size * dtype.itemsize)
+    reduced = numpy.frombuffer(reduced_data, dtype=dtype)
+
+    def remap_range(bounds):
+        """Remap one range of slabs into the output buffer."""
+        (start, stop) = bounds
+        if chunk_progress is not None:
+            chunk_progress.check()
+        numpy.take(lookup_table, source[start:stop], out=reduced[start:stop])
+        if chunk_progress is not None:
+            chunk_progress.advance(stop - start)
+
+    bounds = slab_bounds(source.size, slab_size)
+    if workers == 1:
+        for slab_range in bounds:
+            remap_range(slab_range)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(remap_range, bounds))
+    return reduced_data
+
+def remap_numpy(data, voxel_map_byte, workers=1, slab_size=1):
+    """
+    Lookup-table remap of one byte labels applied with ``numpy.take``.
+
+    Args:
+        data (bytearray or numpy.ndarray): Raw voxel data.
+        voxel_map_byte (dict): Mapping of original to reduced material index.
+        workers (int): Number of threads (default 1), see remap_labels.
+        slab_size (int): Number of voxels per z-slice (nx * ny).
+
+    Returns:
+        bytearray: New voxel data; the input is not modified.
+    """
+    return remap_labels(numpy.frombuffer(data, dtype=numpy.uint8),
+                        voxel_map_byte, NARROW_LABEL, workers, slab_size)
+
+REMAP_BACKENDS = {'python': remap_python,
+                  'translate': remap_translate,
+                  'numpy': remap_numpy}
+
+# Serial numpy.take is about 2.5 times slower than bytes.translate, so a
+# threaded 'numpy' remap only beats the serial 'translate' backend with at
+# least this many CPUs, on models of more than one REMAP_CHUNK_VOXELS range.
+PARALLEL_MIN_WORKERS = 4
+
+def read_voxel_map(voxel_map_file):
+    """
+    Read a material map file.
+
+    Each line maps a material short name to a new name; blank lines and
+    comments are skipped.
+
+    Args:
+        voxel_map_file (str): Text file containing material substitutions.
+
+    Returns:
+        dict: Mapping of material short name to new name; empty if the file
+              does not exist.
+    """
+    voxel_map = {}
+    if not os.path.isfile(voxel_map_file):
+        logger.warning("Could not find file: %s", voxel_map_file)
+        return voxel_map
+    logger.debug("Found: %s", voxel_map_file)
+    with open(voxel_map_file, 'r') as map_fh:
+        for map_string in map_fh:
+            mat_match = MATERIAL_PATTERN.match(map_string)
+            if mat_match:
+                voxel_map[mat_match.group(1)] = mat_match.group(2).strip()
+    return voxel_map
+
+def map_material_names(materials, voxel_map):
+    """
+    Look up the new name of every material of a voxel model.
+
+    Materials are matched by short name, without the model prefix.
+
+    Args:
+        materials (:obj:`MaterialTable`): Materials of the voxel model.
+        voxel_map (dict): Mapping of material short name to new name.
+
+    Returns:
+        list: New names of materials 1 to len(materials) - 1 ('Free Space'
+              is not mapped).
+
+    Raises:
+        KeyError: A material is missing from the map.
+    """
+    targets = []
+    for i in range(1, len(materials)):
+        name = materials.shortName(i)
+        if name not in voxel_map:
+            raise KeyError("Material " + repr(name) + " is not in the map.")
+        targets.append(voxel_map[name])
+    return targets
+
 class ReduceVoxel(object):
     """
     ReduceVoxel: Create a new voxel object with a  reduced set of biological
@@ -33,37 +258,83 @@ class ReduceVoxel(object):
         voxel_map_file (str): Text file containing material substitutions
                               (mappings) for new voxel object.
         voxel_object (:obj:`VirtualPopulation`): VirtualPopulation object.
+        backend (str): Remap engine, one of ``REMAP_BACKENDS``.  'translate'
+                       (default) applies a 256-entry lookup table in one
+                       bulk pass; 'numpy' applies the same table with
+                       numpy.take; 'python' is the per-voxel reference.
+        workers (int): Number of threads remapping z-slabs in parallel
+                       (default 1).  Only the 'numpy' backend supports more
+                       than one worker.  None picks the faster of the
+                       serial backend and a threaded 'numpy' remap with
+                       one worker per CPU, see PARALLEL_MIN_WORKERS.
+        cache (:obj:`DerivationCache`): Optional cache of reduced models.
+                                        A model reduced before from the
+                                        same source and map file contents
+                                        is read back instead of recomputed.
+        progress (callable): Optional progress(stage, done, total) callback,
+                             called with the number of voxels remapped
+                             after every range of z-slices.
+        cancel (:obj:`CancellationToken`): Optional token; once cancelled,
+                                           the remap raises
+                                           OperationCancelled.
+
+    Wide (uint16) labels, in the source or the reduced model, do not fit the
+    256-entry tables of the 'python' and 'translate' backends and are always
+    remapped with numpy.
     """
-    def __init__(self, voxel_map_file, voxel_object):
+    def __init__(self, voxel_map_file, voxel_object, backend='translate',
+                 workers=1, cache=None, progress=None, cancel=None):
 
+        if backend not in REMAP_BACKENDS:
+            raise ValueError("Unknown remap backend: " + str(backend))
+        if workers is None:
+            cpus = os.cpu_count() or 1
+            num_voxels = voxel_object.nx * voxel_object.ny * voxel_object.nz
+            if cpus >= PARALLEL_MIN_WORKERS and \
+               num_voxels > REMAP_CHUNK_VOXELS:
+                (backend, workers) = ('numpy', cpus)
+            else:
+                workers = 1
+        if workers < 1:
+            raise ValueError("workers must be at least 1.")
+        if workers > 1 and backend != 'numpy':
+            raise ValueError("Parallel remap requires the 'numpy' backend.")
+        self._backend = backend
+        self._workers = workers
+        self._progress = progress
+        self._cancel = cancel
         self._voxel_map_file = voxel_map_file
         self._voxel_map = {}
         self._voxel_map_byte = {0:0}
         self._original_voxel_object = voxel_object
         self._reduced_voxel_object = VirtualPopulation()
-        self._load_map_from_file()
-        self._remap_materials()
+        if cache is None:
+            self._reduce()
+            return
+        # The result does not depend on the backend or the worker count.
+        key = cache.key('ReduceVoxel', [voxel_object], [voxel_map_file])
+        self._reduced_voxel_object = cache.derive(key, self._reduce)
+
+    def _reduce(self):
+        """Build the reduced voxel object and return it."""
+        with stage('reduce.map'):
+            self._load_map_from_file()
+        source = self._original_voxel_object
+        num_voxels = source.nx * source.ny * source.nz
+        with stage('reduce.remap', num_voxels):
+            self._remap_materials()
+        return self._reduced_voxel_object
 
     def _load_map_from_file(self):
         """Loads the map file and create a python dictionary."""
-        if not os.path.isfile(self._voxel_map_file):
-            print("Could not find file: ", self._voxel_map_file)
-        else:
-            print("Found: ", self._voxel_map_file)
-            with open(self._voxel_map_file, 'r') as map_fh:
-                map_content = map_fh.readlines()
-
-            for map_string in map_content:
-                mat_match = MATERIAL_PATTERN.match(map_string)
-                if mat_match:
-                    self._voxel_map[mat_match.group(1)] = mat_match.group(2)
+        self._voxel_map = read_voxel_map(self._voxel_map_file)
 
         # Add reduced set of materials to reduced voxel object
         reduced_mat_map = {}
-        map_index = 1
         reduced_materials = set(self._voxel_map.values())
 
-        for (map_index, mat) in enumerate(reduced_materials):
+        # Index 0 is reserved for 'Free Space'.
+        for (map_index, mat) in enumerate(sorted(reduced_materials), 1):
             self._reduced_voxel_object.appendMaterial(mat,
                                                       random(),
                                                       random(),
@@ -71,16 +342,14 @@ class ReduceVoxel(object):
             reduced_mat_map[mat] = map_index
 
         for i in range(self._reduced_voxel_object.numMaterials):
-            print(i, " : ", self._reduced_voxel_object.material(i))
-        for i in range(1, self._original_voxel_object.numMaterials):
-            name = self._original_voxel_object.material(i)[1].split('/')[-1]
-            self._voxel_map_byte[i] = reduced_mat_map[self._voxel_map[name]]
+            logger.debug("%d : %s", i, self._reduced_voxel_object.material(i))
+        targets = map_material_names(self._original_voxel_object.materials,
+                                     self._voxel_map)
+        for (i, target) in enumerate(targets, 1):
+            self._voxel_map_byte[i] = reduced_mat_map[target]
 
-    def _remap_materials(self):
-        """
-        Remap the materials according to the map file and populate voxel
-        object.
-        """
+    def _copy_grid(self):
+        """Copy name, grid extents and spatial steps to the reduced object."""
         self._reduced_voxel_object.name = self._original_voxel_object.name + \
                                           '_reduced'
         self._reduced_voxel_object.nx = self._original_voxel_object.nx
@@ -89,11 +358,44 @@ class ReduceVoxel(object):
         self._reduced_voxel_object.dx = self._original_voxel_object.dx
         self._reduced_voxel_object.dy = self._original_voxel_object.dy
         self._reduced_voxel_object.dz = self._original_voxel_object.dz
-        reduced_data = self._original_voxel_object.data
-        for (index, data) in enumerate(reduced_data):
-            if index == 10099596:
-                print(index, data, ":", self._voxel_map_byte[data])
-            reduced_data[index] = self._voxel_map_byte[data]
+
+    def _remap_materials(self):
+        """
+        Remap the materials according to the map file and populate voxel
+        object.
+        """
+        self._copy_grid()
+        source = self._original_voxel_object
+        slab_size = source.nx * source.ny
+        chunk_progress = None
+        if self._progress is not None or self._cancel is not None:
+            chunk_progress = ChunkProgress('reduce.remap',
+                                           slab_size * source.nz,
+                                           self._progress, self._cancel)
+        dtype = labelDtypeFor(self._reduced_voxel_object.numMaterials)
+        if self._workers > 1 or dtype != NARROW_LABEL or \
+           source.labelDtype != NARROW_LABEL:
+            self._reduced_voxel_object.data = remap_labels(
+                source.array, self._voxel_map_byte, dtype, self._workers,
+                slab_size, chunk_progress)
+            return
+        remap = REMAP_BACKENDS[self._backend]
+        # Every backend takes a flat byte buffer; memory-mapped data is a
+        # (nz, ny, nx) array.
+        voxels = source.data
+        if not isinstance(voxels, bytearray):
+            voxels = memoryview(source.array.reshape(-1))
+        if chunk_progress is None:
+            self._reduced_voxel_object.data = remap(voxels,
+                                                    self._voxel_map_byte)
+            return
+        # Remap range by range to report progress and honour cancellation.
+        reduced_data = bytearray(len(voxels))
+        for (start, stop) in slab_bounds(len(voxels), slab_size):
+            chunk_progress.check()
+            reduced_data[start:stop] = remap(voxels[start:stop],
+                                             self._voxel_map_byte)
+            chunk_progress.advance(stop - start)
         self._reduced_voxel_object.data = reduced_data
 
     @property
@@ -101,6 +403,201 @@ class ReduceVoxel(object):
         """Return the reduced voxel model object."""
         return self._reduced_voxel_object
 
+class StreamReduceVoxel(ReduceVoxel):
+    """
+    StreamReduceVoxel: Reduce the materials of a voxel model on disk without
+    loading its data.
+
+    The source data file is read one slab of z-slices at a time, each slab is
+    remapped and written straight to the output data file, so peak memory is
+    bounded by the slab size.  The source voxel object only supplies the
+    materials and grid, and is never modified.  After reduction the reduced
+    voxel model's data is a read-only memory map of the output file.
+
+    Args:
+        voxel_map_file (str): Text file containing material substitutions
+                              (mappings) for new voxel object.
+        voxel_object (:obj:`VirtualPopulation`): VirtualPopulation object
+                              describing the source model.  Its data is not
+                              used, so it can be opened with lazy=True.
+        data_file (str): Source Virtual Population data (.raw) file.
+        file_path (str): Output directory for the reduced .txt and .raw files.
+        name (str): Name of the reduced model (default: source name with
+                    '_reduced' appended).
+        slab_depth (int): Number of z-slices read and remapped per chunk.
+        backend (str): Remap engine, one of ``REMAP_BACKENDS``.
+        progress (callable): Optional progress(stage, done, total) callback,
+                             called with the number of source bytes
+                             remapped after every slab.
+        cancel (:obj:`CancellationToken`): Optional token; once cancelled,
+                                           the reduction raises
+                                           OperationCancelled.
+
+    The output data is written to a partial file that only replaces the
+    .raw file once it is complete, so a failed or cancelled reduction never
+    leaves a truncated .raw file behind.
+    """
+    def __init__(self, voxel_map_file, voxel_object, data_file, file_path,
+                 name=None, slab_depth=1, backend='translate', progress=None,
+                 cancel=None):
+        if slab_depth < 1:
+            raise ValueError("slab_depth must be at least 1.")
+        if not os.path.isdir(file_path):
+            raise IOError("Directory (" + file_path + ") not found.")
+        self._data_file = data_file
+        self._file_path = file_path
+        self._name = name
+        self._slab_depth = slab_depth
+        super(StreamReduceVoxel, self).__init__(voxel_map_file, voxel_object,
+                                                backend, progress=progress,
+                                                cancel=cancel)
+
+    def _remap_materials(self):
+        """Stream the source data through the remap into the output file."""
+        self._copy_grid()
+        if self._name is not None:
+            self._reduced_voxel_object.name = self._name
+        voxel = self._reduced_voxel_object
+        file_name = os.path.realpath(os.path.join(self._file_path,
+                                                  voxel.name))
+
+        num_voxels = voxel.nx * voxel.ny * voxel.nz
+        source_dtype = WIDE_LABEL if num_voxels and \
+            os.path.getsize(self._data_file) == 2 * num_voxels \
+            else NARROW_LABEL
+        dtype = labelDtypeFor(voxel.numMaterials)
+        if source_dtype == NARROW_LABEL and dtype == NARROW_LABEL:
+            remap = REMAP_BACKENDS[self._backend]
+        else:
+            remap = lambda chunk, voxel_map_byte: remap_labels(
+                numpy.frombuffer(chunk, dtype=source_dtype), voxel_map_byte,
+                dtype)
+        slab = bytearray(voxel.nx * voxel.ny * self._slab_depth *
+                         source_dtype.itemsize)
+        slab_view = memoryview(slab)
+        remaining = num_voxels * source_dtype.itemsize
+        chunk_progress = ChunkProgress('reduce.remap', remaining,
+                                       self._progress, self._cancel)
+        try:
+            with open(self._data_file, 'rb') as source_fh, \
+                 atomicWrite(file_name + '.raw', 'wb',
+                             num_voxels * dtype.itemsize) as reduced_fh:
+                while remaining > 0:
+                    chunk_progress.check()
+                    count = source_fh.readinto(slab_view[:min(remaining,
+                                                              len(slab))])
+                    if not count:
+                        raise IOError("Unexpected end of data file: " +
+                                      self._data_file)
+                    reduced_fh.write(remap(slab_view[:count],
+                                           self._voxel_map_byte))
+                    remaining -= count
+                    chunk_progress.advance(count)
+        finally:
+            slab_view.release()
+        if writeVirtualPopulationInfo(voxel, file_name + '.txt') != 0:
+            raise IOError("Could not write " + file_name + '.txt')
+
+        voxel.data = numpy.memmap(file_name + '.raw', dtype=dtype, mode='r',
+                                  shape=(voxel.nz, voxel.ny, voxel.nx))
+
+class _MaterialMapping(ReduceVoxel):
+    """ReduceVoxel that loads the map and grid but leaves data to the caller."""
+    def _reduce(self):
+        """Load the map and copy the grid only; the caller remaps the data."""
+        with stage('reduce.map'):
+            self._load_map_from_file()
+        self._copy_grid()
+        return self._reduced_voxel_object
+
+    @property
+    def voxel_map_byte(self):
+        """Return the original to reduced material index map."""
+        return self._voxel_map_byte
+
+class BatchReduceVoxel(object):
+    """
+    BatchReduceVoxel: Create several reduced voxel objects from one voxel
+    object, one per material map file, in a single pass over the data.
+
+    The source data is walked once in ranges of whole z-slices; each range is
+    remapped through every map's lookup table while it is still in cache.
+    The source voxel object is not modified.
+
+    Args:
+        voxel_map_files (list): Material map files, one per reduced model.
+        voxel_object (:obj:`VirtualPopulation`): VirtualPopulation object.
+        names (list): Names of the reduced models (default: source name and
+                      map file name joined by '_').
+    """
+    def __init__(self, voxel_map_files, voxel_object, names=None):
+        if names is None:
+            names = [voxel_object.name + '_' +
+                     os.path.splitext(os.path.basename(map_file))[0]
+                     for map_file in voxel_map_files]
+        if len(names) != len(voxel_map_files):
+            raise ValueError("Expected one name per material map file.")
+
+        self._mappings = [_MaterialMapping(map_file, voxel_object)
+                          for map_file in voxel_map_files]
+        for (mapping, name) in zip(self._mappings, names):
+            mapping.voxel_model.name = name
+        with stage('reduce.remap',
+                   voxel_object.nx * voxel_object.ny * voxel_object.nz):
+            self._remap_materials(voxel_object)
+
+    def _remap_materials(self, voxel_object):
+        """Remap the source data through every lookup table in one pass."""
+        source = voxel_object.array.reshape(-1)
+        dtypes = [labelDtypeFor(mapping.voxel_model.numMaterials)
+                  for mapping in self._mappings]
+        reduced_data = [bytearray(source.size * dtype.itemsize)
+                        for dtype in dtypes]
+        narrow = source.dtype == NARROW_LABEL and \
+                 all(dtype == NARROW_LABEL for dtype in dtypes)
+        if narrow:
+            lookup_tables = [build_lookup_table(mapping.voxel_map_byte)
+                             for mapping in self._mappings]
+        else:
+            # Wide labels are gathered with numpy straight into the outputs.
+            lookup_tables = [build_label_lookup_table(
+                mapping.voxel_map_byte, 1 << (8 * source.dtype.itemsize),
+                dtype) for (mapping, dtype) in zip(self._mappings, dtypes)]
+            reduced = [numpy.frombuffer(data, dtype=dtype)
+                       for (data, dtype) in zip(reduced_data, dtypes)]
+        for (start, stop) in slab_bounds(source.size,
+                                         voxel_object.nx * voxel_object.ny):
+            if narrow:
+                slab = source[start:stop].tobytes()
+                for (lookup_table, data) in zip(lookup_tables, reduced_data):
+                    data[start:stop] = slab.translate(lookup_table)
+            else:
+                for (lookup_table, labels) in zip(lookup_tables, reduced):
+                    numpy.take(lookup_table, source[start:stop],
+                               out=labels[start:stop])
+        for (mapping, data) in zip(self._mappings, reduced_data):
+            mapping.voxel_model.data = data
+
+    @property
+    def voxel_models(self):
+        """Return the reduced voxel model objects, in map file order."""
+        return [mapping.voxel_model for mapping in self._mappings]
+
+    def write(self, file_path=None):
+        """
+        Write every reduced model with writeVirtualPopulation.
+
+        Args:
+            file_path (str): Output directory (default: current directory).
+
+        Returns:
+            list: writeVirtualPopulation status for each reduced model.
+        """
+        if file_path is None:
+            file_path = os.getcwd()
+        return [writeVirtualPopulation(voxel, file_path)
+                for voxel in self.voxel_models]
+
 def main(argv):
     """
     Main entry function for voxel reduce from command line.
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Resampling of Virtual Population label volumes.
+
+Along an axis whose spacing grows by an integer factor, each block of that
+many voxels becomes one voxel holding the most common label of the block
+(majority vote, ties going to the lowest label).  Along any other axis
+(upsampling or non-integer factors) each new voxel takes the label of the
+old voxel nearest to its center.  Output is produced one z-slice at a time,
+so the working memory is bounded by a single slab of blocks.
+"""
+
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+import math
+import numpy
+
+# Label used to pad partial edge blocks; never wins a majority vote.
+PAD_LABEL = 0xFFFF
+
+def isBlockFactor(factor):
+    """Returns True if factor is resampled by majority vote blocks."""
+    return factor >= 1 and factor == int(factor)
+
+def resampledShape(shape, factors):
+    """
+    Returns the (nz, ny, nx) shape of a grid of the given shape after its
+    spacing along z, y and x is multiplied by factors.
+    """
+    return tuple(int(math.ceil(n / factor)) if isBlockFactor(factor)
+                 else max(1, int(round(n / factor)))
+                 for (n, factor) in zip(shape, factors))
+
+def _nearestIndices(n, newN):
+    """Returns the old index nearest to the center of each new index."""
+    centers = (numpy.arange(newN) + 0.5) * (n / newN)
+    return numpy.minimum(centers.astype(numpy.int64), n - 1)
+
+def blockMode(blocks):
+    """
+    Returns the most common label along the last axis of blocks, ignoring
+    PAD_LABEL.  Ties go to the lowest label.
+    """
+    ordered = numpy.sort(blocks, axis=-1)
+    position = numpy.arange(ordered.shape[-1])
+    runStart = numpy.ones(ordered.shape, dtype=bool)
+    runStart[..., 1:] = ordered[..., 1:] != ordered[..., :-1]
+    runStart = numpy.maximum.accumulate(numpy.where(runStart, position, 0),
+                                        axis=-1)
+    counts = position - runStart + 1
+    counts[ordered == PAD_LABEL] = 0
+    best = counts.argmax(axis=-1)[..., numpy.newaxis]
+    return numpy.take_along_axis(ordered, best, axis=-1)[..., 0]
+
+def resampleLabels(array, factors, out=None):
+    """
+    Resample a (nz, ny, nx) label array whose spacing along z, y and x is
+    multiplied by factors.
+
+    Args:
+        array (numpy.ndarray): Source labels.
+        factors (tuple): Spacing factors (fz, fy, fx).
+        out (numpy.ndarray): Optional output array of resampledShape.
+
+    Returns:
+        numpy.ndarray: Resampled labels.
+    """
+    newShape = resampledShape(array.shape, factors)
+    if out is None:
+        out = numpy.empty(newShape, dtype=array.dtype)
+    elif out.shape != newShape:
+        raise ValueError("out has shape " + str(out.shape) +
+                         ", expected " + str(newShape))
+    block = [int(factor) if isBlockFactor(factor) else 1
+             for factor in factors]
+    nearest = [None if isBlockFactor(factor) else _nearestIndices(n, newN)
+               for (n, newN, factor) in zip(array.shape, newShape, factors)]
+    (newNz, newNy, newNx) = newShape
+
+    for z in range(newNz):
+        if nearest[0] is None:
+            slab = array[z * block[0]:(z + 1) * block[0]]
+        else:
+            slab = array[nearest[0][z]:nearest[0][z] + 1]
+        if nearest[1] is not None:
+            slab = slab[:, nearest[1]]
+        if nearest[2] is not None:
+            slab = slab[:, :, nearest[2]]
+        if block[1] == block[2] == 1 and slab.shape[0] == 1:
+            out[z] = slab[0]
+            continue
+        padded = numpy.full((slab.shape[0], newNy * block[1],
+                             newNx * block[2]), PAD_LABEL, dtype=numpy.uint16)
+        padded[:, :slab.shape[1], :slab.shape[2]] = slab
+        blocks = padded.reshape(slab.shape[0], newNy, block[1],
+                                newNx, block[2]).transpose(1, 3, 0, 2, 4)
+        out[z] = blockMode(blocks.reshape(newNy, newNx, -1))
+    return out
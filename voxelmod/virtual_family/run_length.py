@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Run-length encoded storage for sparse Virtual Population label volumes.
+
+Voxel data is encoded as runs of equal labels along x.  Runs of material 0
+(Free Space) are not stored, so memory scales with the number of non-zero
+runs (roughly the body surface) rather than with the bounding box.
+"""
+
+from __future__ import (absolute_import, division,
+                        print_function, unicode_literals)
+import numpy
+from .material_statistics import MaterialStatistics
+
+def _decodeRuns(positions, lengths, values, size):
+    """Expand runs at flat positions into a dense label array of size."""
+    dense = numpy.zeros(size, dtype=values.dtype)
+    if len(lengths):
+        lengths = lengths.astype(numpy.int64)
+        runOffsets = numpy.cumsum(lengths) - lengths
+        indices = numpy.repeat(positions - runOffsets, lengths) + \
+                  numpy.arange(lengths.sum())
+        dense[indices] = numpy.repeat(values, lengths)
+    return dense
+
+class RunLengthVoxelData(object):
+    """
+    Run-length encoded (nz, ny, nx) label volume.
+
+    Runs are stored row by row, with rows in (z, y) order: the runs of row
+    z * ny + y are runStarts[rowOffsets[row]:rowOffsets[row + 1]] and the
+    matching slices of runLengths and runValues.
+
+    Args:
+        shape (tuple): Grid shape (nz, ny, nx).
+        rowOffsets (numpy.ndarray): nz * ny + 1 offsets into the run arrays.
+        runStarts (numpy.ndarray): x index of the first voxel of each run.
+        runLengths (numpy.ndarray): Number of voxels in each run.
+        runValues (numpy.ndarray): Material index of each run (never 0), in
+                                   the label data type of the volume.
+    """
+    def __init__(self, shape, rowOffsets, runStarts, runLengths, runValues):
+        self._shape = tuple(shape)
+        self._rowOffsets = rowOffsets
+        self._runStarts = runStarts
+        self._runLengths = runLengths
+        self._runValues = runValues
+
+    @classmethod
+    def fromArray(cls, array):
+        """Encode a dense (nz, ny, nx) label array, one z-slice at a time."""
+        (nz, ny, nx) = array.shape
+        rowCounts = []
+        runStarts = []
+        runLengths = []
+        runValues = []
+        for z in range(nz):
+            flat = numpy.ascontiguousarray(array[z]).reshape(-1)
+            boundary = numpy.empty(flat.size, dtype=bool)
+            boundary[0] = True
+            numpy.not_equal(flat[1:], flat[:-1], out=boundary[1:])
+            boundary[::nx] = True
+            starts = numpy.flatnonzero(boundary)
+            lengths = numpy.diff(numpy.append(starts, flat.size))
+            values = flat[starts]
+            keep = values != 0
+            (starts, lengths, values) = (starts[keep], lengths[keep],
+                                         values[keep])
+            rowCounts.append(numpy.bincount(starts // nx, minlength=ny))
+            runStarts.append((starts % nx).astype(numpy.uint32))
+            runLengths.append(lengths.astype(numpy.uint32))
+            runValues.append(values)
+        rowOffsets = numpy.zeros(nz * ny + 1, dtype=numpy.int64)
+        if nz:
+            numpy.cumsum(numpy.concatenate(rowCounts), out=rowOffsets[1:])
+        concat = lambda parts, dtype: numpy.concatenate(parts) if parts \
+            else numpy.zeros(0, dtype=dtype)
+        return cls((nz, ny, nx), rowOffsets,
+                   concat(runStarts, numpy.uint32),
+                   concat(runLengths, numpy.uint32),
+                   concat(runValues, array.dtype))
+
+    @property
+    def shape(self):
+        """Returns the grid shape (nz, ny, nx)."""
+        return self._shape
+
+    @property
+    def dtype(self):
+        """Returns the label data type of the volume."""
+        return self._runValues.dtype
+
+    @property
+    def numRuns(self):
+        """Returns the number of stored (non-zero) runs."""
+        return len(self._runValues)
+
+    @property
+    def nbytes(self):
+        """Returns the memory held by the encoding, in bytes."""
+        return (self._rowOffsets.nbytes + self._runStarts.nbytes +
+                self._runLengths.nbytes + self._runValues.nbytes)
+
+    def voxel(self, z, y, x):
+        """Returns the material index at (z, y, x)."""
+        row = z * self._shape[1] + y
+        (first, last) = self._rowOffsets[row:row + 2]
+        run = numpy.searchsorted(self._runStarts[first:last], x,
+                                 side='right') - 1
+        if run >= 0 and x < self._runStarts[first + run] + \
+                            self._runLengths[first + run]:
+            return int(self._runValues[first + run])
+        return 0
+
+    def readRow(self, z, y):
+        """Returns the dense x-row at (z, y) as a label array."""
+        row = z * self._shape[1] + y
+        (first, last) = self._rowOffsets[row:row + 2]
+        return _decodeRuns(self._runStarts[first:last].astype(numpy.int64),
+                           self._runLengths[first:last],
+                           self._runValues[first:last], self._shape[2])
+
+    def readSlice(self, z):
+        """Returns the dense z-slice as a (ny, nx) label array."""
+        (ny, nx) = self._shape[1:]
+        rowOffsets = self._rowOffsets[z * ny:(z + 1) * ny + 1]
+        (first, last) = (rowOffsets[0], rowOffsets[-1])
+        rows = numpy.repeat(numpy.arange(ny, dtype=numpy.int64),
+                            numpy.diff(rowOffsets))
+        positions = rows * nx + self._runStarts[first:last]
+        return _decodeRuns(positions, self._runLengths[first:last],
+                           self._runValues[first:last],
+                           ny * nx).reshape(ny, nx)
+
+    def toArray(self):
+        """Decode to a dense (nz, ny, nx) label array."""
+        return numpy.frombuffer(self.toBytes(), dtype=self._runValues.dtype
+                                ).reshape(self._shape)
+
+    def toBytes(self):
+        """Decode to a dense bytearray in .raw (z, y, x) order."""
+        (nz, ny, nx) = self._shape
+        dtype = self._runValues.dtype
+        data = bytearray(nz * ny * nx * dtype.itemsize)
+        dense = numpy.frombuffer(data, dtype=dtype).reshape(self._shape)
+        for z in range(nz):
+            dense[z] = self.readSlice(z)
+        return data
+
+    def materialCounts(self, minlength=0):
+        """
+        Returns the number of voxels of each material index, counted from
+        the runs without decoding.
+        """
+        counts = numpy.bincount(self._runValues,
+                                weights=self._runLengths,
+                                minlength=max(minlength, 1)).astype(numpy.int64)
+        counts[0] = self._shape[0] * self._shape[1] * self._shape[2] - \
+                    counts[1:].sum()
+        return counts
+
+    def materialStatistics(self, numMaterials=0):
+        """
+        Returns the MaterialStatistics of the volume, computed from the runs
+        without decoding.  numMaterials sets the minimum number of material
+        indices reported, as in computeMaterialStatistics.
+        """
+        (nz, ny, nx) = self._shape
+        rows = numpy.repeat(numpy.arange(nz * ny, dtype=numpy.int64),
+                            numpy.diff(self._rowOffsets))
+        (z, y) = (rows // ny, rows % ny)
+        starts = self._runStarts.astype(numpy.int64)
+        lengths = self._runLengths.astype(numpy.int64)
+        values = self._runValues.astype(numpy.intp)
+        numLabels = max(numMaterials, 1,
+                        int(values.max()) + 1 if values.size else 0)
+        counts = self.materialCounts(numLabels)
+
+        # Sums of the x, y and z indices of every run's voxels.
+        sums = numpy.zeros((numLabels, 3))
+        for (axis, weights) in enumerate((lengths * starts +
+                                          lengths * (lengths - 1) // 2,
+                                          lengths * y, lengths * z)):
+            sums[:, axis] = numpy.bincount(values, weights=weights,
+                                           minlength=numLabels)
+        numVoxels = nx * ny * nz
+        sums[0] = [numVoxels * (n - 1) / 2.0 for n in (nx, ny, nz)]
+        sums[0] -= sums[1:].sum(axis=0)
+
+        extents = numpy.array([nx, ny, nz], dtype=numpy.int64)
+        lower = numpy.tile(extents, (numLabels, 1))
+        upper = numpy.zeros((numLabels, 3), dtype=numpy.int64)
+        for (axis, first, stop) in ((0, starts, starts + lengths),
+                                    (1, y, y + 1), (2, z, z + 1)):
+            numpy.minimum.at(lower[:, axis], values, first)
+            numpy.maximum.at(upper[:, axis], values, stop)
+        # Free Space is present where the runs do not cover a whole plane.
+        coverage = numpy.cumsum(
+            numpy.bincount(starts, minlength=nx + 1) -
+            numpy.bincount(starts + lengths, minlength=nx + 1))[:nx]
+        freeSpace = (coverage < ny * nz,
+                     numpy.bincount(y, weights=lengths, minlength=ny) <
+                     nx * nz,
+                     numpy.bincount(z, weights=lengths, minlength=nz) <
+                     nx * ny)
+        for (axis, present) in enumerate(freeSpace):
+            lower[0, axis] = present.argmax()
+            upper[0, axis] = len(present) - present[::-1].argmax()
+        empty = counts == 0
+        lower[empty] = 0
+        upper[empty] = extents
+        return MaterialStatistics(counts, lower, upper, sums)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Tissue electrical property volumes for electromagnetic solvers.
+
+The TissueProperties class assigns conductivity, relative permittivity and
+mass density to every material of a voxel model from a tissue property
+table, and expands them into dense float32 volumes with one lookup table
+gather per z-slab.  Materials are matched to the table by short name, either
+directly or through a material map file as used by ReduceVoxel.
+
+Property table format (whitespace separated, '#' starts a comment):
+    frequency 64e6
+    # name      sigma [S/m]     epsilon_r   density [kg/m^3]
+    Muscle      0.688           72.2        1090
+"""
+from __future__ import(absolute_import, division, generators,
+                       print_function, unicode_literals)
+
+import os
+from os.path import sep
+import contextlib
+import logging
+import numpy
+from .reduce_voxel import (REMAP_CHUNK_VOXELS,
+                           slab_bounds,
+                           read_voxel_map,
+                           map_material_names)
+from .virtual_population import NARROW_LABEL, WIDE_LABEL
+from .atomic_file import atomicWrite
+
+logger = logging.getLogger(__name__)
+
+PROPERTY_NAMES = ('sigma', 'epsilon_r', 'density')
+PROPERTY_DTYPE = numpy.dtype('<f4')
+
+# Properties of 'Free Space' (material 0) unless the table lists it.
+FREE_SPACE_PROPERTIES = (0.0, 1.0, 0.0)
+
+def read_property_table(property_file):
+    """
+    Read a tissue property table file.
+
+    Args:
+        property_file (str): Text file of tissue name, sigma, epsilon_r and
+                             density rows, and an optional frequency line.
+
+    Returns:
+        tuple: (table, frequency); table maps tissue name to a
+               (sigma, epsilon_r, density) tuple, frequency is in Hz or None
+               if the file does not give one.
+
+    Raises:
+        ValueError: A line is not a frequency or a property row.
+    """
+    table = {}
+    frequency = None
+    with open(property_file, 'r') as property_fh:
+        for (line_number, line) in enumerate(property_fh, 1):
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+            try:
+                if len(fields) == 2 and fields[0] == 'frequency':
+                    frequency = float(fields[1])
+                elif len(fields) == 1 + len(PROPERTY_NAMES):
+                    table[fields[0]] = tuple(float(value)
+                                             for value in fields[1:])
+                else:
+                    raise ValueError("expected a tissue name and " +
+                                     str(len(PROPERTY_NAMES)) + " values")
+            except ValueError as e:
+                raise ValueError(property_file + ", line " +
+                                 str(line_number) + ": " + str(e))
+    return (table, frequency)
+
+class TissueProperties(object):
+    """
+    TissueProperties: Dense tissue property volumes of a voxel object.
+
+    Args:
+        property_table (str or dict): Property table file, or a mapping of
+                                      tissue name to (sigma, epsilon_r,
+                                      density).
+        voxel_object (:obj:`VirtualPopulation`): VirtualPopulation object;
+                                                 memory-mapped data, and
+                                                 the data file of a model
+                                                 read with lazy=True, are
+                                                 only read one slab at a
+                                                 time.
+        voxel_map_file (str): Optional material map file; materials are then
+                              looked up in the table by their mapped name,
+                              as ReduceVoxel would name them.
+        frequency (float): Frequency of the table in Hz, overriding the one
+                           given in the property table file.
+
+    Raises:
+        KeyError: A material has no entry in the map or the table.
+    """
+    def __init__(self, property_table, voxel_object, voxel_map_file=None,
+                 frequency=None):
+        if isinstance(property_table, dict):
+            table = property_table
+        else:
+            (table, file_frequency) = read_property_table(property_table)
+            if frequency is None:
+                frequency = file_frequency
+        self._frequency = frequency
+        self._voxel_object = voxel_object
+
+        materials = voxel_object.materials
+        if voxel_map_file is None:
+            names = [materials.shortName(i) for i in range(1, len(materials))]
+        else:
+            names = map_material_names(materials,
+                                       read_voxel_map(voxel_map_file))
+        self._lookup_table = numpy.empty((len(PROPERTY_NAMES), len(materials)),
+                                         dtype=PROPERTY_DTYPE)
+        self._lookup_table[:, 0] = table.get(materials.shortName(0),
+                                             FREE_SPACE_PROPERTIES)
+        for (i, name) in enumerate(names, 1):
+            if name not in table:
+                raise KeyError("Tissue " + repr(name) +
+                               " is not in the property table.")
+            self._lookup_table[:, i] = table[name]
+
+    @property
+    def frequency(self):
+        """Returns the frequency of the property table in Hz, or None."""
+        return self._frequency
+
+    def _property_index(self, property_name):
+        """Returns the row of a property in the lookup table."""
+        if property_name not in PROPERTY_NAMES:
+            raise ValueError("Unknown property: " + str(property_name) +
+                             ".  Valid properties are " + str(PROPERTY_NAMES))
+        return PROPERTY_NAMES.index(property_name)
+
+    def lookup_table(self, property_name):
+        """Returns the float32 value of a property for every material index."""
+        return self._lookup_table[self._property_index(property_name)]
+
+    def _label_slabs(self):
+        """
+        Yield (start, stop, labels) for the voxel labels in ranges of whole
+        z-slices.  Deferred data is read from its data file range by range
+        and is not loaded into the voxel object.
+        """
+        voxel = self._voxel_object
+        num_voxels = voxel.nx * voxel.ny * voxel.nz
+        bounds = slab_bounds(num_voxels, voxel.nx * voxel.ny)
+        data_file = voxel.deferredDataFile
+        if data_file is None:
+            labels = voxel.array.reshape(-1)
+            for (start, stop) in bounds:
+                yield (start, stop, numpy.asarray(labels[start:stop]))
+            return
+        dtype = WIDE_LABEL if num_voxels and os.path.getsize(data_file) == \
+            WIDE_LABEL.itemsize * num_voxels else NARROW_LABEL
+        with open(data_file, 'rb') as data_fh:
+            for (start, stop) in bounds:
+                labels = numpy.fromfile(data_fh, dtype=dtype,
+                                        count=stop - start)
+                if labels.size != stop - start:
+                    raise IOError("Unexpected end of data file: " +
+                                  data_file)
+                yield (start, stop, labels)
+
+    def volume(self, property_name):
+        """
+        Expand a property over the voxel grid.
+
+        Args:
+            property_name (str): One of ``PROPERTY_NAMES``.
+
+        Returns:
+            numpy.ndarray: (nz, ny, nx) float32 property volume.
+        """
+        lookup_table = self.lookup_table(property_name)
+        voxel = self._voxel_object
+        volume = numpy.empty((voxel.nz, voxel.ny, voxel.nx),
+                             dtype=PROPERTY_DTYPE)
+        values = volume.reshape(-1)
+        for (start, stop, labels) in self._label_slabs():
+            numpy.take(lookup_table, labels, out=values[start:stop])
+        return volume
+
+    def write(self, file_path=None, property_names=PROPERTY_NAMES):
+        """
+        Stream property volumes to little endian float32 .raw files named
+        <model name>_<property>.raw, in the (z, y, x) order and on the grid
+        of the voxel model's own .raw file.
+
+        The labels are read once, a slab of whole z-slices at a time, and
+        every property is gathered from the same slab, so memory use does
+        not grow with the grid.  Each file replaces its target atomically
+        once complete.
+
+        Args:
+            file_path (str): Output directory (default: current directory).
+            property_names (tuple): Properties to write.
+
+        Returns:
+            int: 0 on success, -1 if the directory does not exist.
+        """
+        if file_path is None:
+            file_path = os.getcwd()
+        if not os.path.isdir(file_path):
+            logger.error("Directory (%s) not found.", file_path)
+            return -1
+        lookup_tables = [self.lookup_table(property_name)
+                         for property_name in property_names]
+        voxel = self._voxel_object
+        num_voxels = voxel.nx * voxel.ny * voxel.nz
+        buffer = numpy.empty(max(voxel.nx * voxel.ny,
+                                 min(num_voxels, REMAP_CHUNK_VOXELS)),
+                             dtype=PROPERTY_DTYPE)
+        base_name = os.path.realpath(file_path + sep +
+                                     self._voxel_object.name)
+        with contextlib.ExitStack() as stack:
+            file_handles = [stack.enter_context(atomicWrite(
+                base_name + '_' + property_name + '.raw', 'wb',
+                num_voxels * PROPERTY_DTYPE.itemsize))
+                for property_name in property_names]
+            for (start, stop, labels) in self._label_slabs():
+                values = buffer[:stop - start]
+                for (lookup_table, file_handle) in zip(lookup_tables,
+                                                       file_handles):
+                    numpy.take(lookup_table, labels, out=values)
+                    file_handle.write(values)
+        return 0
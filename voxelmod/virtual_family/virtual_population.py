@@ -12,12 +12,58 @@ from __future__ import (absolute_import, division,
 import sys, os, ntpath
 from os.path import sep
 import re
+import logging
+import numpy
+from .run_length import RunLengthVoxelData
+from .resample import resampleLabels, resampledShape
+from .material_statistics import computeMaterialStatistics
+from .material_table import MaterialTable
+from .instrumentation import stage
+from .progress import ChunkProgress, OperationCancelled, IO_CHUNK_BYTES
+from .atomic_file import atomicWrite, byteView, writeBuffer
+
+logger = logging.getLogger(__name__)
 
 # Regular expression patterns for reading virtual population voxel data.
 VOXEL_NAME_PROG = re.compile("([a-zA-Z0-9_.]*).txt$")
-MAT_PROG = re.compile("(^[0-9]+)\s([0|0.[0-9]*|1])\s([0|0.[0-9]*|1])\s([0|0.[0-9]*|1])\s([a-zA-Z0-9_/]*)")
-NXYZ_PROG = re.compile("^n([xyz])\s([0-9]*)")
-DXYZ_PROG = re.compile("^d([xyz])\s([0-9.]*)")
+
+# Grid header keys in Virtual Population info files and their value types.
+GRID_KEYS = {'nx': int, 'ny': int, 'nz': int,
+             'dx': float, 'dy': float, 'dz': float}
+
+# Voxel label data types: one byte for up to 256 materials, otherwise two
+# bytes, little endian as in the .raw file.
+NARROW_LABEL = numpy.dtype(numpy.uint8)
+WIDE_LABEL = numpy.dtype('<u2')
+
+def labelDtypeFor(numMaterials):
+    """Returns the narrowest label data type for a number of materials."""
+    return NARROW_LABEL if numMaterials <= 256 else WIDE_LABEL
+
+def _convertLabels(voxels, dtype):
+    """
+    Returns a bytearray holding the labels of voxels as dtype.  Raises
+    ValueError if a label does not fit.
+    """
+    dtype = numpy.dtype(dtype)
+    if voxels.size and int(voxels.max()) > numpy.iinfo(dtype).max:
+        raise ValueError("Voxel labels do not fit in " + str(dtype))
+    data = bytearray(voxels.size * dtype.itemsize)
+    numpy.frombuffer(data, dtype=dtype)[...] = voxels.reshape(-1)
+    return data
+
+# Axis names in x, y, z order.
+AXES = ('x', 'y', 'z')
+
+class VirtualPopulationInfoError(ValueError):
+    """Raised when a line of a Virtual Population info file is malformed."""
+    def __init__(self, infoFile, lineNumber, line, reason):
+        self.infoFile = infoFile
+        self.lineNumber = lineNumber
+        self.line = line
+        self.reason = reason
+        super(VirtualPopulationInfoError, self).__init__(
+            "{0}:{1}: {2}: {3!r}".format(infoFile, lineNumber, reason, line))
 
 class VirtualPopulation(object):
     """Holds Virtual Population """
@@ -25,10 +71,12 @@ class VirtualPopulation(object):
         self._name = ''
         self._nx = 0; self._ny = 0; self._nz = 0
         self._dx = 0; self._dy = 0; self._dz = 0
-        self._materials = [[int('0'),
-                           'Free Space',
-                           float('0'), float('0'), float('0')]]
+        self._materials = MaterialTable()
         self._data = None
+        self._dataLoader = None
+        self._dataFile = None
+        self._runLength = None
+        self._statistics = None
 
     @property
     def name(self):
@@ -102,57 +150,440 @@ class VirtualPopulation(object):
 
     @property
     def data(self):
-        """Return the Raw Voxel Data"""
+        """Return the Raw Voxel Data, loading it first if it is deferred."""
+        if self._dataLoader is not None:
+            self._data = self._dataLoader()
+            self._dataLoader = None
+            self._dataFile = None
+            self._runLength = None
+            self._statistics = None
         return self._data
 
     @data.setter
     def data(self, value):
         """Set the raw voxel data."""
         self._data = value
+        self._dataLoader = None
+        self._dataFile = None
+        self._runLength = None
+        self._statistics = None
+
+    @property
+    def dataLoaded(self):
+        """Returns True unless loading of the voxel data is still deferred."""
+        return self._dataLoader is None
+
+    @property
+    def deferredDataFile(self):
+        """
+        Returns the file a deferred data loader will read, or None if the
+        data is loaded or does not come from a file.
+        """
+        return self._dataFile
+
+    def setDataLoader(self, loader, dataFile=None):
+        """
+        Defer loading of the voxel data: loader is called with no arguments
+        on the first access to data, and its result becomes the data.
+        dataFile optionally names the file the loader reads.
+        """
+        self._data = None
+        self._dataLoader = loader
+        self._dataFile = dataFile
+        self._runLength = None
+        self._statistics = None
+
+    @property
+    def materialStatistics(self):
+        """
+        Returns the MaterialStatistics (voxel count, bounding box and
+        centroid per material index) of the voxel data.
+
+        They are computed in one pass on first use and cached until data is
+        replaced.  Call invalidateStatistics after editing data in place.
+        A packed object (see packRunLength) computes them from its runs,
+        without decoding.
+        """
+        if self._statistics is None:
+            if self._runLength is not None:
+                self._statistics = self._runLength.materialStatistics(
+                    self.numMaterials)
+            else:
+                self._statistics = computeMaterialStatistics(
+                    self.array, self.numMaterials)
+        return self._statistics
+
+    def invalidateStatistics(self):
+        """Drop cached material statistics after data was edited in place."""
+        self._statistics = None
+
+    @property
+    def runLength(self):
+        """
+        Returns the run-length encoded voxel data if the object is packed
+        (see packRunLength), otherwise None.
+        """
+        return self._runLength
+
+    def packRunLength(self):
+        """
+        Replace the dense voxel data by a run-length encoding along x.
+
+        The encoding is returned and kept as runLength.  Sparse reads
+        through runLength, labelDtype, materialStatistics and
+        writeVirtualPopulation work on the runs, so memory stays
+        proportional to the number of runs.  Any dense access decodes the
+        whole volume back to a dense bytearray and drops the encoding: data
+        and array, and the operations built on them, such as subRegion,
+        resample, boundingBox and material relabelling.
+        """
+        runLength = RunLengthVoxelData.fromArray(self.array)
+        self.setDataLoader(runLength.toBytes)
+        self._runLength = runLength
+        return runLength
+
+    @property
+    def labelDtype(self):
+        """
+        Returns the numpy data type of the voxel labels: NARROW_LABEL
+        (uint8) or WIDE_LABEL (little endian uint16).  For raw buffers it
+        follows from the buffer size; without data it follows from the
+        number of materials.  A packed object is not decoded.
+        """
+        if self._runLength is not None:
+            return self._runLength.dtype
+        data = self.data
+        if data is None:
+            return labelDtypeFor(self.numMaterials)
+        if isinstance(data, numpy.ndarray):
+            return data.dtype
+        numVoxels = self._nx * self._ny * self._nz
+        if numVoxels and len(data) == WIDE_LABEL.itemsize * numVoxels:
+            return WIDE_LABEL
+        return NARROW_LABEL
+
+    def setLabelDtype(self, dtype):
+        """
+        Convert the voxel data to labels of the given data type.  Raises
+        ValueError if a label does not fit.
+        """
+        if self.labelDtype != numpy.dtype(dtype):
+            self.data = _convertLabels(self.array, dtype)
+
+    def narrowLabels(self):
+        """Convert wide voxel labels to uint8 if every material fits."""
+        if self.labelDtype != NARROW_LABEL and self.numMaterials <= 256:
+            self.setLabelDtype(NARROW_LABEL)
+
+    @property
+    def array(self):
+        """
+        Return a zero-copy (nz, ny, nx) numpy view of the voxel data, with
+        labelDtype as its data type.
+
+        The view shares memory with data, so writes through it modify the
+        voxel object.  Raises ValueError if the grid extents do not match
+        the size of data.
+        """
+        data = self.data
+        if data is None:
+            raise ValueError("Voxel object has no data.")
+        if isinstance(data, numpy.ndarray):
+            flat = data.reshape(-1)
+        else:
+            flat = numpy.frombuffer(data, dtype=self.labelDtype)
+        if flat.size != self._nx * self._ny * self._nz:
+            raise ValueError("Grid extents (" + str(self._nx) + ", " +
+                             str(self._ny) + ", " + str(self._nz) +
+                             ") do not match data size " + str(flat.size))
+        return flat.reshape(self._nz, self._ny, self._nx)
+
+    def _newGrid(self, shape, spacing, dtype=NARROW_LABEL):
+        """
+        Returns a new voxel object with this object's name and materials, a
+        zeroed (nz, ny, nx) grid of the given shape and label data type, and
+        the given (dx, dy, dz) spacing.
+        """
+        voxelModel = VirtualPopulation()
+        voxelModel.name = self._name
+        voxelModel._materials = self._materials.copy()
+        (voxelModel.nz, voxelModel.ny, voxelModel.nx) = shape
+        (voxelModel.dx, voxelModel.dy, voxelModel.dz) = spacing
+        voxelModel.data = bytearray(shape[0] * shape[1] * shape[2] *
+                                    numpy.dtype(dtype).itemsize)
+        return voxelModel
+
+    def _fromArray(self, array, spacing):
+        """
+        Returns a new voxel object with this object's name and materials,
+        the given (nz, ny, nx) array copied in one pass as its data, and the
+        given (dx, dy, dz) spacing.
+        """
+        voxelModel = self._newGrid(array.shape, spacing, array.dtype)
+        voxelModel.array[...] = array
+        return voxelModel
+
+    def resample(self, factors):
+        """
+        Returns a new voxel object whose spatial steps are multiplied by
+        factors, given as (fx, fy, fz) or one number for all axes.
+
+        Integer factors above 1 downsample by majority vote over blocks of
+        voxels; other factors (upsampling, non-integer) pick the nearest
+        voxel.  See resample.resampleLabels.
+        """
+        if isinstance(factors, (int, float)):
+            factors = (factors,) * 3
+        if min(factors) <= 0:
+            raise ValueError("Resampling factors must be positive.")
+        arrayFactors = tuple(reversed(factors))
+        shape = resampledShape((self._nz, self._ny, self._nx), arrayFactors)
+        spacing = [delta * factor for (delta, factor) in
+                   zip((self._dx, self._dy, self._dz), factors)]
+        voxels = self.array
+        voxelModel = self._newGrid(shape, spacing, voxels.dtype)
+        resampleLabels(voxels, arrayFactors, out=voxelModel.array)
+        return voxelModel
+
+    def subRegion(self, xRange=None, yRange=None, zRange=None):
+        """
+        Returns a new voxel object holding the sub-region given by
+        (start, stop) index ranges along x, y and z.  A range of None keeps
+        the whole axis.
+        """
+        slices = []
+        for (axis, n, bounds) in (('z', self._nz, zRange),
+                                  ('y', self._ny, yRange),
+                                  ('x', self._nx, xRange)):
+            (start, stop) = (0, n) if bounds is None else bounds
+            if not 0 <= start < stop <= n:
+                raise ValueError(axis + " range " + str(bounds) +
+                                 " is outside [0, " + str(n) + "]")
+            slices.append(slice(start, stop))
+        return self._fromArray(self.array[tuple(slices)],
+                               (self._dx, self._dy, self._dz))
+
+    def boundingBox(self):
+        """
+        Returns the tight ((x0, x1), (y0, y1), (z0, z1)) index ranges that
+        hold every voxel that is not Free Space, or None if there are none.
+        """
+        voxels = self.array
+        bounds = []
+        for reduceAxes in ((0, 1), (0, 2), (1, 2)):
+            occupied = numpy.flatnonzero(voxels.any(axis=reduceAxes))
+            if not occupied.size:
+                return None
+            bounds.append((int(occupied[0]), int(occupied[-1]) + 1))
+        return tuple(bounds)
+
+    def trimFreeSpace(self, padding=0):
+        """
+        Returns (voxelModel, offset): a new voxel object cropped to the
+        bounding box of all non Free Space voxels, grown by padding cells
+        (an int, or one int per x, y, z) and clipped to the grid, and the
+        (x, y, z) index of its first voxel in this object.
+        """
+        bounds = self.boundingBox()
+        if bounds is None:
+            raise ValueError("Voxel object holds only Free Space.")
+        if isinstance(padding, int):
+            padding = (padding,) * 3
+        (xRange, yRange, zRange) = [
+            (max(start - pad, 0), min(stop + pad, n))
+            for ((start, stop), pad, n) in
+            zip(bounds, padding, (self._nx, self._ny, self._nz))]
+        return (self.subRegion(xRange, yRange, zRange),
+                (xRange[0], yRange[0], zRange[0]))
+
+    def flip(self, axis):
+        """Returns a new voxel object mirrored along axis 'x', 'y' or 'z'."""
+        if axis not in AXES:
+            raise ValueError("axis must be one of " + str(AXES))
+        slices = [slice(None)] * 3
+        slices[2 - AXES.index(axis)] = slice(None, None, -1)
+        return self._fromArray(self.array[tuple(slices)],
+                               (self._dx, self._dy, self._dz))
+
+    def flipZ(self):
+        """Returns a new voxel object mirrored along z."""
+        return self.flip('z')
+
+    def permuteAxes(self, order):
+        """
+        Returns a new voxel object with its axes reordered.  order names the
+        old axis that becomes the new x, y and z, e.g. ('y', 'x', 'z') swaps
+        x and y.  Grid extents and spatial steps are permuted to match.
+        """
+        if sorted(order) != sorted(AXES):
+            raise ValueError("order must be a permutation of " + str(AXES))
+        spacing = (self._dx, self._dy, self._dz)
+        # array axes are (z, y, x), so both orders are reversed.
+        arrayOrder = [2 - AXES.index(axis) for axis in reversed(order)]
+        return self._fromArray(self.array.transpose(arrayOrder),
+                               [spacing[AXES.index(axis)] for axis in order])
 
     @property
     def numMaterials(self):
         """Returns the number of materials in voxel object."""
         return len(self._materials)
 
+    @property
+    def materials(self):
+        """Returns the MaterialTable of the voxel object."""
+        return self._materials
+
     def material(self, matNum):
-        """Returns the material at specified location."""
-        if (0 <= matNum) and (matNum < len(self._materials)):
-            return self._materials[matNum]
-        else:
-            print("Material index, ", matNum ,
-                  " is out of range.  Valid range is [0,",
-                  len(matNum)-1, ")")
+        """
+        Returns [number, name, red, green, blue] of the material at the
+        specified location.  Raises IndexError if it is out of range.
+        """
+        return self._materials.record(matNum)
+
+    def materialIndex(self, materialName):
+        """
+        Returns the number of the material with the given full name
+        ('Adult_male_1_34y/Heart_muscle') or short name ('Heart_muscle').
+        """
+        return self._materials.index(materialName)
 
     def appendMaterial(self, materialName, RGB_Red, RGB_Green, RGB_Blue):
         """
         Add a material to the end of the list with optional RGB color.
         """
-        
-        self._materials.append([self.numMaterials, materialName,
-                                RGB_Red, RGB_Green, RGB_Blue])
-
-    def removeMaterial(self, materialName ):
-        """Remove material with given name."""
-        matRemove = []
-        for matIndex in range(len(self._materials)):
-            if self._materials[matIndex][1] == materialName:
-                matRemove.append(matIndex)
-        for matIndex in matRemove:
-            del(self._materials[matIndex])
-        self._renumberMaterials()
-
-    def _renumberMaterials(self):
-        """Fix material numbering after removal."""
-        index = 0
-        for mat in self._materials:
-            mat[0] = index
-            index += 1
+        self._materials.append(materialName, RGB_Red, RGB_Green, RGB_Blue)
+
+    def _materialNumber(self, material):
+        """Returns the number of a material given by number or name."""
+        if isinstance(material, int):
+            if not 0 <= material < self.numMaterials:
+                raise IndexError("Material index " + str(material) +
+                                 " is out of range.")
+            return material
+        return self._materials.index(material)
+
+    def _relabelMaterials(self, order, mapping):
+        """
+        Rebuild the material table from the old material numbers in order
+        and relabel every voxel through a lookup table: a voxel of old
+        material m becomes material mapping[m].
+        """
+        self._materials.reorder(order)
+        if self._data is None and self._dataLoader is None:
+            return
+        voxels = self.array
+        lookupTable = numpy.arange(1 << (8 * voxels.dtype.itemsize),
+                                   dtype=voxels.dtype)
+        for (old, new) in mapping.items():
+            lookupTable[old] = new
+        # Relabel a slab of about a million voxels at a time, which bounds
+        # the intp index temporaries of the lookup.
+        step = max(1, (1 << 20) // max(1, self._nx * self._ny))
+        if not voxels.flags.writeable:
+            self.data = bytearray(voxels.nbytes)
+            relabelled = self.array
+            for z in range(0, self._nz, step):
+                numpy.take(lookupTable, voxels[z:z + step],
+                           out=relabelled[z:z + step])
+        else:
+            # Relabel in place.
+            for z in range(0, self._nz, step):
+                voxels[z:z + step] = lookupTable[voxels[z:z + step]]
+            self.invalidateStatistics()
+        self.narrowLabels()
 
-# Reader helper function
-def readVirtualPopulation(infoFile, dataFile):
+    def mergeMaterials(self, materialNames, target):
+        """
+        Merge materials into the target material: their voxels are
+        relabelled as target and they are removed from the material list.
+        Materials are given by number, full name or short name.
+        """
+        targetNumber = self._materialNumber(target)
+        sources = set(self._materialNumber(name) for name in materialNames)
+        sources.discard(targetNumber)
+        if 0 in sources:
+            raise ValueError("Free Space can not be merged or removed.")
+        order = [matNum for matNum in range(self.numMaterials)
+                 if matNum not in sources]
+        mapping = dict((old, new) for (new, old) in enumerate(order))
+        for source in sources:
+            mapping[source] = mapping[targetNumber]
+        self._relabelMaterials(order, mapping)
+
+    def removeMaterial(self, materialName, replacement=0):
+        """
+        Remove material with given name.  Its voxels become the replacement
+        material (default Free Space) and later materials move down, with
+        the voxel data relabelled to match.
+        """
+        self.mergeMaterials([materialName], replacement)
+
+    def reorderMaterials(self, order):
+        """
+        Reorder materials so that old material order[i] becomes material i,
+        relabelling the voxel data to match.  order must be a permutation of
+        all material numbers that keeps Free Space at 0.
+        """
+        if sorted(order) != list(range(self.numMaterials)) or order[0] != 0:
+            raise ValueError("order must be a permutation of all materials "
+                             "starting with 0 (Free Space).")
+        self._relabelMaterials(order, dict((old, new) for (new, old)
+                                           in enumerate(order)))
+
+# Metadata parser helper function
+def parseVirtualPopulationInfo(infoFile):
     """
-    Read Virtual Population info and data files and return a Virtual Population voxel object.
+    Parse a Virtual Population info (.txt) file in a single pass.
+
+    Each line is split into whitespace separated tokens and dispatched on the
+    first token: an integer starts a material line, nx/ny/nz/dx/dy/dz are
+    grid header entries, and anything else (blank lines, section titles) is
+    skipped.
+
+    Returns a tuple (materials, grid), where materials is a list of
+    (name, red, green, blue) tuples in file order and grid is a dict of the
+    GRID_KEYS entries found.  Raises VirtualPopulationInfoError for the
+    first malformed line.
+    """
+    materials = []
+    grid = {}
+    with open(infoFile, 'r') as fileHandle:
+        for (lineNumber, line) in enumerate(fileHandle, 1):
+            tokens = line.split(None, 4)
+            if not tokens:
+                continue
+            key = tokens[0]
+            if key.isdigit():
+                if len(tokens) != 5:
+                    raise VirtualPopulationInfoError(
+                        infoFile, lineNumber, line,
+                        "expected index, RGB color and material name")
+                try:
+                    rgb = [float(token) for token in tokens[1:4]]
+                except ValueError:
+                    raise VirtualPopulationInfoError(
+                        infoFile, lineNumber, line, "invalid RGB color")
+                materials.append((tokens[4].rstrip(),) + tuple(rgb))
+            elif key in GRID_KEYS:
+                if len(tokens) != 2:
+                    raise VirtualPopulationInfoError(
+                        infoFile, lineNumber, line,
+                        "expected a single value for " + key)
+                try:
+                    grid[key] = GRID_KEYS[key](tokens[1])
+                except ValueError:
+                    raise VirtualPopulationInfoError(
+                        infoFile, lineNumber, line, "invalid value for " + key)
+    return materials, grid
+
+# Metadata reader helper function
+def readVirtualPopulationInfo(infoFile):
+    """
+    Read a Virtual Population info file and return a Virtual Population
+    voxel object with its materials and grid, but no data.
+
+    Raises VirtualPopulationInfoError for a malformed line, and IOError if
+    the file can not be read.
     """
     voxelModel = VirtualPopulation()
     
@@ -164,115 +595,219 @@ def readVirtualPopulation(infoFile, dataFile):
     m = re.match(VOXEL_NAME_PROG, infoFileTail)
     voxelModel.name = m.group(1)
 
-    try:
-        fileHandle = open(infoFile, 'r')
-        for line in fileHandle:
-            m_mat = re.match(MAT_PROG, line)
-            m_nxyz = re.match(NXYZ_PROG, line)
-            m_dxyz = re.match(DXYZ_PROG, line)
-            if m_mat:
-                voxelModel.appendMaterial(m_mat.group(5),
-                                          float(m_mat.group(2)),
-                                          float(m_mat.group(3)),
-                                          float(m_mat.group(4)))
-            elif m_nxyz:
-                if m_nxyz.group(1) == "x":
-                    voxelModel.nx = int(m_nxyz.group(2))
-                elif m_nxyz.group(1) == "y":
-                    voxelModel.ny = int(m_nxyz.group(2))
-                elif m_nxyz.group(1) == "z":
-                    voxelModel.nz = int(m_nxyz.group(2))
-                else:
-                    print(m_nxyz.group(1), m_nxyz.group(2))
-            elif m_dxyz:
-                if m_dxyz.group(1) == "x":
-                    voxelModel.dx = float(m_dxyz.group(2))
-                elif m_dxyz.group(1) == "y":
-                    voxelModel.dy = float(m_dxyz.group(2))
-                elif m_dxyz.group(1) == "z":
-                    voxelModel.dz = float(m_dxyz.group(2))
-                else:
-                    print(m_dxyz.group(1), m_dxyz.group(2))
-        fileHandle.close()
+    with stage('read.info', numBytes=os.path.getsize(infoFile)):
+        materials, grid = parseVirtualPopulationInfo(infoFile)
+    for material in materials:
+        voxelModel.appendMaterial(*material)
+    for (key, value) in grid.items():
+        setattr(voxelModel, key, value)
 
-    except IOError as e:
-        print("I/O error({0}): {1}".format(e.errno, e.strerror))
-    except:
-        print("Unexpected error:", sys.exc_info()[0])
-        raise Exception("Unexpected Error.")    
+    return voxelModel
+
+# Memory-map modes accepted by readVirtualPopulation: read-only or
+# copy-on-write.  Writable maps are not offered so a model on disk can not
+# be modified by accident.
+MMAP_MODES = ('r', 'c')
+
+# Reader helper function
+def readVirtualPopulation(infoFile, dataFile, mmapMode=None, lazy=False,
+                          progress=None, cancel=None):
+    """
+    Read Virtual Population info and data files and return a Virtual Population voxel object.
+
+    If mmapMode is 'r' (read-only) or 'c' (copy-on-write), the data file is
+    memory-mapped instead of read, and data is a numpy.memmap of shape
+    (nz, ny, nx).  Pages are only loaded from disk when they are accessed.
+
+    If lazy is True, only the info file is read; the data file is read (or
+    mapped) the first time data is accessed.
+
+    Labels are read as uint8, or as little endian uint16 if the data file
+    holds two bytes per voxel.  Wide labels of a model with at most 256
+    materials are narrowed to uint8, unless the file is memory-mapped.
+
+    The data file is read in chunks.  progress(stage, done, total), if
+    given, is called with the number of bytes read after every chunk, and
+    the read raises OperationCancelled once the optional cancel token is
+    cancelled.
+    """
+    if mmapMode is not None and mmapMode not in MMAP_MODES:
+        raise ValueError("mmapMode must be one of " + str(MMAP_MODES))
+
+    voxelModel = readVirtualPopulationInfo(infoFile)
 
     # Load data file from .raw file
     if not os.path.isfile(dataFile):
         raise Exception("File name: ", dataFile, " does not exist.")
+    shape = (voxelModel.nz, voxelModel.ny, voxelModel.nx)
+    numMaterials = voxelModel.numMaterials
+    if lazy:
+        voxelModel.setDataLoader(
+            lambda: _readDataFile(dataFile, shape, mmapMode, numMaterials,
+                                  progress, cancel),
+            dataFile)
+    else:
+        voxelModel.data = _readDataFile(dataFile, shape, mmapMode,
+                                        numMaterials, progress, cancel)
+
+    return voxelModel
+
+def _readDataFile(dataFile, shape, mmapMode=None, numMaterials=0,
+                  progress=None, cancel=None):
+    """
+    Read or memory-map a Virtual Population data (.raw) file.
+    """
+    numVoxels = shape[0] * shape[1] * shape[2]
+    fileSize = os.path.getsize(dataFile)
+    dtype = WIDE_LABEL if numVoxels and \
+        fileSize == WIDE_LABEL.itemsize * numVoxels else NARROW_LABEL
+    if mmapMode is not None:
+        with stage('read.mmap', numVoxels, fileSize):
+            return numpy.memmap(dataFile, dtype=dtype, mode=mmapMode,
+                                shape=shape)
     try:
-        with open(dataFile, 'rb') as fileHandle:
-            voxelModel.data = bytearray(fileHandle.read())
+        # Read straight into a preallocated buffer to avoid a second copy.
+        chunkProgress = ChunkProgress('read.data', fileSize, progress, cancel)
+        with stage('read.data', numVoxels, fileSize), \
+             open(dataFile, 'rb') as fileHandle:
+            data = bytearray(fileSize)
+            dataView = memoryview(data)
+            for start in range(0, fileSize, IO_CHUNK_BYTES):
+                chunkProgress.check()
+                stop = min(start + IO_CHUNK_BYTES, fileSize)
+                fileHandle.readinto(dataView[start:stop])
+                chunkProgress.advance(stop - start)
+            dataView.release()
+        if dtype == WIDE_LABEL and numMaterials <= 256:
+            data = _convertLabels(numpy.frombuffer(data, dtype=dtype),
+                                  NARROW_LABEL)
+        return data
     except IOError as e:
-        print("I/O error({0}): {1}".format(e.errno, e.strerror))
+        logger.error("I/O error({0}): {1}".format(e.errno, e.strerror))
+    except OperationCancelled:
+        raise
     except:
-        print("Unexpected error:", sys_exc_info()[0])
+        logger.error("Unexpected error: %s", sys.exc_info()[0])
         raise Exception("Unexpected Error.")
 
-    return voxelModel
+# Metadata writer helper function
+def formatVirtualPopulationInfo(vpVoxel):
+    """
+    Returns the contents of the Virtual Population info (.txt) file for the
+    given voxel object.
+    """
+    materials = vpVoxel.materials
+    lines = []
+    # materials
+    for index in range(1, len(materials)):
+        (red, green, blue) = materials.color(index)
+        lines.append("{0}\t{1:.6f}\t{2:.6f}\t{3:.6f}\t{4}\n".format(
+            index, red, green, blue, materials.name(index)))
+    # grid extents
+    lines.append('\nGrid extent (number of cells)\n')
+    lines.extend(key + '\t' + str(getattr(vpVoxel, key)) + '\n'
+                 for key in ('nx', 'ny', 'nz'))
+    # spatial steps (resolution)
+    lines.append('\nSpatial steps [m]\n')
+    lines.extend(key + '\t' + str(getattr(vpVoxel, key)) + '\n'
+                 for key in ('dx', 'dy', 'dz'))
+    return ''.join(lines)
+
+def writeVirtualPopulationInfo(vpVoxel, fileNameInfo, sync=False):
+    """
+    Write the Virtual Population info (.txt) file for the given voxel object.
+
+    The contents are formatted first and written in one buffered write that
+    atomically replaces any previous file; if sync is True, the file is
+    fsynced before it replaces the previous one.  Returns 0 on success and
+    -1 if the file could not be written.
+    """
+    try:
+        contents = formatVirtualPopulationInfo(vpVoxel)
+        with atomicWrite(fileNameInfo, 'w', sync=sync) as fileHandle:
+            fileHandle.write(contents)
+        return 0
+    except IOError as e:
+        logger.error("I/O Error({0}): {1}".format(e.errno, e.strerror))
+        return -1
+    except:
+        logger.error("Unexpected error: %s", sys.exc_info()[0])
+        raise Exception("Unexpected Error.")
 
 # Writer helper function
-def writeVirtualPopulation(vpVoxel, filePath=os.getcwd()):
+def writeVirtualPopulation(vpVoxel, filePath=None, progress=None,
+                           cancel=None, preallocate=False, sync=False):
     """
     Write Virtual Population info and data files from given Virtual 
-    Population voxel object.
+    Population voxel object, to filePath (default: the current directory).
+
+    Labels are written as uint8 for up to 256 materials and as little endian
+    uint16 otherwise, converting the voxel data if needed.  Otherwise the
+    data is written straight from the voxel object's buffer or array,
+    without a copy; a run-length packed object is decoded one z-slice at a
+    time and stays packed.
+
+    Both files are written to partial files that atomically replace the
+    targets once complete, data first and info last; a failed, cancelled or
+    interrupted write leaves no truncated file behind.  If preallocate is
+    True, the data file space is reserved up front (os.posix_fallocate); if
+    sync is True, the files are fsynced before they replace the targets.
+
+    Returns 0 on success and -1 if a file could not be written; the info
+    file is only written once the data file is complete.
+
+    progress(stage, done, total), if given, is called with the number of
+    bytes written after every chunk, and the write raises
+    OperationCancelled once the optional cancel token is cancelled.
     """
+    if filePath is None:
+        filePath = os.getcwd()
     if not os.path.isdir(filePath):
-        print("Directory (", filePath, ") not found.")
+        logger.error("Directory (%s) not found.", filePath)
         return -1
     
     if not vpVoxel:
-        print("Voxel object not valid.")
+        logger.error("Voxel object not valid.")
         return -1
     else:
         fileNameInfo = os.path.realpath(filePath + sep + \
                                         vpVoxel.name + '.txt')
         fileNameData = os.path.realpath(filePath + sep + \
                                         vpVoxel.name + '.raw')
-        # Write metadata file
-        try:
-            fileHandle = open(fileNameInfo, 'w')
-            # write materials
-            for index in range(1,vpVoxel.numMaterials):
-                material = vpVoxel.material(index)
-                fileHandle.write(str(material[0]) + '\t' + \
-                                 "{0:.6f}".format(material[2]) + '\t' + \
-                                 "{0:.6f}".format(material[3]) + '\t' + \
-                                 "{0:.6f}".format(material[4]) + '\t' + \
-                                 material[1] + '\n')
-            # write grid extents
-            fileHandle.write('\nGrid extent (number of cells)\n')
-            fileHandle.write('nx\t' + str(vpVoxel.nx) + '\n')
-            fileHandle.write('ny\t' + str(vpVoxel.ny) + '\n')
-            fileHandle.write('nz\t' + str(vpVoxel.nz) + '\n')
-        
-            # write spatial steps (resolution)
-            fileHandle.write('\nSpatial steps [m]\n')
-            fileHandle.write('dx\t' + str(vpVoxel.dx) + '\n')
-            fileHandle.write('dy\t' + str(vpVoxel.dy) + '\n')
-            fileHandle.write('dz\t' + str(vpVoxel.dz) + '\n')
-            
-            fileHandle.close()
-        except IOError as e:
-            print("I/O Error({0}): {1}".format(e.errno, e.strerror))
-        except:
-            print("Unexpected error:", sys.exc_info()[0])
-            raise Exception("Unexpected Error.")
 
         # Write binary data file
-
         try:
-            fileHandle = open(fileNameData, 'wb')
-            fileHandle.write(vpVoxel.data)
-            fileHandle.close()
+            dtype = labelDtypeFor(vpVoxel.numMaterials)
+            runLength = vpVoxel.runLength
+            if runLength is not None and runLength.dtype == dtype:
+                # A packed model is written one decoded z-slice at a time.
+                chunks = (runLength.readSlice(z) for z in range(vpVoxel.nz))
+                numBytes = vpVoxel.nx * vpVoxel.ny * vpVoxel.nz * \
+                           dtype.itemsize
+            else:
+                data = vpVoxel.data
+                if vpVoxel.labelDtype != dtype:
+                    data = _convertLabels(vpVoxel.array, dtype)
+                with byteView(data) as view:
+                    numBytes = view.nbytes
+                chunks = [data]
+            chunkProgress = ChunkProgress('write.data', numBytes, progress,
+                                          cancel)
+            with stage('write.data', numBytes // dtype.itemsize, numBytes), \
+                 atomicWrite(fileNameData, 'wb',
+                             numBytes if preallocate else None,
+                             sync) as fileHandle:
+                for chunk in chunks:
+                    writeBuffer(fileHandle, chunk, chunkProgress)
         except IOError as e:
-            print("I/O Error({0}): {1}".format(e.errno, e.strerror))
+            logger.error("I/O Error({0}): {1}".format(e.errno, e.strerror))
+            return -1
+        except OperationCancelled:
+            raise
         except:
-            print("Unexpected error:", sys.exc_info()[0])
+            logger.error("Unexpected error: %s", sys.exc_info()[0])
             raise Exception("Unexpected Error.")
 
-    return 0
+        # Write metadata file
+        with stage('write.info'):
+            return writeVirtualPopulationInfo(vpVoxel, fileNameInfo, sync)